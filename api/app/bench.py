@@ -0,0 +1,335 @@
+"""Ad-hoc benchmarks against a real database (DATABASE_URL).
+
+    python bench.py allocation --parallel 50
+    python bench.py geojson --features 10000
+    python bench.py product-queries --sizes 10 1000
+
+Each benchmark creates its own fixture rows and removes them afterwards. Requests
+beyond the connection pool size queue for a connection, as they would under uvicorn.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import event, func, insert, text
+from db import SessionLocal, engine
+from models import (
+    ActiveSubstance,
+    CadastreCF,
+    Parcel,
+    ChemProduct,
+    InventoryLocation,
+    ProductActive,
+    StockLot,
+    InventoryTxn,
+)
+from schemas import ApplicationCreate, ApplicationItemIn
+from services import lot_balances, parcel_geometry
+from services.pagination import PageParams, keyset
+
+
+def bench_allocation(args) -> int:
+    """Post N applications for the same product concurrently and check the stock math."""
+    tag = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    try:
+        cf = CadastreCF(cf_number=f"bench-{tag}")
+        db.add(cf)
+        db.flush()
+        parcel = Parcel(cf_id=cf.id, name=f"bench {tag}", status="active")
+        product = ChemProduct(trade_name=f"Bench {tag}", trade_name_norm=f"bench{tag}", product_type="herbicide")
+        location = InventoryLocation(name=f"bench-{tag}")
+        db.add_all([parcel, product, location])
+        db.flush()
+        lot_ids = []
+        # Several small lots so every application has to split across lots.
+        for i in range(args.lots):
+            lot = StockLot(
+                product_id=product.id,
+                location_id=location.id,
+                lot_code=f"B{tag}-{i}",
+                received_date=date(2024, 1, 1),
+                uom="l",
+                unit_price=10.0,
+            )
+            db.add(lot)
+            db.flush()
+            db.add(InventoryTxn(lot_id=lot.id, movement="in", qty=args.lot_qty, uom="l", date=date(2024, 1, 1)))
+            lot_ids.append(lot.id)
+        db.commit()
+        parcel_id, product_id, location_id, cf_id = parcel.id, product.id, location.id, cf.id
+    finally:
+        db.close()
+
+    from routers.applications import create_application
+
+    payload = ApplicationCreate(
+        parcel_id=parcel_id,
+        date=date.today(),
+        area_ha=args.area_ha,
+        items=[ApplicationItemIn(product_id=product_id, dose_per_ha=args.dose, uom="L/ha")],
+    )
+
+    def post_one(_):
+        session = SessionLocal()
+        started = time.perf_counter()
+        try:
+            create_application(payload=payload, db=session, user=None)
+            return True, time.perf_counter() - started
+        except HTTPException:
+            return False, time.perf_counter() - started
+        finally:
+            session.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.parallel) as pool:
+        results = list(pool.map(post_one, range(args.parallel)))
+    elapsed = time.perf_counter() - started
+
+    ok = sum(1 for r, _ in results if r)
+    latencies = sorted(t for _, t in results)
+    total_stock = args.lots * args.lot_qty
+    per_app = args.dose * args.area_ha
+    expected_ok = min(args.parallel, int(total_stock // per_app))
+
+    db = SessionLocal()
+    try:
+        balances = db.execute(
+            text("SELECT lot_id, qty FROM lot_balances WHERE lot_id = ANY(:ids)"), {"ids": lot_ids}
+        ).all()
+        mismatches = [m for m in lot_balances.verify_lot_balances(db) if m["lot_id"] in lot_ids]
+        remaining = sum(float(q) for _, q in balances)
+        negative = [lot_id for lot_id, q in balances if q < -1e-9]
+
+        print(f"applications posted: {ok}/{args.parallel} (expected {expected_ok})")
+        print(f"wall time: {elapsed:.3f}s, throughput: {args.parallel / elapsed:.1f} req/s")
+        print(f"latency p50: {latencies[len(latencies) // 2] * 1000:.1f} ms, max: {latencies[-1] * 1000:.1f} ms")
+        print(f"stock remaining: {remaining:.3f} l (expected {total_stock - ok * per_app:.3f} l)")
+        print(f"negative lots: {negative or 'none'}, balance mismatches: {mismatches or 'none'}")
+
+        _cleanup_allocation(db, parcel_id, product_id, location_id, cf_id)
+        db.commit()
+    finally:
+        db.close()
+    return 0 if ok == expected_ok and not negative and not mismatches else 1
+
+
+def _cleanup_allocation(db, parcel_id: int, product_id: int, location_id: int, cf_id: int) -> None:
+    params = {"parcel_id": parcel_id, "product_id": product_id, "location_id": location_id, "cf_id": cf_id}
+    db.execute(
+        text(
+            "DELETE FROM application_items WHERE application_id IN "
+            "(SELECT id FROM applications WHERE parcel_id = :parcel_id)"
+        ),
+        params,
+    )
+    db.execute(text("DELETE FROM applications WHERE parcel_id = :parcel_id"), params)
+    db.execute(
+        text("DELETE FROM inventory_txns WHERE lot_id IN (SELECT id FROM stock_lots WHERE product_id = :product_id)"),
+        params,
+    )
+    db.execute(text("DELETE FROM stock_lots WHERE product_id = :product_id"), params)
+    db.execute(text("DELETE FROM chem_products WHERE id = :product_id"), params)
+    db.execute(text("DELETE FROM inventory_locations WHERE id = :location_id"), params)
+    db.execute(text("DELETE FROM parcels WHERE id = :parcel_id"), params)
+    db.execute(text("DELETE FROM cadastre_cf WHERE id = :cf_id"), params)
+
+
+def bench_geojson(args) -> int:
+    """Full-resolution parcel page: Python-built FeatureCollection vs json_agg vs the streamed response."""
+    from routers.parcels import FEATURE_COLUMNS, _feature_collection_json, _parcel_query, _stream_feature_collection
+
+    tag = uuid.uuid4().hex[:8]
+    side = int(args.features ** 0.5) + 1
+    step = 0.002
+    # A grid well outside Romania so the bbox only matches fixture parcels.
+    envelope = (10.0 - step, 60.0 - step, 10.0 + side * step, 60.0 + side * step)
+    db = SessionLocal()
+    try:
+        cf = CadastreCF(cf_number=f"bench-{tag}")
+        db.add(cf)
+        db.flush()
+        cf_id = cf.id
+        db.execute(
+            text(
+                """
+                INSERT INTO parcels (cf_id, name, status, area_m2, geom)
+                SELECT :cf_id, 'bench ' || :tag || ' ' || g, 'active', 5000,
+                       ST_Buffer(ST_SetSRID(ST_MakePoint(10.0 + (g % :side) * :step,
+                                                         60.0 + (g / :side) * :step), 4326)::geography,
+                                 40, :segments)
+                FROM generate_series(0, :n - 1) g
+                """
+            ),
+            {"cf_id": cf_id, "tag": tag, "side": side, "step": step, "segments": args.segments, "n": args.features},
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    page = PageParams(cursor=None, limit=args.features, with_total=False)
+
+    def python_path(session):
+        # The per-feature json.loads the endpoint used to do, kept as the baseline.
+        query = _parcel_query(
+            session, envelope, None, *FEATURE_COLUMNS, func.ST_AsGeoJSON(Parcel.geom).label("geojson")
+        )
+        features = [
+            {
+                "type": "Feature",
+                "bbox": parcel_geometry.feature_bbox(row),
+                "geometry": json.loads(row.geojson) if row.geojson else None,
+                "properties": {c.key: getattr(row, c.key) for c in FEATURE_COLUMNS[:7]},
+            }
+            for row in keyset(query, [Parcel.id], page).all()[: page.limit]
+        ]
+        result = {"type": "FeatureCollection", "features": features, "next": None, "total": None, "total_exact": None}
+        return JSONResponse(jsonable_encoder(result)).body
+
+    def database_path(session):
+        return _feature_collection_json(session, envelope, Parcel.geom, None, page)
+
+    def stream_path(session):
+        return b"".join(_stream_feature_collection(session, envelope, None, page))
+
+    status = 0
+    session = SessionLocal()
+    try:
+        for name, build in (("python", python_path), ("json_agg", database_path), ("stream", stream_path)):
+            build(session)  # warm-up
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                body = build(session)
+                timings.append(time.perf_counter() - started)
+            tracemalloc.start()
+            build(session)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            count = len(json.loads(body)["features"])
+            if count != args.features:
+                status = 1
+            timings.sort()
+            print(
+                f"{name:>8}: {count} features, {len(body) / 1e6:.1f} MB, "
+                f"p50 {timings[len(timings) // 2] * 1000:.0f} ms, min {timings[0] * 1000:.0f} ms, "
+                f"peak python memory {peak / 1e6:.1f} MB"
+            )
+        session.rollback()
+        session.execute(text("DELETE FROM parcels WHERE cf_id = :cf_id"), {"cf_id": cf_id})
+        session.execute(text("DELETE FROM cadastre_cf WHERE id = :cf_id"), {"cf_id": cf_id})
+        session.commit()
+    finally:
+        session.close()
+    return status
+
+
+def bench_product_queries(args) -> int:
+    """Statements issued by the product listings must not grow with the number of products."""
+    from routers.inventory import list_inventory, list_products
+
+    def count_statements(call) -> int:
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", record)
+        session = SessionLocal()
+        try:
+            call(session)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+            session.close()
+        return len(statements)
+
+    endpoints = {
+        "list_products": lambda session: list_products(product_type=None, db=session, user=None),
+        "list_inventory(kind=chem)": lambda session: list_inventory(item_type=None, kind="chem", db=session, user=None),
+    }
+    counts = {name: [] for name in endpoints}
+    tag = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    try:
+        active_ids = db.execute(
+            insert(ActiveSubstance).returning(ActiveSubstance.id, sort_by_parameter_order=True),
+            [{"name": f"Bench {tag} {i}", "name_norm": f"bench{tag}{i}"} for i in range(2)],
+        ).scalars().all()
+        created = 0
+        for size in sorted(args.sizes):
+            if size > created:
+                product_ids = db.execute(
+                    insert(ChemProduct).returning(ChemProduct.id, sort_by_parameter_order=True),
+                    [
+                        {"trade_name": f"Bench {tag} {i}", "trade_name_norm": f"bench{tag}{i}", "product_type": "herbicide"}
+                        for i in range(created, size)
+                    ],
+                ).scalars().all()
+                db.execute(
+                    insert(ProductActive),
+                    [
+                        {"product_id": pid, "active_id": aid, "concentration": 100.0, "unit": "g/l"}
+                        for pid in product_ids
+                        for aid in active_ids
+                    ],
+                )
+                db.commit()
+                created = size
+            for name, call in endpoints.items():
+                counts[name].append(count_statements(call))
+            print(f"{size} bench products: " + ", ".join(f"{n}={c[-1]}" for n, c in counts.items()))
+    finally:
+        db.rollback()
+        db.execute(
+            text(
+                "DELETE FROM product_actives WHERE product_id IN "
+                "(SELECT id FROM chem_products WHERE trade_name_norm LIKE :prefix)"
+            ),
+            {"prefix": f"bench{tag}%"},
+        )
+        db.execute(text("DELETE FROM chem_products WHERE trade_name_norm LIKE :prefix"), {"prefix": f"bench{tag}%"})
+        db.execute(text("DELETE FROM active_substances WHERE name_norm LIKE :prefix"), {"prefix": f"bench{tag}%"})
+        db.commit()
+        db.close()
+
+    growing = [name for name, c in counts.items() if len(set(c)) > 1]
+    for name in growing:
+        print(f"{name}: statement count depends on the number of products ({counts[name]})")
+    return 1 if growing else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Agri API benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    alloc = sub.add_parser("allocation", help="concurrent application posting for one product")
+    alloc.add_argument("--parallel", type=int, default=50)
+    alloc.add_argument("--lots", type=int, default=20)
+    alloc.add_argument("--lot-qty", type=float, default=100.0)
+    alloc.add_argument("--area-ha", type=float, default=10.0)
+    alloc.add_argument("--dose", type=float, default=3.0)
+    alloc.set_defaults(func=bench_allocation)
+
+    geojson = sub.add_parser("geojson", help="parcel FeatureCollection built in Python vs in PostGIS (aggregated or streamed)")
+    geojson.add_argument("--features", type=int, default=10000)
+    geojson.add_argument("--segments", type=int, default=8, help="ST_Buffer quarter-circle segments per parcel")
+    geojson.add_argument("--repeat", type=int, default=5)
+    geojson.set_defaults(func=bench_geojson)
+
+    products = sub.add_parser("product-queries", help="check that product listings run a fixed number of queries")
+    products.add_argument("--sizes", type=int, nargs="+", default=[10, 1000])
+    products.set_defaults(func=bench_product_queries)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,7 +6,14 @@ from db import engine
 from models import Base
 from routers import auth, cf, parcels, works, inventory, harvests, soil, catalog, raster, applications, reports
 from services.inventory_views import ensure_inventory_views
-from services.db_migrate import ensure_schema_extensions
+from services.lot_balances import ensure_lot_balances
+from services.stock_snapshots import ensure_stock_snapshots
+from services.active_stock import ensure_active_stock
+from services.change_tracking import ensure_change_tracking
+from services.cost_ledger import ensure_cost_ledger
+from services.parcel_geometry import ensure_parcel_geometry
+from services.parcel_search import ensure_parcel_search
+from services.db_migrate import ensure_schema_extensions, ensure_indexes
 
 app = FastAPI(title="Agri API")
 
@@ -47,6 +54,14 @@ def on_startup():
     _wait_for_db()
     ensure_schema_extensions(engine)
     Base.metadata.create_all(bind=engine)
+    ensure_indexes(engine)
+    ensure_parcel_geometry(engine)
+    ensure_parcel_search(engine)
+    ensure_change_tracking(engine)
+    ensure_lot_balances(engine)
+    ensure_stock_snapshots(engine)
+    ensure_active_stock(engine)
+    ensure_cost_ledger(engine)
     ensure_inventory_views(engine)
     if os.getenv("AUTO_SEED") == "1":
         from seed import seed_all
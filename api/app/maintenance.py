@@ -0,0 +1,192 @@
+import argparse
+import json
+import sys
+from datetime import date
+from db import SessionLocal
+from services import lot_balances, stock_snapshots, active_stock, cost_ledger, parcel_geometry, cf_import, parcel_measure
+
+
+def rebuild_balances(args) -> int:
+    db = SessionLocal()
+    try:
+        count = lot_balances.rebuild_lot_balances(db)
+        db.commit()
+        print(f"Rebuilt balances for {count} lots")
+        return 0
+    finally:
+        db.close()
+
+
+def verify_balances(args) -> int:
+    db = SessionLocal()
+    try:
+        mismatches = lot_balances.verify_lot_balances(db)
+    finally:
+        db.close()
+    for m in mismatches:
+        print(f"lot {m['lot_id']}: stored={m['stored_qty']} expected={m['expected_qty']}")
+    if mismatches:
+        print(f"{len(mismatches)} lot balances differ from inventory_txns")
+        return 1
+    print("Lot balances OK")
+    return 0
+
+
+def snapshot_stock(args) -> int:
+    db = SessionLocal()
+    try:
+        if args.as_of:
+            written = [stock_snapshots.write_snapshot(db, args.as_of)]
+            db.commit()
+        else:
+            written = stock_snapshots.ensure_checkpoints(db, period=args.period)
+    finally:
+        db.close()
+    for s in written:
+        print(f"snapshot {s['as_of']}: {s['lots']} lots")
+    print(f"{len(written)} snapshots written")
+    return 0
+
+
+def rebuild_active_stock(args) -> int:
+    db = SessionLocal()
+    try:
+        count = active_stock.rebuild_active_stock(db)
+        db.commit()
+        print(f"Rebuilt active stock for {count} lot/active pairs")
+        return 0
+    finally:
+        db.close()
+
+
+def verify_active_stock(args) -> int:
+    db = SessionLocal()
+    try:
+        mismatches = active_stock.verify_active_stock(db)
+    finally:
+        db.close()
+    for m in mismatches:
+        print(f"active {m['active_id']}: stored={m['stored_kg']} expected={m['expected_kg']}")
+    if mismatches:
+        print(f"{len(mismatches)} active totals differ from active_stock_lots")
+        return 1
+    print("Active stock totals OK")
+    return 0
+
+
+def rebuild_costs(args) -> int:
+    db = SessionLocal()
+    try:
+        count = cost_ledger.rebuild_cost_ledger(db)
+        db.commit()
+        print(f"Rebuilt cost ledger: {count} parcel/season/category rows")
+        return 0
+    finally:
+        db.close()
+
+
+def explain_parcels(args) -> int:
+    db = SessionLocal()
+    try:
+        from routers.parcels import explain_list
+
+        result = explain_list(
+            db, parcel_geometry.parse_bbox(args.bbox), zoom=args.zoom, search=args.search,
+            limit=args.limit, analyze=args.analyze,
+        )
+        db.rollback()
+    finally:
+        db.close()
+    plan = result["plan"][0]
+    print(json.dumps(plan, indent=2, default=str))
+    if not result["uses_index"]:
+        print(f"Viewport query does not use {parcel_geometry.BBOX_INDEX}")
+        return 1
+    print(f"Viewport query uses {parcel_geometry.BBOX_INDEX}")
+    return 0
+
+
+def import_cf(args) -> int:
+    with open(args.path, "rb") as fh:
+        df = cf_import.read_points(fh.read(), args.path)
+
+    def progress(phase: str, done: int, total: int) -> None:
+        print(f"{phase}: {done}/{total}", flush=True)
+
+    db = SessionLocal()
+    try:
+        result = cf_import.import_cf_points(db, df, progress=progress, allow_overlap=args.allow_overlap)
+        if args.dry_run:
+            db.rollback()
+        else:
+            db.commit()
+    except cf_import.ImportFormatError as exc:
+        print(exc)
+        return 1
+    finally:
+        db.close()
+    for err in result["errors"]:
+        print(f"CF {err['cf_number']}: {err['error']}")
+    print(f"{result['imported']} parcels from {result['rows']} points, {len(result['errors'])} errors")
+    return 0
+
+
+def remeasure_parcels(args) -> int:
+    def progress(done: int, total: int) -> None:
+        print(f"parcels: {done}/{total}", flush=True)
+
+    db = SessionLocal()
+    try:
+        result = parcel_measure.remeasure_parcels(db, chunk=args.chunk, dry_run=args.dry_run, progress=progress)
+    finally:
+        db.close()
+    for failed in result["failed"]:
+        print(f"parcel {failed['id']}: cannot be repaired ({failed['reason']})")
+    verb = "would be" if args.dry_run else "were"
+    print(
+        f"{result['parcels']} parcels checked: {result['repaired']} {verb} repaired, "
+        f"{result['remeasured']} {verb} re-measured, {len(result['failed'])} failed"
+    )
+    return 1 if result["failed"] else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Agri API maintenance tasks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild-balances", help="recompute lot_balances from inventory_txns").set_defaults(func=rebuild_balances)
+    sub.add_parser("verify-balances", help="compare lot_balances with inventory_txns").set_defaults(func=verify_balances)
+    sub.add_parser("rebuild-active-stock", help="recompute active_stock_lots/totals from lot_balances").set_defaults(
+        func=rebuild_active_stock
+    )
+    sub.add_parser("verify-active-stock", help="compare active_stock_totals with active_stock_lots").set_defaults(
+        func=verify_active_stock
+    )
+    sub.add_parser("rebuild-cost-ledger", help="recompute cost_ledger from works and applications").set_defaults(
+        func=rebuild_costs
+    )
+    explain = sub.add_parser("explain-parcels", help="check that GET /parcels uses the GiST index (run on production-size data)")
+    explain.add_argument("--bbox", required=True, help="minx,miny,maxx,maxy of a real map viewport")
+    explain.add_argument("--zoom", type=int, default=None, help="map zoom; < 13 explains the simplified-band query")
+    explain.add_argument("--search", default=None)
+    explain.add_argument("--limit", type=int, default=200)
+    explain.add_argument("--analyze", action="store_true", help="run EXPLAIN ANALYZE for actual timings")
+    explain.set_defaults(func=explain_parcels)
+    imp = sub.add_parser("import-cf", help="bulk import a CF_Points sheet (CSV/XLSX) with progress")
+    imp.add_argument("path")
+    imp.add_argument("--dry-run", action="store_true", help="validate and build geometries, then roll back")
+    imp.add_argument("--allow-overlap", action="store_true", help="import CFs that overlap existing parcels")
+    imp.set_defaults(func=import_cf)
+    remeasure = sub.add_parser("remeasure-parcels", help="repair invalid parcel geometries and recompute area_m2")
+    remeasure.add_argument("--chunk", type=int, default=parcel_measure.CHUNK)
+    remeasure.add_argument("--dry-run", action="store_true", help="only report what would change")
+    remeasure.set_defaults(func=remeasure_parcels)
+    snap = sub.add_parser("snapshot-stock", help="write stock snapshots for closed periods (or one date)")
+    snap.add_argument("--as-of", type=date.fromisoformat, default=None)
+    snap.add_argument("--period", choices=sorted(stock_snapshots.SNAPSHOT_PERIODS), default=stock_snapshots.SNAPSHOT_PERIOD)
+    snap.set_defaults(func=snapshot_stock)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
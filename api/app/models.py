@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Text, ForeignKey, Enum, UniqueConstraint, Index
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Text, BigInteger, ForeignKey, Enum, UniqueConstraint, Index
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship
-from geoalchemy2 import Geography
+from geoalchemy2 import Geography, Geometry
 from datetime import datetime
 from db import Base
 
@@ -35,6 +35,14 @@ class Parcel(Base):
     geom = Column(Geography("POLYGON", srid=4326))
     culture = Column(String)
     status = Column(String)
+    # Derived from geom by trg_parcel_geometry_derive; never written by the app.
+    geom_z9 = Column(Geometry("GEOMETRY", srid=4326, spatial_index=False))
+    geom_z12 = Column(Geometry("GEOMETRY", srid=4326, spatial_index=False))
+    centroid = Column(Geometry("POINT", srid=4326, spatial_index=False))
+    bbox_min_lon = Column(Float)
+    bbox_min_lat = Column(Float)
+    bbox_max_lon = Column(Float)
+    bbox_max_lat = Column(Float)
 
     cf = relationship("CadastreCF", back_populates="parcels")
     works = relationship("Work", back_populates="parcel", cascade="all, delete")
@@ -77,6 +85,10 @@ class Work(Base):
 
     parcel = relationship("Parcel", back_populates="works")
 
+    __table_args__ = (
+        Index("ix_works_parcel_date", "parcel_id", "date", "id"),
+    )
+
 
 class Chemical(Base):
     __tablename__ = "chemicals"
@@ -185,6 +197,7 @@ class InventoryTxn(Base):
     date = Column(Date, nullable=False)
     reason = Column(String)
     ref_type = Column(String)
+    ref_id = Column(Integer)
     created_by = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
     doc_id = Column(Integer, ForeignKey("docs.id"))
@@ -194,6 +207,59 @@ class InventoryTxn(Base):
     lot = relationship("StockLot", back_populates="txns")
     doc = relationship("Doc")
 
+    __table_args__ = (
+        Index("ix_inventory_txns_lot", "lot_id", "id"),
+        Index("ix_inventory_txns_date", "date", "id"),
+    )
+
+
+class LotBalance(Base):
+    __tablename__ = "lot_balances"
+
+    lot_id = Column(Integer, ForeignKey("stock_lots.id", ondelete="CASCADE"), primary_key=True)
+    qty = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ActiveStockLot(Base):
+    __tablename__ = "active_stock_lots"
+
+    lot_id = Column(Integer, ForeignKey("stock_lots.id", ondelete="CASCADE"), primary_key=True)
+    active_id = Column(Integer, ForeignKey("active_substances.id", ondelete="CASCADE"), primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("chem_products.id", ondelete="CASCADE"), nullable=False)
+    lot_qty = Column(Float, nullable=False)
+    active_kg = Column(Float)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ActiveStockTotal(Base):
+    __tablename__ = "active_stock_totals"
+
+    active_id = Column(Integer, ForeignKey("active_substances.id", ondelete="CASCADE"), primary_key=True)
+    total_kg = Column(Float, nullable=False, default=0)
+    lot_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class StockSnapshot(Base):
+    __tablename__ = "stock_snapshots"
+
+    id = Column(Integer, primary_key=True)
+    as_of = Column(Date, nullable=False, unique=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    lots = relationship("StockSnapshotLot", back_populates="snapshot", cascade="all, delete")
+
+
+class StockSnapshotLot(Base):
+    __tablename__ = "stock_snapshot_lots"
+
+    snapshot_id = Column(Integer, ForeignKey("stock_snapshots.id", ondelete="CASCADE"), primary_key=True)
+    lot_id = Column(Integer, ForeignKey("stock_lots.id", ondelete="CASCADE"), primary_key=True)
+    qty = Column(Float, nullable=False)
+
+    snapshot = relationship("StockSnapshot", back_populates="lots")
+
 
 class TankMix(Base):
     __tablename__ = "tank_mixes"
@@ -241,12 +307,17 @@ class Application(Base):
 
     items = relationship("ApplicationItem", back_populates="application", cascade="all, delete")
 
+    __table_args__ = (
+        Index("ix_applications_date", "date", "id"),
+        Index("ix_applications_parcel_date", "parcel_id", "date", "id"),
+    )
+
 
 class ApplicationItem(Base):
     __tablename__ = "application_items"
 
     id = Column(Integer, primary_key=True)
-    application_id = Column(Integer, ForeignKey("applications.id"), nullable=False)
+    application_id = Column(Integer, ForeignKey("applications.id"), nullable=False, index=True)
     product_id = Column(Integer, ForeignKey("chem_products.id"), nullable=False)
     applied_qty = Column(Float, nullable=False)
     uom = Column(String, nullable=False)
@@ -309,6 +380,11 @@ class Harvest(Base):
     parcel = relationship("Parcel", back_populates="harvests")
     tickets = relationship("HarvestTicket", back_populates="harvest", cascade="all, delete")
 
+    __table_args__ = (
+        Index("ix_harvests_date", "date", "id"),
+        Index("ix_harvests_parcel_date", "parcel_id", "date", "id"),
+    )
+
 
 class HarvestTicket(Base):
     __tablename__ = "harvest_tickets"
@@ -343,6 +419,11 @@ class SoilAnalysis(Base):
     parcel = relationship("Parcel", back_populates="soils")
     doc = relationship("Doc")
 
+    __table_args__ = (
+        Index("ix_soil_analyses_date", "date", "id"),
+        Index("ix_soil_analyses_parcel_date", "parcel_id", "date", "id"),
+    )
+
 
 class RasterAsset(Base):
     __tablename__ = "raster_assets"
@@ -407,6 +488,29 @@ class VarietyCatalog(Base):
     active = Column(Integer, default=1)
 
 
+class CostLedger(Base):
+    __tablename__ = "cost_ledger"
+
+    parcel_id = Column(Integer, ForeignKey("parcels.id", ondelete="CASCADE"), primary_key=True)
+    season = Column(Integer, primary_key=True)
+    category = Column(String, primary_key=True)
+    amount = Column(Float, nullable=False, default=0)
+    entries = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_cost_ledger_season", "season", "parcel_id"),
+    )
+
+
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+
+    table_name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
+
 class ChemMixRule(Base):
     __tablename__ = "chem_mix_rules"
 
@@ -1,19 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import insert, text
 from datetime import date
 from db import get_db
 from models import (
+    Parcel,
     TankMix,
     TankMixItem,
     Application,
     ApplicationItem,
-    InventoryTxn,
-    StockLot,
-    ChemProduct,
 )
-from schemas import MixCreate, ApplicationCreate
+from schemas import MixCreate, ApplicationCreate, ApplicationBatchCreate, ApplicationPreviewRequest
 from security import get_current_user
+from services import stock_allocation, tank_mixes
+from services.pagination import PageParams, page_params, decode_cursor, page_of_rows, sql_total
 
 router = APIRouter(tags=["applications"])
 
@@ -48,58 +48,56 @@ def create_mix(payload: MixCreate, db: Session = Depends(get_db), user=Depends(g
         )
 
     db.commit()
+    tank_mixes.invalidate()
     return {"id": mix.id}
 
 
 @router.get("/mix")
 def list_mix(db: Session = Depends(get_db), user=Depends(get_current_user)):
-    mixes = db.query(TankMix).order_by(TankMix.created_at.desc()).all()
-    result = []
-    for m in mixes:
-        items = (
-            db.query(TankMixItem)
-            .filter(TankMixItem.mix_id == m.id)
-            .all()
-        )
-        result.append(
-            {
-                "id": m.id,
-                "name": m.name,
-                "water_ph": m.water_ph,
-                "water_hardness_ppm": m.water_hardness_ppm,
-                "notes": m.notes,
-                "items": [
-                    {
-                        "product_id": i.product_id,
-                        "dose_per_ha": i.dose_per_ha,
-                        "uom": i.uom,
-                    }
-                    for i in items
-                ],
-            }
-        )
-    return result
+    return tank_mixes.list_mixes(db)
 
 
 @router.get("/applications")
 def list_applications(
     parcel_id: int = Query(None),
+    date_from: date = Query(None),
+    date_to: date = Query(None),
+    page: PageParams = Depends(page_params),
     db: Session = Depends(get_db),
     user=Depends(get_current_user),
 ):
-    query = db.query(Application)
+    where = []
+    params = {"limit": page.limit + 1}
     if parcel_id:
-        query = query.filter(Application.parcel_id == parcel_id)
-    return query.order_by(Application.date.desc()).all()
+        where.append("a.parcel_id = :parcel_id")
+        params["parcel_id"] = parcel_id
+    if date_from:
+        where.append("a.date >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        where.append("a.date <= :date_to")
+        params["date_to"] = date_to
+    total = None
+    if page.with_total:
+        count_sql = "SELECT 1 FROM applications a" + (" WHERE " + " AND ".join(where) if where else "")
+        total = sql_total(db, count_sql, params, page.total_mode)
+    if page.cursor:
+        params["cursor_date"], params["cursor_id"] = decode_cursor(page.cursor, 2)
+        where.append("(a.date, a.id) < (:cursor_date, :cursor_id)")
+    rows = _applications_with_items(db, where, params, "ORDER BY a.date DESC, a.id DESC LIMIT :limit")
+    return page_of_rows(rows, ["date", "id"], page, total)
 
 
 @router.get("/inventory/applications")
 def list_inventory_applications(
     parcel_id: int = Query(None),
+    date_from: date = Query(None),
+    date_to: date = Query(None),
+    page: PageParams = Depends(page_params),
     db: Session = Depends(get_db),
     user=Depends(get_current_user),
 ):
-    return list_applications(parcel_id=parcel_id, db=db, user=user)
+    return list_applications(parcel_id=parcel_id, date_from=date_from, date_to=date_to, page=page, db=db, user=user)
 
 
 @router.post("/applications")
@@ -109,20 +107,14 @@ def create_application(payload: ApplicationCreate, db: Session = Depends(get_db)
     if payload.area_ha <= 0:
         raise HTTPException(status_code=400, detail="Suprafata trebuie sa fie > 0")
 
-    items = payload.items
-    if payload.mix_id:
-        items = (
-            db.query(TankMixItem)
-            .filter(TankMixItem.mix_id == payload.mix_id)
-            .all()
-        )
-        items = [
-            {"product_id": i.product_id, "dose_per_ha": i.dose_per_ha, "uom": i.uom}
-            for i in items
-        ]
+    doses = _doses_per_ha(_resolve_items(db, payload.items, payload.mix_id))
+    demands = {key: dose * payload.area_ha for key, dose in doses.items()}
 
-    if not items:
-        raise HTTPException(status_code=400, detail="Mix-ul nu are items")
+    try:
+        allocations = stock_allocation.allocate_fifo(db, demands)
+    except stock_allocation.StockShortage as exc:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(exc))
 
     application = Application(
         parcel_id=payload.parcel_id,
@@ -139,47 +131,27 @@ def create_application(payload: ApplicationCreate, db: Session = Depends(get_db)
     db.flush()
 
     total_cost = 0.0
-
-    for item in items:
-        dose = float(item["dose_per_ha"])
-        uom = item["uom"]
-        if uom not in {"L/ha", "kg/ha"}:
-            raise HTTPException(status_code=400, detail="UoM invalid pentru doza")
-        qty = dose * payload.area_ha
-        product_id = int(item["product_id"])
-        base_uom = "l" if uom.lower().startswith("l") else "kg"
-
-        allocations = _allocate_fifo(db, product_id, qty, base_uom)
-        if not allocations:
-            raise HTTPException(status_code=409, detail=f"Stoc insuficient pentru produsul {product_id}")
-
-        for alloc in allocations:
-            lot = db.query(StockLot).filter(StockLot.id == alloc["lot_id"]).first()
-            unit_price = getattr(lot, "unit_price", None)
-            cost = (unit_price or 0) * alloc["qty"]
+    item_rows = []
+    picked = []
+    for (product_id, base_uom), lots in allocations.items():
+        for alloc in lots:
+            cost = (alloc["unit_price"] or 0) * alloc["qty"]
             total_cost += cost
-            db.add(
-                ApplicationItem(
-                    application_id=application.id,
-                    product_id=product_id,
-                    applied_qty=alloc["qty"],
-                    uom=base_uom,
-                    from_lot_id=alloc["lot_id"],
-                    unit_price=unit_price,
-                    cost=cost,
-                )
-            )
-            db.add(
-                InventoryTxn(
-                    lot_id=alloc["lot_id"],
-                    movement="out",
-                    qty=alloc["qty"],
-                    uom=base_uom,
-                    date=payload.date,
-                    reason="application",
-                    ref_id=application.id,
-                )
+            item_rows.append(
+                {
+                    "application_id": application.id,
+                    "product_id": product_id,
+                    "applied_qty": alloc["qty"],
+                    "uom": base_uom,
+                    "from_lot_id": alloc["lot_id"],
+                    "unit_price": alloc["unit_price"],
+                    "cost": cost,
+                }
             )
+            picked.append(alloc)
+
+    db.execute(insert(ApplicationItem), item_rows)
+    stock_allocation.insert_out_txns(db, picked, payload.date, reason="application", ref_id=application.id)
 
     application.total_cost = total_cost
     db.commit()
@@ -187,6 +159,162 @@ def create_application(payload: ApplicationCreate, db: Session = Depends(get_db)
     return application
 
 
+@router.post("/applications/preview")
+def preview_application(
+    payload: ApplicationPreviewRequest, db: Session = Depends(get_db), user=Depends(get_current_user)
+):
+    """What posting would draw from stock right now; takes no locks and writes nothing."""
+    if not payload.items and not payload.mix_id:
+        raise HTTPException(status_code=400, detail="Trebuie items sau mix_id")
+    if payload.area_ha <= 0:
+        raise HTTPException(status_code=400, detail="Suprafata trebuie sa fie > 0")
+
+    doses = _doses_per_ha(_resolve_items(db, payload.items, payload.mix_id))
+    demands = {key: dose * payload.area_ha for key, dose in doses.items()}
+    lots = stock_allocation.load_available_lots(db, [pid for pid, _ in demands])
+    allocations, shortages = stock_allocation.plan_fifo(lots, demands)
+    short = {(s.product_id, s.uom): s for s in shortages}
+
+    products = []
+    for (product_id, base_uom), picked in allocations.items():
+        requested = demands[(product_id, base_uom)]
+        allocated = sum(a["qty"] for a in picked)
+        products.append(
+            {
+                "product_id": product_id,
+                "uom": base_uom,
+                "requested": requested,
+                "allocated": allocated,
+                "shortage": requested - allocated if (product_id, base_uom) in short else 0.0,
+                "cost": sum((a["unit_price"] or 0) * a["qty"] for a in picked),
+                "lots": [
+                    {
+                        "lot_id": a["lot_id"],
+                        "lot_code": a["lot_code"],
+                        "expires_at": a["expires_at"],
+                        "qty": a["qty"],
+                        "unit_price": a["unit_price"],
+                        "cost": (a["unit_price"] or 0) * a["qty"],
+                    }
+                    for a in picked
+                ],
+            }
+        )
+    return {
+        "ok": not shortages,
+        "area_ha": payload.area_ha,
+        "total_cost": sum(p["cost"] for p in products),
+        "products": products,
+    }
+
+
+@router.post("/applications/batch")
+def create_applications_batch(
+    payload: ApplicationBatchCreate, db: Session = Depends(get_db), user=Depends(get_current_user)
+):
+    """One spraying run over many parcels: a single allocation, all rows in one transaction."""
+    if not payload.items and not payload.mix_id:
+        raise HTTPException(status_code=400, detail="Trebuie items sau mix_id")
+    if not payload.parcels:
+        raise HTTPException(status_code=400, detail="Lista de parcele este goala")
+    if any(p.area_ha <= 0 for p in payload.parcels):
+        raise HTTPException(status_code=400, detail="Suprafata trebuie sa fie > 0")
+    parcel_ids = {p.parcel_id for p in payload.parcels}
+    found = {pid for (pid,) in db.query(Parcel.id).filter(Parcel.id.in_(parcel_ids)).all()}
+    missing = sorted(parcel_ids - found)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Parcela {missing[0]} nu exista")
+
+    doses = _doses_per_ha(_resolve_items(db, payload.items, payload.mix_id))
+    areas = [p.area_ha for p in payload.parcels]
+    total_area = sum(areas)
+    demands = {key: dose * total_area for key, dose in doses.items()}
+
+    # Any shortage rejects the whole run before anything is written.
+    try:
+        allocations = stock_allocation.allocate_fifo(db, demands)
+    except stock_allocation.StockShortage as exc:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(exc))
+
+    # Parcels draw from the allocated lots in request order, as consecutive single posts would.
+    shares = {
+        key: stock_allocation.split_allocation(allocations[key], [dose * area for area in areas])
+        for key, dose in doses.items()
+    }
+    per_parcel = [[(key, alloc) for key in shares for alloc in shares[key][idx]] for idx in range(len(areas))]
+
+    app_rows = [
+        {
+            "parcel_id": p.parcel_id,
+            "date": payload.date,
+            "mix_id": payload.mix_id,
+            "area_ha": p.area_ha,
+            "operator_id": payload.operator_id,
+            "machine": payload.machine,
+            "water_l_per_ha": payload.water_l_per_ha,
+            "tank_volume_l": payload.tank_volume_l,
+            "status": payload.status or "posted",
+            "total_cost": sum((alloc["unit_price"] or 0) * alloc["qty"] for _, alloc in picks),
+        }
+        for p, picks in zip(payload.parcels, per_parcel)
+    ]
+    app_ids = db.execute(
+        insert(Application).returning(Application.id, sort_by_parameter_order=True), app_rows
+    ).scalars().all()
+
+    item_rows = []
+    picked = []
+    for app_id, picks in zip(app_ids, per_parcel):
+        for (product_id, base_uom), alloc in picks:
+            item_rows.append(
+                {
+                    "application_id": app_id,
+                    "product_id": product_id,
+                    "applied_qty": alloc["qty"],
+                    "uom": base_uom,
+                    "from_lot_id": alloc["lot_id"],
+                    "unit_price": alloc["unit_price"],
+                    "cost": (alloc["unit_price"] or 0) * alloc["qty"],
+                }
+            )
+            picked.append({**alloc, "ref_id": app_id})
+
+    db.execute(insert(ApplicationItem), item_rows)
+    stock_allocation.insert_out_txns(db, picked, payload.date, reason="application")
+    db.commit()
+
+    return {
+        "total_area_ha": total_area,
+        "total_cost": sum(r["total_cost"] for r in app_rows),
+        "applications": [
+            {"id": app_id, "parcel_id": r["parcel_id"], "area_ha": r["area_ha"], "total_cost": r["total_cost"]}
+            for app_id, r in zip(app_ids, app_rows)
+        ],
+    }
+
+
+def _resolve_items(db: Session, items, mix_id: int | None) -> list[dict]:
+    resolved = [i.dict() for i in items or []]
+    if mix_id:
+        resolved = tank_mixes.mix_items(db, mix_id)
+    if not resolved:
+        raise HTTPException(status_code=400, detail="Mix-ul nu are items")
+    return resolved
+
+
+def _doses_per_ha(items: list[dict]) -> dict:
+    """Sum the doses per (product_id, base uom) so each product is allocated once."""
+    doses = {}
+    for item in items:
+        uom = item["uom"]
+        if uom not in {"L/ha", "kg/ha"}:
+            raise HTTPException(status_code=400, detail="UoM invalid pentru doza")
+        key = (int(item["product_id"]), "l" if uom.lower().startswith("l") else "kg")
+        doses[key] = doses.get(key, 0.0) + float(item["dose_per_ha"])
+    return doses
+
+
 @router.post("/inventory/applications")
 def create_inventory_application(payload: ApplicationCreate, db: Session = Depends(get_db), user=Depends(get_current_user)):
     return create_application(payload=payload, db=db, user=user)
@@ -194,60 +322,46 @@ def create_inventory_application(payload: ApplicationCreate, db: Session = Depen
 
 @router.get("/inventory/applications/{app_id}")
 def get_inventory_application(app_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    app = db.query(Application).filter(Application.id == app_id).first()
-    if not app:
+    rows = _applications_with_items(db, ["a.id = :app_id"], {"app_id": app_id})
+    if not rows:
         raise HTTPException(status_code=404, detail="Aplicare inexistenta")
-    items = db.query(ApplicationItem).filter(ApplicationItem.application_id == app_id).all()
-    return {
-        "id": app.id,
-        "parcel_id": app.parcel_id,
-        "date": app.date,
-        "area_ha": app.area_ha,
-        "total_cost": app.total_cost,
-        "status": app.status,
-        "items": [
-            {
-                "product_id": i.product_id,
-                "applied_qty": i.applied_qty,
-                "uom": i.uom,
-                "from_lot_id": i.from_lot_id,
-                "unit_price": i.unit_price,
-                "cost": i.cost,
-            }
-            for i in items
-        ],
-    }
+    return rows[0]
+
 
+@router.get("/applications/{app_id}")
+def get_application(app_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
+    return get_inventory_application(app_id=app_id, db=db, user=user)
 
-def _allocate_fifo(db: Session, product_id: int, qty: float, uom: str):
-    sql = """
-        SELECT l.id AS lot_id,
-               l.uom,
-               l.expires_at,
-               l.received_date,
-               COALESCE(SUM(CASE WHEN t.movement='in' THEN t.qty WHEN t.movement='out' THEN -t.qty ELSE t.qty END),0) AS qty
-        FROM stock_lots l
-        LEFT JOIN inventory_txns t ON t.lot_id = l.id
-        WHERE l.product_id = :product_id
-        GROUP BY l.id
-        ORDER BY (l.expires_at IS NULL) ASC, l.expires_at ASC, l.received_date ASC, l.id ASC
+
+def _applications_with_items(db: Session, where: list[str], params: dict, tail: str = "") -> list[dict]:
+    """Applications with their items, product names and lot codes, in one query."""
+    sql = f"""
+        SELECT a.id, a.parcel_id, a.date, a.mix_id, a.area_ha, a.operator_id, a.machine,
+               a.water_l_per_ha, a.tank_volume_l, a.status, a.total_cost, a.doc_id, a.created_at,
+               COALESCE(it.items, '[]'::json) AS items
+        FROM applications a
+        LEFT JOIN LATERAL (
+            SELECT json_agg(
+                       json_build_object(
+                           'id', i.id,
+                           'product_id', i.product_id,
+                           'trade_name', p.trade_name,
+                           'applied_qty', i.applied_qty,
+                           'uom', i.uom,
+                           'from_lot_id', i.from_lot_id,
+                           'lot_code', l.lot_code,
+                           'unit_price', i.unit_price,
+                           'cost', i.cost
+                       )
+                       ORDER BY i.id
+                   ) AS items
+            FROM application_items i
+            JOIN chem_products p ON p.id = i.product_id
+            LEFT JOIN stock_lots l ON l.id = i.from_lot_id
+            WHERE i.application_id = a.id
+        ) it ON TRUE
+        {"WHERE " + " AND ".join(where) if where else ""}
+        {tail}
     """
-    rows = db.execute(text(sql), {"product_id": product_id}).mappings().all()
-
-    remaining = qty
-    allocations = []
-    for r in rows:
-        if remaining <= 0:
-            break
-        if r["uom"] != uom:
-            continue
-        available = float(r["qty"] or 0)
-        if available <= 0:
-            continue
-        take = available if available < remaining else remaining
-        allocations.append({"lot_id": r["lot_id"], "qty": take})
-        remaining -= take
-
-    if remaining > 0:
-        return []
-    return allocations
+    return [dict(r) for r in db.execute(text(sql), params).mappings().all()]
+
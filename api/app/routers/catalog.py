@@ -1,17 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from db import get_db
 from models import CropCatalog, VarietyCatalog, Parcel, ParcelCrop, ActiveSubstance
 from schemas import CropCreate, VarietyCreate, ParcelCropCreate, ActiveSubstanceCreate
 from security import get_current_user
 from services import chem_parse
+from services.pagination import PageParams, page_params, paginate
 
 router = APIRouter(tags=["catalog"])
 
 
 @router.get("/catalog/crops")
-def list_crops(db: Session = Depends(get_db), user=Depends(get_current_user)):
-    return db.query(CropCatalog).order_by(CropCatalog.crop.asc()).all()
+def list_crops(page: PageParams = Depends(page_params), db: Session = Depends(get_db), user=Depends(get_current_user)):
+    return paginate(db.query(CropCatalog), [CropCatalog.crop, CropCatalog.id], page)
 
 
 @router.post("/catalog/crops")
@@ -24,8 +25,16 @@ def create_crop(payload: CropCreate, db: Session = Depends(get_db), user=Depends
 
 
 @router.get("/catalog/varieties")
-def list_varieties(db: Session = Depends(get_db), user=Depends(get_current_user)):
-    return db.query(VarietyCatalog).all()
+def list_varieties(
+    crop_id: int = Query(None),
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    query = db.query(VarietyCatalog)
+    if crop_id:
+        query = query.filter(VarietyCatalog.crop_id == crop_id)
+    return paginate(query, [VarietyCatalog.id], page)
 
 
 @router.post("/catalog/varieties")
@@ -1,11 +1,9 @@
 from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
 from sqlalchemy.orm import Session
 from typing import Optional
-import io
-import pandas as pd
 from db import get_db
 from models import CadastreCF, Parcel, Doc
-from services import pdf_cf_parser, geo, storage
+from services import pdf_cf_parser, geo, storage, cf_import, parcel_overlap
 from security import get_current_user
 from geoalchemy2 import WKTElement
 
@@ -19,6 +17,7 @@ async def import_cf_pdf(
     parcel_name: Optional[str] = Form(None),
     county: Optional[str] = Form(None),
     locality: Optional[str] = Form(None),
+    allow_overlap: bool = Form(False),
     db: Session = Depends(get_db),
     user=Depends(get_current_user),
 ):
@@ -29,6 +28,7 @@ async def import_cf_pdf(
 
     points_wgs84 = geo.stereo70_to_wgs84(points)
     polygon = geo.points_to_polygon(points_wgs84)
+    conflicts = parcel_overlap.check_write(db, polygon, allow_overlap)
 
     cf = db.query(CadastreCF).filter(CadastreCF.cf_number == cf_number).first()
     if not cf:
@@ -59,6 +59,7 @@ async def import_cf_pdf(
         "cf_id": cf.id,
         "parcel_id": parcel.id,
         "area_m2": area,
+        "overlaps": conflicts,
         "feature": {
             "type": "Feature",
             "geometry": geo.shape_to_geojson(polygon),
@@ -70,42 +71,19 @@ async def import_cf_pdf(
 @router.post("/import-excel")
 async def import_cf_excel(
     file: UploadFile = File(...),
+    allow_overlap: bool = Form(False),
     db: Session = Depends(get_db),
     user=Depends(get_current_user),
 ):
     content = await file.read()
-    if file.filename.lower().endswith(".csv"):
-        df_points = pd.read_csv(io.BytesIO(content))
-    else:
-        df_points = pd.read_excel(io.BytesIO(content), sheet_name="CF_Points")
-
-    required = {"cf_number", "x_stereo70", "y_stereo70", "order"}
-    if not required.issubset(set(df_points.columns)):
-        raise HTTPException(status_code=400, detail="Sheet-ul CF_Points trebuie să aibă coloanele: cf_number, x_stereo70, y_stereo70, order")
-
-    results = []
-    for cf_number, group in df_points.groupby("cf_number"):
-        group_sorted = group.sort_values("order")
-        points = list(zip(group_sorted["x_stereo70"].astype(float), group_sorted["y_stereo70"].astype(float)))
-        if len(points) < 3:
-            continue
-        points_wgs84 = geo.stereo70_to_wgs84(points)
-        polygon = geo.points_to_polygon(points_wgs84)
-
-        cf = db.query(CadastreCF).filter(CadastreCF.cf_number == cf_number).first()
-        if not cf:
-            cf = CadastreCF(cf_number=str(cf_number))
-            db.add(cf)
-            db.flush()
-
-        area = geo.area_m2(polygon)
-        wkt = WKTElement(polygon.wkt, srid=4326)
-        parcel = Parcel(cf_id=cf.id, name=f"CF {cf_number}", area_m2=area, geom=wkt, status="active")
-        db.add(parcel)
-        results.append({"cf_number": cf_number, "area_m2": area})
-
+    df_points = cf_import.read_points(content, file.filename)
+    try:
+        result = cf_import.import_cf_points(db, df_points, allow_overlap=allow_overlap)
+    except cf_import.ImportFormatError as exc:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(exc))
     db.commit()
-    return {"imported": len(results), "items": results}
+    return result
 
 
 def _ocr_endpoint():
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
 from sqlalchemy.orm import Session
+from datetime import date
 from db import get_db
 from models import Harvest, HarvestTicket, Doc
 from schemas import HarvestCreate
 from security import get_current_user
 from services import chem_parse, storage
+from services.pagination import PageParams, page_params, paginate
 import requests
 import os
 
@@ -21,8 +23,22 @@ def create_harvest(payload: HarvestCreate, db: Session = Depends(get_db), user=D
 
 
 @router.get("")
-def list_harvests(db: Session = Depends(get_db), user=Depends(get_current_user)):
-    return db.query(Harvest).order_by(Harvest.date.desc()).all()
+def list_harvests(
+    parcel_id: int = Query(None),
+    date_from: date = Query(None),
+    date_to: date = Query(None),
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    query = db.query(Harvest)
+    if parcel_id:
+        query = query.filter(Harvest.parcel_id == parcel_id)
+    if date_from:
+        query = query.filter(Harvest.date >= date_from)
+    if date_to:
+        query = query.filter(Harvest.date <= date_to)
+    return paginate(query, [Harvest.date, Harvest.id], page, descending=True)
 
 
 @router.post("/{harvest_id}/ticket")
@@ -1,13 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Body
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import text, insert, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import date
 from pydantic import ValidationError
 from db import get_db
 from models import (
     Inventory,
     InventoryMovement,
-    ChemMixRule,
     Doc,
     ActiveSubstance,
     ChemProduct,
@@ -23,18 +24,19 @@ from schemas import (
     InventoryUpdate,
     InventoryMovementCreate,
     MixCheckRequest,
+    MixBatchCheckRequest,
     ChemProductUpsert,
     InventoryLotCreate,
+    InventoryLotBulkCreate,
     InventoryTxnCreate,
     ActiveSubstanceCreate,
 )
-from security import get_current_user
-from services import chem_parse, storage, chem_units
+from security import get_current_user, require_role
+from services import chem_parse, storage, chem_units, lot_balances, stock_allocation, exports, stock_snapshots, txn_import, mix_rules
+from services.pagination import PageParams, page_params, paginate
 import requests
 import time
 import os
-from openpyxl import Workbook
-from openpyxl.styles import Font
 
 router = APIRouter(tags=["inventory"])
 
@@ -47,42 +49,8 @@ def list_inventory(
     user=Depends(get_current_user),
 ):
     if kind == "chem":
-        products = db.query(ChemProduct).order_by(ChemProduct.trade_name.asc()).all()
-        payload = []
-        for p in products:
-            actives = (
-                db.query(ProductActive, ActiveSubstance)
-                .join(ActiveSubstance, ActiveSubstance.id == ProductActive.active_id)
-                .filter(ProductActive.product_id == p.id)
-                .all()
-            )
-            payload.append(
-                {
-                    "id": p.id,
-                    "trade_name": p.trade_name,
-                    "product_type": p.product_type,
-                    "formulation": p.formulation,
-                    "supplier": p.supplier,
-                    "ean13": p.ean13,
-                    "registration_no": p.registration_no,
-                    "label_doc_id": p.label_doc_id,
-                    "sds_doc_id": p.sds_doc_id,
-                    "density_kg_per_l": p.density_kg_per_l,
-                    "default_uom": p.default_uom,
-                    "compat_notes": p.compat_notes,
-                    "notes": p.notes,
-                    "actives": [
-                        {
-                            "active_id": a.id,
-                            "active_name": a.name,
-                            "concentration": pa.concentration,
-                            "unit": pa.unit,
-                        }
-                        for pa, a in actives
-                    ],
-                }
-            )
-        return payload
+        products = _products_with_actives(db).order_by(ChemProduct.trade_name.asc()).all()
+        return [_product_to_dict(p) for p in products]
 
     query = db.query(Inventory)
     if item_type:
@@ -156,19 +124,19 @@ def list_products(
     db: Session = Depends(get_db),
     user=Depends(get_current_user),
 ):
-    query = db.query(ChemProduct)
+    query = _products_with_actives(db)
     if product_type:
         query = query.filter(ChemProduct.product_type == product_type)
     products = query.order_by(ChemProduct.trade_name.asc()).all()
-    return [_product_to_dict(db, p) for p in products]
+    return [_product_to_dict(p) for p in products]
 
 
 @router.get("/inventory/products/{product_id}")
 def get_product(product_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    product = db.query(ChemProduct).filter(ChemProduct.id == product_id).first()
+    product = _products_with_actives(db).filter(ChemProduct.id == product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Produs inexistent")
-    return _product_to_dict(db, product)
+    return _product_to_dict(product)
 
 
 @router.post("/inventory/products")
@@ -296,9 +264,9 @@ async def ingest_label(file: UploadFile = File(...), db: Session = Depends(get_d
     product_match = None
     if parsed.get("trade_name"):
         trade_norm = chem_parse.normalize_text(parsed["trade_name"]).replace(" ", "")
-        product = db.query(ChemProduct).filter(ChemProduct.trade_name_norm == trade_norm).first()
+        product = _products_with_actives(db).filter(ChemProduct.trade_name_norm == trade_norm).first()
         if product:
-            product_match = _product_to_dict(db, product)
+            product_match = _product_to_dict(product)
 
     doc_key = storage.save_doc(content, file.filename, file.content_type or "application/octet-stream")
     doc = Doc(path=doc_key, type="label", ocr_json=str(data))
@@ -317,27 +285,8 @@ async def ingest_label(file: UploadFile = File(...), db: Session = Depends(get_d
 @router.post("/inventory/lots")
 def create_lot(payload: InventoryLotCreate, db: Session = Depends(get_db), user=Depends(get_current_user)):
     product = db.query(ChemProduct).filter(ChemProduct.id == payload.product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Produsul nu exista")
-
-    expires_at = payload.expiry_date or payload.expires_at
-    if expires_at and expires_at < payload.received_date:
-        raise HTTPException(status_code=400, detail="Data expirarii trebuie sa fie dupa data receptiei")
-
-    uom = chem_units.normalize_uom(payload.uom)
-    if uom not in chem_units.ALLOWED_UOM:
-        raise HTTPException(status_code=400, detail="Unitatea trebuie sa fie l sau kg")
-
-    if payload.qty <= 0:
-        raise HTTPException(status_code=400, detail="Cantitatea trebuie sa fie > 0")
-
-    actives = db.query(ProductActive).filter(ProductActive.product_id == product.id).all()
-    for pa in actives:
-        unit = chem_units.normalize_conc_unit(pa.unit) or pa.unit
-        if unit == "%w/v" and not product.density_kg_per_l:
-            raise HTTPException(status_code=400, detail="Densitatea este obligatorie pentru produse %w/v")
-        if chem_units.requires_density(unit, uom) and not product.density_kg_per_l:
-            raise HTTPException(status_code=400, detail="Densitatea produsului este necesara pentru conversia unitatilor")
+    actives = db.query(ProductActive).filter(ProductActive.product_id == payload.product_id).all()
+    uom, expires_at = _check_lot_line(payload, product, actives)
 
     location = _ensure_location(db, payload.location_id, payload.location_name)
 
@@ -381,6 +330,123 @@ def create_lot(payload: InventoryLotCreate, db: Session = Depends(get_db), user=
     }
 
 
+@router.post("/inventory/lots/bulk")
+def create_lots_bulk(payload: InventoryLotBulkCreate, db: Session = Depends(get_db), user=Depends(get_current_user)):
+    """Receive a whole invoice: valid lines are stored together, invalid ones are reported."""
+    lines = payload.lines
+    product_ids = {line.product_id for line in lines}
+    products = {p.id: p for p in _products_with_actives(db).filter(ChemProduct.id.in_(product_ids)).all()}
+    location_ids = {line.location_id for line in lines if line.location_id}
+    locations_by_id = {
+        loc.id: loc for loc in db.query(InventoryLocation).filter(InventoryLocation.id.in_(location_ids)).all()
+    }
+
+    errors = []
+    valid = []
+    for idx, line in enumerate(lines, start=1):
+        try:
+            product = products.get(line.product_id)
+            uom, expires_at = _check_lot_line(line, product, product.actives if product else [])
+            if line.location_id and line.location_id not in locations_by_id:
+                raise HTTPException(status_code=404, detail="Locatia nu exista")
+        except HTTPException as exc:
+            errors.append({"line": idx, "lot_code": line.lot_code, "detail": exc.detail})
+            continue
+        valid.append((idx, line, uom, expires_at))
+
+    # Locations given by name are created once per batch, like _ensure_location does per line.
+    names = {
+        (line.location_name or "Depozit principal").strip() for _, line, _, _ in valid if not line.location_id
+    }
+    if names:
+        db.execute(
+            pg_insert(InventoryLocation)
+            .values([{"name": name} for name in sorted(names)])
+            .on_conflict_do_nothing(index_elements=["name"])
+        )
+    location_by_name = {
+        loc.name: loc.id for loc in db.query(InventoryLocation).filter(InventoryLocation.name.in_(names)).all()
+    }
+
+    lot_rows = [
+        {
+            "product_id": line.product_id,
+            "location_id": line.location_id or location_by_name[(line.location_name or "Depozit principal").strip()],
+            "lot_code": line.lot_code.strip(),
+            "received_date": line.received_date,
+            "expires_at": expires_at,
+            "uom": uom,
+            "unit_price": line.unit_price,
+            "notes": line.notes,
+        }
+        for _, line, uom, expires_at in valid
+    ]
+    valid, lot_rows = _drop_duplicate_lots(db, valid, lot_rows, errors)
+    errors.sort(key=lambda e: e["line"])
+
+    created = []
+    if valid:
+        lot_ids = db.execute(
+            insert(StockLot).returning(StockLot.id, sort_by_parameter_order=True), lot_rows
+        ).scalars().all()
+        db.execute(
+            insert(InventoryTxn),
+            [
+                {"lot_id": lot_id, "movement": "in", "qty": line.qty, "uom": uom, "date": line.received_date}
+                for lot_id, (_, line, uom, _) in zip(lot_ids, valid)
+            ],
+        )
+        today = date.today()
+        for lot_id, row, (idx, line, _, expires_at) in zip(lot_ids, lot_rows, valid):
+            expires_in = (expires_at - today).days if expires_at else None
+            created.append(
+                {
+                    "line": idx,
+                    "id": lot_id,
+                    **row,
+                    "qty": line.qty,
+                    "expires_in_days": expires_in,
+                    "expiring_soon": (expires_in is not None and expires_in <= 90),
+                }
+            )
+    db.commit()
+    return {"created": created, "errors": errors}
+
+
+def _drop_duplicate_lots(db: Session, valid: list, lot_rows: list, errors: list):
+    """Report lines that would break uq_stock_lot_unique instead of failing the whole invoice.
+
+    The constraint is a plain UNIQUE, so lots without an expiry date never collide.
+    """
+    def key(row):
+        return (row["product_id"], row["lot_code"], row["expires_at"], row["location_id"])
+
+    keys = [key(row) for row in lot_rows if row["expires_at"] is not None]
+    existing = set()
+    if keys:
+        columns = (StockLot.product_id, StockLot.lot_code, StockLot.expires_at, StockLot.location_id)
+        existing = {tuple(r) for r in db.query(*columns).filter(tuple_(*columns).in_(keys)).all()}
+
+    seen = {}
+    kept_valid, kept_rows = [], []
+    for entry, row in zip(valid, lot_rows):
+        idx, line = entry[0], entry[1]
+        if row["expires_at"] is not None:
+            k = key(row)
+            if k in existing:
+                errors.append({"line": idx, "lot_code": line.lot_code, "detail": "Lotul exista deja"})
+                continue
+            if k in seen:
+                errors.append(
+                    {"line": idx, "lot_code": line.lot_code, "detail": f"Lot duplicat (linia {seen[k]})"}
+                )
+                continue
+            seen[k] = idx
+        kept_valid.append(entry)
+        kept_rows.append(row)
+    return kept_valid, kept_rows
+
+
 @router.get("/inventory/lots")
 def list_lots(
     product_id: int = Query(None),
@@ -400,12 +466,11 @@ def list_lots(
                l.uom,
                l.unit_price,
                l.notes,
-               COALESCE(SUM(CASE WHEN t.movement='in' THEN t.qty WHEN t.movement='out' THEN -t.qty ELSE t.qty END),0) AS qty
+               COALESCE(b.qty, 0) AS qty
         FROM stock_lots l
-        LEFT JOIN inventory_txns t ON t.lot_id = l.id
+        LEFT JOIN lot_balances b ON b.lot_id = l.id
         WHERE (:product_id IS NULL OR l.product_id = :product_id)
           AND (:location_id IS NULL OR l.location_id = :location_id)
-        GROUP BY l.id
         ORDER BY (l.expires_at IS NULL) ASC, l.expires_at ASC, l.received_date ASC;
     """
     rows = db.execute(text(sql), params).mappings().all()
@@ -454,6 +519,7 @@ def create_inventory_txn(payload: InventoryTxnCreate, db: Session = Depends(get_
         if lot.uom != uom:
             raise HTTPException(status_code=400, detail="Unitatea nu corespunde lotului")
         if movement == "out":
+            stock_allocation.lock_products(db, [lot.product_id])
             current = _get_lot_balance(db, lot.id)
             if current < payload.qty:
                 raise HTTPException(status_code=400, detail="Stoc insuficient in lot")
@@ -480,31 +546,93 @@ def create_inventory_txn(payload: InventoryTxnCreate, db: Session = Depends(get_
     if not payload.product_id:
         raise HTTPException(status_code=400, detail="product_id este obligatoriu pentru FIFO")
 
-    allocations = _allocate_fifo(db, payload.product_id, payload.qty, uom)
-    if not allocations:
+    try:
+        allocations = stock_allocation.allocate_fifo(db, {(payload.product_id, uom): payload.qty})
+    except stock_allocation.StockShortage:
+        db.rollback()
         raise HTTPException(status_code=400, detail="Stoc insuficient pentru FIFO")
 
-    created = []
-    for alloc in allocations:
-        txn = InventoryTxn(
-            lot_id=alloc["lot_id"],
-            movement="out",
-            qty=alloc["qty"],
-            uom=uom,
-            date=payload.date,
-            doc_id=payload.doc_id,
-            notes=payload.notes,
-        )
-        db.add(txn)
-        created.append(txn)
+    picked = allocations[(payload.product_id, uom)]
+    stock_allocation.insert_out_txns(db, picked, payload.date, doc_id=payload.doc_id, notes=payload.notes)
     db.commit()
-    return {"items": [{"lot_id": t.lot_id, "qty": t.qty} for t in created]}
+    return {"items": [{"lot_id": a["lot_id"], "qty": a["qty"]} for a in picked]}
+
+
+@router.post("/inventory/txns/import")
+def import_inventory_txns(
+    file: UploadFile = File(...),
+    dry_run: bool = Query(False),
+    db: Session = Depends(get_db),
+    user=Depends(require_role("admin")),
+):
+    """Load txns from CSV/XLSX; valid rows are imported, the rest go to an error report."""
+    filename = file.filename or ""
+    if not filename.lower().endswith((".csv", ".xlsx")):
+        raise HTTPException(status_code=400, detail="Fisierul trebuie sa fie CSV sau XLSX")
+
+    doc_id = None
+    if not dry_run:
+        # The upload is spooled to disk by Starlette; it is sent to storage and parsed from there.
+        doc_key = storage.save_doc_fileobj(file.file, filename, file.content_type or "application/octet-stream")
+        file.file.seek(0)
+        doc = Doc(path=doc_key, type="txn_import")
+        db.add(doc)
+        db.flush()
+        doc_id = doc.id
+
+    try:
+        result = txn_import.import_txns(db, file.file, filename, doc_id=doc_id, created_by=user.id, dry_run=dry_run)
+    except txn_import.ImportFormatError as exc:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    report_doc_id = None
+    if dry_run:
+        db.rollback()
+    else:
+        if result["rejected"]:
+            report_key = storage.save_doc(
+                txn_import.error_report_csv(result), f"erori_{filename.rsplit('.', 1)[0]}.csv", "text/csv"
+            )
+            report = Doc(path=report_key, type="txn_import_errors")
+            db.add(report)
+            db.flush()
+            report_doc_id = report.id
+        db.commit()
+
+    return {
+        "rows": result["rows"],
+        "imported": result["imported"],
+        "rejected": result["rejected"],
+        "doc_id": doc_id,
+        "error_report_doc_id": report_doc_id,
+        "errors": [
+            {"line": e["line"], "error": e["error"]} for e in result["errors"][: txn_import.REPORT_SAMPLE]
+        ],
+    }
 
 
 @router.get("/inventory/txns")
-def list_inventory_txns(db: Session = Depends(get_db), user=Depends(get_current_user)):
-    rows = db.query(InventoryTxn).order_by(InventoryTxn.created_at.desc()).all()
-    return rows
+def list_inventory_txns(
+    lot_id: int = Query(None),
+    reason: str = Query(None),
+    date_from: date = Query(None),
+    date_to: date = Query(None),
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    query = db.query(InventoryTxn)
+    if lot_id:
+        query = query.filter(InventoryTxn.lot_id == lot_id)
+    if reason:
+        query = query.filter(InventoryTxn.reason == reason)
+    if date_from:
+        query = query.filter(InventoryTxn.date >= date_from)
+    if date_to:
+        query = query.filter(InventoryTxn.date <= date_to)
+    # Ids grow with created_at and, unlike created_at, are unique and never null.
+    return paginate(query, [InventoryTxn.id], page, descending=True)
 
 
 @router.get("/inventory/active-stock")
@@ -527,23 +655,25 @@ def active_stock(active: str = Query(None), name: str = Query(None), db: Session
     rows = db.execute(
         text(
             """
-            SELECT active_id, active_name, product_id, trade_name, lot_id, lot_code, expires_at, uom, lot_qty, active_kg
-            FROM vw_active_stock
-            WHERE active_id = :active_id
+            SELECT s.product_id, p.trade_name, s.lot_id, l.lot_code, l.expires_at, l.uom, s.lot_qty, s.active_kg
+            FROM active_stock_lots s
+            JOIN stock_lots l ON l.id = s.lot_id
+            JOIN chem_products p ON p.id = s.product_id
+            WHERE s.active_id = :active_id
+            ORDER BY l.expires_at NULLS LAST, s.lot_id
             """
         ),
         {"active_id": active_row.id},
     ).mappings().all()
+    total = db.execute(
+        text("SELECT total_kg FROM active_stock_totals WHERE active_id = :active_id"),
+        {"active_id": active_row.id},
+    ).scalar() or 0.0
 
-    total = 0.0
     breakdown = []
     for r in rows:
-        qty = float(r["lot_qty"] or 0)
-        if qty <= 0:
-            continue
+        qty = float(r["lot_qty"])
         active_kg = r["active_kg"]
-        if active_kg is not None:
-            total += float(active_kg)
         breakdown.append(
             {
                 "product_id": r["product_id"],
@@ -557,138 +687,106 @@ def active_stock(active: str = Query(None), name: str = Query(None), db: Session
             }
         )
 
-    return {"active_name": active_row.name, "total_kg": round(total, 3), "breakdown": breakdown}
+    return {"active_name": active_row.name, "total_kg": round(float(total), 3), "breakdown": breakdown}
 
 
 @router.get("/inventory/stock-summary")
 def stock_summary(db: Session = Depends(get_db), user=Depends(get_current_user)):
     sql = """
         SELECT l.product_id, l.location_id, l.uom,
-               COALESCE(SUM(CASE WHEN t.movement='in' THEN t.qty WHEN t.movement='out' THEN -t.qty ELSE t.qty END),0) AS qty,
-               COALESCE(SUM(CASE WHEN t.movement='in' THEN t.qty WHEN t.movement='out' THEN -t.qty ELSE t.qty END),0) * COALESCE(l.unit_price,0) AS value
+               COALESCE(SUM(b.qty),0) AS qty,
+               COALESCE(SUM(b.qty),0) * COALESCE(l.unit_price,0) AS value
         FROM stock_lots l
-        LEFT JOIN inventory_txns t ON t.lot_id = l.id
+        LEFT JOIN lot_balances b ON b.lot_id = l.id
         GROUP BY l.product_id, l.location_id, l.uom, l.unit_price
     """
     rows = db.execute(text(sql)).mappings().all()
     return [dict(r) for r in rows]
 
 
-@router.get("/inventory/export.xlsx")
-def export_excel(
-    scope: str = Query("all"),
+@router.get("/inventory/stock-as-of")
+def stock_as_of(
+    as_of: date = Query(...),
+    product_id: int = Query(None),
+    location_id: int = Query(None),
     db: Session = Depends(get_db),
     user=Depends(get_current_user),
 ):
-    wb = Workbook()
-    wb.remove(wb.active)
-
-    def add_sheet(name: str, headers: list[str], rows: list[list]):
-        ws = wb.create_sheet(title=name)
-        ws.append(headers)
-        for cell in ws[1]:
-            cell.font = Font(bold=True)
-        for row in rows:
-            ws.append(row)
-        ws.auto_filter.ref = ws.dimensions
-        ws.freeze_panes = "A2"
-
-    if scope in {"products", "all"}:
-        products = db.query(ChemProduct).order_by(ChemProduct.trade_name.asc()).all()
-        rows = [
-            [
-                p.id,
-                p.trade_name,
-                p.formulation,
-                p.supplier,
-                p.ean13,
-                p.registration_no,
-                p.density_kg_per_l,
-            ]
-            for p in products
-        ]
-        add_sheet("Products", ["id", "trade_name", "formulation", "supplier", "ean13", "registration_no", "density"], rows)
-
-    if scope in {"actives", "all"}:
-        actives = db.query(ActiveSubstance).order_by(ActiveSubstance.name.asc()).all()
-        rows = [
-            [a.id, a.name, a.cas_no, ",".join(a.synonyms or []), a.notes]
-            for a in actives
-        ]
-        add_sheet("ActiveSubstances", ["id", "name", "cas_no", "synonyms", "notes"], rows)
-
-    if scope in {"product_actives", "all"}:
-        rows = db.execute(
-            text(
-                """
-                SELECT pa.id, pa.product_id, p.trade_name, pa.active_id, a.name, pa.concentration, pa.unit
-                FROM product_actives pa
-                JOIN chem_products p ON p.id = pa.product_id
-                JOIN active_substances a ON a.id = pa.active_id
-                """
-            )
-        ).fetchall()
-        add_sheet("ProductActives", ["id", "product_id", "product", "active_id", "active", "concentration", "unit"], rows)
-
-    if scope in {"lots", "all"}:
-        rows = db.execute(
-            text(
-                """
-                SELECT l.id, l.product_id, p.trade_name, l.lot_code, l.received_date, l.expires_at, l.uom, l.unit_price
-                FROM stock_lots l
-                JOIN chem_products p ON p.id = l.product_id
-                ORDER BY (l.expires_at IS NULL) ASC, l.expires_at ASC
-                """
-            )
-        ).fetchall()
-        add_sheet("Lots", ["id", "product_id", "product", "lot_code", "received_date", "expires_at", "uom", "unit_price"], rows)
-
-    if scope in {"txns", "all"}:
-        rows = db.execute(
-            text(
-                """
-                SELECT id, lot_id, movement, qty, uom, date, reason, ref_type, ref_id, created_at
-                FROM inventory_txns
-                ORDER BY created_at DESC
-                """
-            )
-        ).fetchall()
-        add_sheet("Transactions", ["id", "lot_id", "movement", "qty", "uom", "date", "reason", "ref_type", "ref_id", "created_at"], rows)
-
-    if scope in {"applications", "all"}:
-        rows = db.execute(
-            text(
-                """
-                SELECT a.id, a.parcel_id, a.date, a.area_ha, a.total_cost
-                FROM applications a
-                ORDER BY a.date DESC
-                """
-            )
-        ).fetchall()
-        add_sheet("Applications", ["id", "parcel_id", "date", "area_ha", "total_cost"], rows)
-
-    if scope in {"active_summary", "all"}:
-        rows = db.execute(
-            text(
-                """
-                SELECT active_name, SUM(active_kg) AS total_kg
-                FROM vw_active_stock
-                GROUP BY active_name
-                ORDER BY active_name ASC
-                """
-            )
-        ).fetchall()
-        add_sheet("ActiveStockSummary", ["active_name", "total_kg"], rows)
-
-    from io import BytesIO
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    from fastapi.responses import StreamingResponse
+    return stock_snapshots.stock_as_of(db, as_of, product_id=product_id, location_id=location_id)
+
+
+@router.get("/inventory/snapshots")
+def list_snapshots(db: Session = Depends(get_db), user=Depends(get_current_user)):
+    rows = db.execute(
+        text(
+            """
+            SELECT s.id, s.as_of, s.created_at, COUNT(sl.lot_id) AS lots
+            FROM stock_snapshots s
+            LEFT JOIN stock_snapshot_lots sl ON sl.snapshot_id = s.id
+            GROUP BY s.id
+            ORDER BY s.as_of DESC
+            """
+        )
+    ).mappings().all()
+    return [dict(r) for r in rows]
+
+
+@router.post("/inventory/snapshots")
+def create_snapshot(
+    as_of: date = Query(None),
+    db: Session = Depends(get_db),
+    user=Depends(require_role("admin")),
+):
+    if as_of:
+        snapshot = stock_snapshots.write_snapshot(db, as_of)
+        db.commit()
+        return {"written": [snapshot]}
+    return {"written": stock_snapshots.ensure_checkpoints(db)}
+
+
+@router.post("/inventory/balances/rebuild")
+def rebuild_balances(db: Session = Depends(get_db), user=Depends(require_role("admin"))):
+    count = lot_balances.rebuild_lot_balances(db)
+    db.commit()
+    return {"lots": count}
+
+
+@router.get("/inventory/balances/verify")
+def verify_balances(db: Session = Depends(get_db), user=Depends(require_role("admin"))):
+    mismatches = lot_balances.verify_lot_balances(db)
+    return {"ok": not mismatches, "mismatches": mismatches}
+
+
+@router.get("/inventory/export.xlsx")
+def export_excel(scope: str = Query("all"), user=Depends(get_current_user)):
+    return _export_response("xlsx", scope)
+
+
+@router.get("/inventory/export.csv")
+def export_csv(scope: str = Query("all"), user=Depends(get_current_user)):
+    return _export_response("csv", scope)
+
+
+@router.get("/inventory/export.parquet")
+def export_parquet(scope: str = Query("all"), user=Depends(get_current_user)):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Exportul Parquet necesita pyarrow")
+    return _export_response("parquet", scope)
+
+
+def _export_response(fmt: str, scope: str):
+    try:
+        chunks, filename = exports.stream_export(fmt, scope)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Scope invalid: {scope}")
+    media_type = exports.FORMATS[fmt] if not filename.endswith(".zip") else "application/zip"
+    # The generator owns its own connection: request-scoped sessions close before streaming starts.
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=inventory_export.xlsx"},
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
     )
 
 
@@ -718,16 +816,10 @@ async def ocr_label(file: UploadFile = File(...), db: Session = Depends(get_db),
 
 @router.post("/mix/check")
 def check_mix(payload: MixCheckRequest, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    a = payload.a_subst
-    b = payload.b_subst
-    rule = db.query(ChemMixRule).filter(ChemMixRule.a_subst == a, ChemMixRule.b_subst == b).first()
-    if not rule:
-        rule = db.query(ChemMixRule).filter(ChemMixRule.a_subst == b, ChemMixRule.b_subst == a).first()
+    rule = mix_rules.rule_status(db, payload.a_subst, payload.b_subst)
     if not rule:
         return {"status": "unknown"}
-    if rule.allowed:
-        return {"status": "allowed", "notes": rule.notes}
-    return {"status": "forbidden", "notes": rule.notes}
+    return {"status": rule["relation"], "notes": rule["note"]}
 
 
 @router.post("/mix/check-items")
@@ -741,38 +833,13 @@ def check_mix_items(
     if not product_ids:
         raise HTTPException(status_code=400, detail="Nu exista produse pentru verificare")
 
-    actives = (
-        db.query(ProductActive, ActiveSubstance)
-        .join(ActiveSubstance, ActiveSubstance.id == ProductActive.active_id)
-        .filter(ProductActive.product_id.in_(product_ids))
-        .all()
-    )
-    active_names = sorted({a.name for _, a in actives})
-    pairs = []
-    worst = "allowed"
-
-    def severity(val: str) -> int:
-        order = {"forbidden": 3, "caution": 2, "unknown": 1, "allowed": 0}
-        return order.get(val, 1)
-
-    for i in range(len(active_names)):
-        for j in range(i + 1, len(active_names)):
-            a = active_names[i]
-            b = active_names[j]
-            rule = db.query(ChemMixRule).filter(ChemMixRule.a_subst == a, ChemMixRule.b_subst == b).first()
-            if not rule:
-                rule = db.query(ChemMixRule).filter(ChemMixRule.a_subst == b, ChemMixRule.b_subst == a).first()
-            if not rule:
-                relation = "unknown"
-                note = None
-            else:
-                relation = "allowed" if rule.allowed else "forbidden"
-                note = rule.notes
-            pairs.append({"a": a, "b": b, "relation": relation, "note": note})
-            if severity(relation) > severity(worst):
-                worst = relation
+    return mix_rules.evaluate_product_mixes(db, [product_ids])[0]
+
 
-    return {"summary": worst, "pairs": pairs}
+@router.post("/mix/check-batch")
+def check_mix_batch(payload: MixBatchCheckRequest, db: Session = Depends(get_db), user=Depends(get_current_user)):
+    # mixes: [[product_id, ...], ...]; results come back in the same order
+    return {"results": mix_rules.evaluate_product_mixes(db, payload.mixes)}
 
 
 def _upsert_chem_product(payload: ChemProductUpsert, db: Session, product_id: int | None = None):
@@ -883,6 +950,31 @@ def _resolve_active(db: Session, active_id: int | None, active_name: str | None)
     return active
 
 
+def _check_lot_line(payload: InventoryLotCreate, product: ChemProduct | None, actives) -> tuple:
+    """Validate one receiving line; returns the normalized uom and expiry date."""
+    if not product:
+        raise HTTPException(status_code=404, detail="Produsul nu exista")
+
+    expires_at = payload.expiry_date or payload.expires_at
+    if expires_at and expires_at < payload.received_date:
+        raise HTTPException(status_code=400, detail="Data expirarii trebuie sa fie dupa data receptiei")
+
+    uom = chem_units.normalize_uom(payload.uom)
+    if uom not in chem_units.ALLOWED_UOM:
+        raise HTTPException(status_code=400, detail="Unitatea trebuie sa fie l sau kg")
+
+    if payload.qty <= 0:
+        raise HTTPException(status_code=400, detail="Cantitatea trebuie sa fie > 0")
+
+    for pa in actives:
+        unit = chem_units.normalize_conc_unit(pa.unit) or pa.unit
+        if unit == "%w/v" and not product.density_kg_per_l:
+            raise HTTPException(status_code=400, detail="Densitatea este obligatorie pentru produse %w/v")
+        if chem_units.requires_density(unit, uom) and not product.density_kg_per_l:
+            raise HTTPException(status_code=400, detail="Densitatea produsului este necesara pentru conversia unitatilor")
+    return uom, expires_at
+
+
 def _ensure_location(db: Session, location_id: int | None, location_name: str | None) -> InventoryLocation:
     if location_id:
         location = db.query(InventoryLocation).filter(InventoryLocation.id == location_id).first()
@@ -899,13 +991,14 @@ def _ensure_location(db: Session, location_id: int | None, location_name: str |
     return location
 
 
-def _product_to_dict(db: Session, product: ChemProduct):
-    actives = (
-        db.query(ProductActive, ActiveSubstance)
-        .join(ActiveSubstance, ActiveSubstance.id == ProductActive.active_id)
-        .filter(ProductActive.product_id == product.id)
-        .all()
+def _products_with_actives(db: Session):
+    # Two queries in total however many products match: products, then all their actives.
+    return db.query(ChemProduct).options(
+        selectinload(ChemProduct.actives).joinedload(ProductActive.active)
     )
+
+
+def _product_to_dict(product: ChemProduct):
     return {
         "id": product.id,
         "trade_name": product.trade_name,
@@ -922,55 +1015,16 @@ def _product_to_dict(db: Session, product: ChemProduct):
         "notes": product.notes,
         "actives": [
             {
-                "active_id": a.id,
-                "active_name": a.name,
+                "active_id": pa.active.id,
+                "active_name": pa.active.name,
                 "concentration": pa.concentration,
                 "unit": pa.unit,
             }
-            for pa, a in actives
+            for pa in product.actives
         ],
     }
 
 
 def _get_lot_balance(db: Session, lot_id: int) -> float:
-    sql = """
-        SELECT COALESCE(SUM(CASE WHEN movement='in' THEN qty WHEN movement='out' THEN -qty ELSE qty END),0) AS qty
-        FROM inventory_txns
-        WHERE lot_id = :lot_id
-    """
-    row = db.execute(text(sql), {"lot_id": lot_id}).mappings().first()
-    return float(row["qty"] or 0)
-
-
-def _allocate_fifo(db: Session, product_id: int, qty: float, uom: str):
-    sql = """
-        SELECT l.id AS lot_id,
-               l.uom,
-               l.expires_at,
-               l.received_date,
-               COALESCE(SUM(CASE WHEN t.movement='in' THEN t.qty WHEN t.movement='out' THEN -t.qty ELSE t.qty END),0) AS qty
-        FROM stock_lots l
-        LEFT JOIN inventory_txns t ON t.lot_id = l.id
-        WHERE l.product_id = :product_id
-        GROUP BY l.id
-        ORDER BY (l.expires_at IS NULL) ASC, l.expires_at ASC, l.received_date ASC, l.id ASC
-    """
-    rows = db.execute(text(sql), {"product_id": product_id}).mappings().all()
-
-    remaining = qty
-    allocations = []
-    for r in rows:
-        if remaining <= 0:
-            break
-        if r["uom"] != uom:
-            continue
-        available = float(r["qty"] or 0)
-        if available <= 0:
-            continue
-        take = available if available < remaining else remaining
-        allocations.append({"lot_id": r["lot_id"], "qty": take})
-        remaining -= take
+    return lot_balances.get_lot_balance(db, lot_id)
 
-    if remaining > 0:
-        return []
-    return allocations
@@ -1,90 +1,264 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+import json
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import Optional
-from shapely.geometry import shape
+from sqlalchemy import JSON, Text, case, cast, func, literal_column, null, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from typing import Iterator, Optional
 from geoalchemy2 import WKTElement
-from db import get_db
+from db import engine, get_db
 from models import Parcel, CadastreCF
-from services import geo
+from services import geo, http_cache, parcel_measure, parcel_overlap, parcel_tiles, parcel_geometry, parcel_search
+from services.change_tracking import VersionedLRU
+from services.pagination import PageParams, encode_cursor, keyset, page_params_for, query_total
 from schemas import ParcelCreate, ParcelUpdate
-from security import get_current_user
+from security import get_current_user, require_role
 
 router = APIRouter(prefix="/parcels", tags=["parcels"])
 
+PARCEL_TABLES = ("parcels", "cadastre_cf")
+# The map view loads one page per viewport without following ``next``; keep the old 200 default.
+parcel_page_params = page_params_for(default_limit=200, max_limit=1000)
+# Only simplified-band pages are cached; bounded by count and by total body size.
+_pages = VersionedLRU(
+    PARCEL_TABLES,
+    maxsize=int(os.getenv("PARCEL_PAGE_CACHE_SIZE", "256")),
+    max_bytes=int(os.getenv("PARCEL_PAGE_CACHE_MB", "64")) * 1024 * 1024,
+)
+
 
 @router.get("")
 def list_parcels(
+    request: Request,
     bbox: Optional[str] = None,
     search: Optional[str] = None,
     zoom: Optional[int] = Query(None, ge=1, le=22),
-    limit: int = Query(200, ge=1, le=1000),
-    offset: int = Query(0, ge=0),
+    page: PageParams = Depends(parcel_page_params),
     db: Session = Depends(get_db),
     user=Depends(get_current_user),
 ):
-    query = db.query(
-        Parcel.id,
-        Parcel.name,
-        Parcel.area_m2,
-        Parcel.culture,
-        Parcel.status,
-        Parcel.cf_id,
-        CadastreCF.cf_number,
-        func.ST_AsGeoJSON(Parcel.geom).label("geojson"),
-    ).join(CadastreCF)
-
-    if search:
-        like = f"%{search}%"
-        query = query.filter((Parcel.name.ilike(like)) | (CadastreCF.cf_number.ilike(like)))
-
+    envelope = None
     if bbox:
         try:
-            minx, miny, maxx, maxy = [float(x) for x in bbox.split(",")]
+            envelope = parcel_geometry.parse_bbox(bbox)
         except Exception:
             raise HTTPException(status_code=400, detail="bbox trebuie să fie minx,miny,maxx,maxy")
-        envelope = func.ST_MakeEnvelope(minx, miny, maxx, maxy, 4326)
-        query = query.filter(func.ST_Intersects(Parcel.geom, envelope))
-
-    total = query.count()
-    rows = query.offset(offset).limit(limit).all()
-
-    features = []
-    for row in rows:
-        geom_obj = None
-        if row.geojson:
-            try:
-                geom_obj = shape(_json_loads(row.geojson))
-            except Exception:
-                geom_obj = None
-        if geom_obj and zoom and zoom < 13:
-            tolerance = 0.0003
-            geom_obj = geom_obj.simplify(tolerance, preserve_topology=True)
-        if geom_obj:
-            geom_json = geo.shape_to_geojson(geom_obj)
-        else:
-            geom_json = None
-        features.append(
-            {
-                "type": "Feature",
-                "geometry": geom_json,
-                "properties": {
-                    "id": row.id,
-                    "name": row.name,
-                    "area_m2": row.area_m2,
-                    "culture": row.culture,
-                    "status": row.status,
-                    "cf_id": row.cf_id,
-                    "cf_number": row.cf_number,
-                },
-            }
+
+    key = ("list", envelope, zoom, search, page.cursor, page.limit, page.with_total, page.total_mode)
+    validators = http_cache.validators(db, PARCEL_TABLES, key)
+    if http_cache.is_not_modified(request, validators):
+        return http_cache.not_modified(validators)
+    geometry = parcel_geometry.geometry_for_zoom(zoom)
+    if geometry is Parcel.geom:
+        # Full resolution (zoom >= 13 or none): too large to cache, streamed as PostGIS renders it.
+        return StreamingResponse(
+            _stream_feature_collection(db, envelope, search, page),
+            media_type="application/json",
+            headers=validators.headers(),
+        )
+    body = _pages.get(
+        db,
+        key,
+        lambda session: _feature_collection_json(session, envelope, geometry, search, page),
+        version=validators.versions,
+    )
+    return Response(content=body, media_type="application/json", headers=validators.headers())
+
+
+FEATURE_COLUMNS = (
+    Parcel.id,
+    Parcel.name,
+    Parcel.area_m2,
+    Parcel.culture,
+    Parcel.status,
+    Parcel.cf_id,
+    CadastreCF.cf_number,
+    Parcel.bbox_min_lon,
+    Parcel.bbox_min_lat,
+    Parcel.bbox_max_lon,
+    Parcel.bbox_max_lat,
+)
+STREAM_BATCH = 200
+
+
+def _parcel_query(db: Session, envelope, search: Optional[str], *columns):
+    query = db.query(*columns).join(CadastreCF, CadastreCF.id == Parcel.cf_id)
+
+    if search:
+        # Same expressions as the trigram indexes (ix_parcels_name_trgm, ix_cadastre_cf_number_trgm).
+        like = parcel_search.like_pattern(search.strip())
+        query = query.filter(
+            func.f_unaccent(Parcel.name).ilike(func.f_unaccent(like)) | CadastreCF.cf_number.ilike(like)
         )
 
-    return {"type": "FeatureCollection", "features": features, "total": total}
+    if envelope:
+        hits = parcel_geometry.bbox_hits(*envelope)
+        query = query.join(hits, hits.c.id == Parcel.id)
+    return query
+
+
+def _page_total(db: Session, envelope, search: Optional[str], page: PageParams):
+    if not page.with_total:
+        return None, None
+    return query_total(_parcel_query(db, envelope, search, Parcel.id), page.total_mode)
+
+
+def _json_object(**fields):
+    args = []
+    for name, value in fields.items():
+        args += [literal_column(f"'{name}'"), value]
+    return func.json_build_object(*args)
+
+
+def _feature_json(p):
+    """One GeoJSON Feature per row of a page subquery, built by PostGIS."""
+    return _json_object(
+        type=literal_column("'Feature'"),
+        bbox=case(
+            (p.bbox_min_lon.is_(None), null()),
+            else_=func.json_build_array(p.bbox_min_lon, p.bbox_min_lat, p.bbox_max_lon, p.bbox_max_lat),
+        ),
+        geometry=cast(p.geojson, JSON),
+        properties=_json_object(
+            id=p.id,
+            name=p.name,
+            area_m2=p.area_m2,
+            culture=p.culture,
+            status=p.status,
+            cf_id=p.cf_id,
+            cf_number=p.cf_number,
+        ),
+    )
+
+
+def _collection_tail(last_id, more: bool, total, exact) -> bytes:
+    tail = {"next": encode_cursor([last_id]) if more else None, "total": total, "total_exact": exact}
+    return b"," + json.dumps(tail)[1:].encode("utf-8")
+
+
+def _collection_statement(db: Session, envelope, geometry, search: Optional[str], page: PageParams):
+    """(features as one JSON text, rows fetched, last id in the page) for a page of LIMIT + 1 rows."""
+    query = _parcel_query(
+        db,
+        envelope,
+        search,
+        *FEATURE_COLUMNS,
+        func.ST_AsGeoJSON(geometry).label("geojson"),
+        func.row_number().over(order_by=Parcel.id).label("rn"),
+    )
+    p = keyset(query, [Parcel.id], page).subquery("page").c
+    in_page = p.rn <= page.limit
+    features = func.coalesce(
+        func.json_agg(aggregate_order_by(_feature_json(p), p.id)).filter(in_page), literal_column("'[]'::json")
+    )
+    # Cast to text so the driver hands the document over as-is instead of decoding it.
+    return select(cast(features, Text), func.count(), func.max(p.id).filter(in_page))
+
+
+def _stream_statement(db: Session, envelope, search: Optional[str], page: PageParams):
+    """(feature JSON text, id) per row of a full-resolution page of LIMIT + 1 rows."""
+    query = _parcel_query(db, envelope, search, *FEATURE_COLUMNS, func.ST_AsGeoJSON(Parcel.geom).label("geojson"))
+    p = keyset(query, [Parcel.id], page).subquery("page").c
+    return select(cast(_feature_json(p), Text), p.id).order_by(p.id)
+
+
+def explain_list(
+    db: Session, envelope, zoom: Optional[int] = None, search: Optional[str] = None, limit: int = 200, analyze: bool = False
+) -> dict:
+    """Plan of the statement ``list_parcels`` runs for the first page of this request."""
+    page = PageParams(cursor=None, limit=limit, with_total=False)
+    geometry = parcel_geometry.geometry_for_zoom(zoom)
+    if geometry is Parcel.geom:
+        statement = _stream_statement(db, envelope, search, page)
+    else:
+        statement = _collection_statement(db, envelope, geometry, search, page)
+    return parcel_geometry.explain_statement(db, statement, analyze=analyze)
+
+
+def _feature_collection_json(db: Session, envelope, geometry, search: Optional[str], page: PageParams) -> bytes:
+    """A page of parcels as a FeatureCollection, built by json_agg and returned as raw bytes.
+
+    Features arrive as one text value and are spliced into the response without
+    being parsed; Python only formats the pagination fields.
+    """
+    total, exact = _page_total(db, envelope, search, page)
+    features, fetched, last_id = db.execute(_collection_statement(db, envelope, geometry, search, page)).one()
+    return (
+        b'{"type":"FeatureCollection","features":'
+        + features.encode("utf-8")
+        + _collection_tail(last_id, fetched > page.limit, total, exact)
+    )
+
+
+def _stream_feature_collection(db: Session, envelope, search: Optional[str], page: PageParams) -> Iterator[bytes]:
+    """Same document as ``_feature_collection_json`` at full resolution, sent in batches of features.
+
+    The total and the cursor check run on the request session; the rows are read
+    from a server-side cursor on the generator's own connection, since the
+    request-scoped session is closed before streaming starts.
+    """
+    total, exact = _page_total(db, envelope, search, page)
+    statement = _stream_statement(db, envelope, search, page)
+
+    def chunks() -> Iterator[bytes]:
+        yield b'{"type":"FeatureCollection","features":['
+        fetched, last_id, separator = 0, None, ""
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, max_row_buffer=STREAM_BATCH).execute(statement)
+            for batch in result.partitions(STREAM_BATCH):
+                parts = []
+                for feature, parcel_id in batch:
+                    fetched += 1
+                    if fetched > page.limit:
+                        break
+                    parts.append(feature)
+                    last_id = parcel_id
+                if parts:
+                    yield (separator + ",".join(parts)).encode("utf-8")
+                    separator = ","
+        yield b"]" + _collection_tail(last_id, fetched > page.limit, total, exact)
+
+    return chunks()
+
+
+@router.get("/search")
+def search_parcels(
+    q: str = Query(..., min_length=2, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    return {"items": parcel_search.search_parcels(db, q, limit)}
+
+
+@router.get("/tiles/{z}/{x}/{y}.mvt")
+def parcel_tile(
+    z: int, x: int, y: int, request: Request, db: Session = Depends(get_db), user=Depends(get_current_user)
+):
+    if not parcel_tiles.valid_tile(z, x, y):
+        raise HTTPException(status_code=400, detail="Tile invalid")
+    validators = http_cache.validators(db, PARCEL_TABLES, ("tile", z, x, y))
+    if http_cache.is_not_modified(request, validators):
+        return http_cache.not_modified(validators)
+    return Response(
+        content=parcel_tiles.get_tile(db, z, x, y, version=validators.versions),
+        media_type=parcel_tiles.MVT_MEDIA_TYPE,
+        headers=validators.headers(),
+    )
 
 
 @router.get("/{parcel_id}")
-def get_parcel(parcel_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
+def get_parcel(
+    parcel_id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    validators = http_cache.validators(db, PARCEL_TABLES, ("parcel", parcel_id))
+    if http_cache.is_not_modified(request, validators):
+        return http_cache.not_modified(validators)
     row = db.query(
         Parcel,
         CadastreCF.cf_number,
@@ -94,6 +268,7 @@ def get_parcel(parcel_id: int, db: Session = Depends(get_db), user=Depends(get_c
         raise HTTPException(status_code=404, detail="Parcel not found")
     parcel = row[0]
     geom_json = _json_loads(row.geojson) if row.geojson else None
+    http_cache.apply(response, validators)
     return {
         "id": parcel.id,
         "cf_id": parcel.cf_id,
@@ -107,7 +282,12 @@ def get_parcel(parcel_id: int, db: Session = Depends(get_db), user=Depends(get_c
 
 
 @router.post("")
-def create_parcel(payload: ParcelCreate, db: Session = Depends(get_db), user=Depends(get_current_user)):
+def create_parcel(
+    payload: ParcelCreate,
+    allow_overlap: bool = Query(False),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
     name = payload.name
     geom_geojson = payload.geom_geojson
     if not name or not geom_geojson:
@@ -128,6 +308,7 @@ def create_parcel(payload: ParcelCreate, db: Session = Depends(get_db), user=Dep
         raise HTTPException(status_code=400, detail="cf_id sau cf_number este obligatoriu")
 
     shape_geom = geo.geojson_to_shape(geom_geojson)
+    conflicts = parcel_overlap.check_write(db, shape_geom, allow_overlap)
     area = geo.area_m2(shape_geom)
     wkt = WKTElement(shape_geom.wkt, srid=4326)
 
@@ -142,11 +323,33 @@ def create_parcel(payload: ParcelCreate, db: Session = Depends(get_db), user=Dep
     db.add(parcel)
     db.commit()
     db.refresh(parcel)
-    return {"id": parcel.id, "area_m2": area}
+    return {"id": parcel.id, "area_m2": area, "overlaps": conflicts}
+
+
+@router.post("/remeasure")
+def remeasure_parcels(
+    after_id: int = Query(0, ge=0),
+    max_chunks: int = Query(5, ge=1, le=50),
+    dry_run: bool = Query(False),
+    db: Session = Depends(get_db),
+    user=Depends(require_role("admin")),
+):
+    """Repair and re-measure up to ``max_chunks`` chunks of parcels after ``after_id``.
+
+    Call again with ``after_id=last_id`` until ``done``; the whole table in one run
+    is ``maintenance.py remeasure-parcels``.
+    """
+    return parcel_measure.remeasure_parcels(db, dry_run=dry_run, after_id=after_id, max_chunks=max_chunks)
 
 
 @router.patch("/{parcel_id}")
-def update_parcel(parcel_id: int, payload: ParcelUpdate, db: Session = Depends(get_db), user=Depends(get_current_user)):
+def update_parcel(
+    parcel_id: int,
+    payload: ParcelUpdate,
+    allow_overlap: bool = Query(False),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
     parcel = db.query(Parcel).filter(Parcel.id == parcel_id).first()
     if not parcel:
         raise HTTPException(status_code=404, detail="Parcel not found")
@@ -156,16 +359,17 @@ def update_parcel(parcel_id: int, payload: ParcelUpdate, db: Session = Depends(g
         if field in data:
             setattr(parcel, field, data[field])
 
+    conflicts = []
     if data.get("geom_geojson"):
         shape_geom = geo.geojson_to_shape(data["geom_geojson"])
+        conflicts = parcel_overlap.check_write(db, shape_geom, allow_overlap, exclude_id=parcel.id)
         parcel.area_m2 = geo.area_m2(shape_geom)
         parcel.geom = WKTElement(shape_geom.wkt, srid=4326)
 
     db.commit()
     db.refresh(parcel)
-    return {"id": parcel.id, "area_m2": parcel.area_m2}
+    return {"id": parcel.id, "area_m2": parcel.area_m2, "overlaps": conflicts}
 
 
 def _json_loads(text: str):
-    import json
     return json.loads(text)
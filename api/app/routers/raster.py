@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
+from datetime import datetime
 from db import get_db
 from models import RasterAsset
 from schemas import RasterIngest
 from security import get_current_user
+from services.pagination import PageParams, page_params, paginate
 
 router = APIRouter(prefix="/raster", tags=["raster"])
 
@@ -18,5 +20,17 @@ def ingest_raster(payload: RasterIngest, db: Session = Depends(get_db), user=Dep
 
 
 @router.get("/assets")
-def list_assets(db: Session = Depends(get_db), user=Depends(get_current_user)):
-    return db.query(RasterAsset).all()
+def list_assets(
+    date_from: datetime = Query(None),
+    date_to: datetime = Query(None),
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    query = db.query(RasterAsset)
+    if date_from:
+        query = query.filter(RasterAsset.captured_at >= date_from)
+    if date_to:
+        query = query.filter(RasterAsset.captured_at <= date_to)
+    # captured_at is nullable, so the cursor walks the primary key instead.
+    return paginate(query, [RasterAsset.id], page, descending=True)
@@ -4,6 +4,7 @@ from sqlalchemy import text
 from datetime import date
 from db import get_db
 from security import get_current_user
+from services import cost_ledger
 
 router = APIRouter(prefix="/reports", tags=["reports"])
 
@@ -14,6 +15,16 @@ def report_active_stock(active: str = Query(...), db: Session = Depends(get_db),
     return active_stock(active=active, db=db, user=user)
 
 
+@router.get("/costs")
+def report_costs(
+    season: int = Query(None),
+    parcel_id: int = Query(None),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    return cost_ledger.rollup(db, season=season, parcel_id=parcel_id)
+
+
 @router.get("/alerts")
 def report_alerts(days: int = Query(90), db: Session = Depends(get_db), user=Depends(get_current_user)):
     sql = """
@@ -22,11 +33,10 @@ def report_alerts(days: int = Query(90), db: Session = Depends(get_db), user=Dep
                l.lot_code,
                l.expires_at,
                l.uom,
-               COALESCE(SUM(CASE WHEN t.movement='in' THEN t.qty WHEN t.movement='out' THEN -t.qty ELSE t.qty END),0) AS qty
+               b.qty
         FROM stock_lots l
-        LEFT JOIN inventory_txns t ON t.lot_id = l.id
-        GROUP BY l.id
-        HAVING COALESCE(SUM(CASE WHEN t.movement='in' THEN t.qty WHEN t.movement='out' THEN -t.qty ELSE t.qty END),0) > 0
+        JOIN lot_balances b ON b.lot_id = l.id
+        WHERE b.qty > 0
         ORDER BY (l.expires_at IS NULL) ASC, l.expires_at ASC;
     """
     rows = db.execute(text(sql)).mappings().all()
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
+from datetime import date
 from db import get_db
 from models import SoilAnalysis
 from schemas import SoilAnalysisCreate
 from security import get_current_user
+from services.pagination import PageParams, page_params, paginate
 
 router = APIRouter(prefix="/soil-analyses", tags=["soil"])
 
@@ -18,5 +20,19 @@ def create_analysis(payload: SoilAnalysisCreate, db: Session = Depends(get_db),
 
 
 @router.get("")
-def list_analyses(db: Session = Depends(get_db), user=Depends(get_current_user)):
-    return db.query(SoilAnalysis).order_by(SoilAnalysis.date.desc()).all()
+def list_analyses(
+    parcel_id: int = Query(None),
+    date_from: date = Query(None),
+    date_to: date = Query(None),
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    query = db.query(SoilAnalysis)
+    if parcel_id:
+        query = query.filter(SoilAnalysis.parcel_id == parcel_id)
+    if date_from:
+        query = query.filter(SoilAnalysis.date >= date_from)
+    if date_to:
+        query = query.filter(SoilAnalysis.date <= date_to)
+    return paginate(query, [SoilAnalysis.date, SoilAnalysis.id], page, descending=True)
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
+from datetime import date
 from db import get_db
 from models import Work, Parcel
 from schemas import WorkCreate, WorkUpdate
 from security import get_current_user
+from services.pagination import PageParams, page_params, paginate
 
 router = APIRouter(tags=["works"])
 
@@ -23,15 +25,18 @@ def create_work(parcel_id: int, payload: WorkCreate, db: Session = Depends(get_d
 @router.get("/parcels/{parcel_id}/works")
 def list_works(
     parcel_id: int,
-    limit: int = Query(100, ge=1, le=1000),
-    offset: int = Query(0, ge=0),
+    date_from: date = Query(None),
+    date_to: date = Query(None),
+    page: PageParams = Depends(page_params),
     db: Session = Depends(get_db),
     user=Depends(get_current_user),
 ):
-    query = db.query(Work).filter(Work.parcel_id == parcel_id).order_by(Work.date.desc())
-    total = query.count()
-    items = query.offset(offset).limit(limit).all()
-    return {"items": items, "total": total}
+    query = db.query(Work).filter(Work.parcel_id == parcel_id)
+    if date_from:
+        query = query.filter(Work.date >= date_from)
+    if date_to:
+        query = query.filter(Work.date <= date_to)
+    return paginate(query, [Work.date, Work.id], page, descending=True)
 
 
 @router.patch("/works/{work_id}")
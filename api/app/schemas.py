@@ -209,6 +209,10 @@ class InventoryLotCreate(BaseModel):
     notes: Optional[str] = None
 
 
+class InventoryLotBulkCreate(BaseModel):
+    lines: List[InventoryLotCreate]
+
+
 class InventoryLotOut(BaseModel):
     id: int
     product_id: int
@@ -312,6 +316,29 @@ class ApplicationCreate(BaseModel):
     status: Optional[str] = "posted"
 
 
+class ApplicationPreviewRequest(BaseModel):
+    area_ha: float
+    items: Optional[List[ApplicationItemIn]] = None
+    mix_id: Optional[int] = None
+
+
+class ApplicationBatchParcel(BaseModel):
+    parcel_id: int
+    area_ha: float
+
+
+class ApplicationBatchCreate(BaseModel):
+    date: date
+    parcels: List[ApplicationBatchParcel]
+    items: Optional[List[ApplicationItemIn]] = None
+    mix_id: Optional[int] = None
+    water_l_per_ha: Optional[float] = None
+    tank_volume_l: Optional[float] = None
+    operator_id: Optional[int] = None
+    machine: Optional[str] = None
+    status: Optional[str] = "posted"
+
+
 class ApplicationOut(BaseModel):
     id: int
     parcel_id: int
@@ -440,6 +467,10 @@ class MixCheckRequest(BaseModel):
     b_subst: str
 
 
+class MixBatchCheckRequest(BaseModel):
+    mixes: List[List[int]]
+
+
 class MixCheckResponse(BaseModel):
     status: str
     notes: Optional[str] = None
@@ -1 +1 @@
-from . import geo, pdf_cf_parser, chem_parse, chem_units, inventory_views, db_migrate, storage
+from . import geo, pdf_cf_parser, chem_parse, chem_units, inventory_views, db_migrate, storage, lot_balances, stock_allocation, exports, pagination, stock_snapshots, active_stock, txn_import, change_tracking, mix_rules, tank_mixes, cost_ledger, parcel_tiles, parcel_geometry, parcel_search, http_cache, cf_import, parcel_measure, parcel_overlap
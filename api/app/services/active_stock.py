@@ -0,0 +1,250 @@
+"""Materialized stock per active substance.
+
+``active_stock_lots`` holds the kg of active in every lot with stock on hand (one
+row per lot x active) and ``active_stock_totals`` the sum per active. Both are kept
+current by triggers in the same transaction as the change that affects them:
+
+* ``lot_balances`` changes (i.e. any inventory txn) refresh the touched lots;
+* ``product_actives`` changes refresh every lot of the affected products;
+* a new ``density_kg_per_l`` on a product or a new ``uom``/product on a lot
+  refreshes the lots concerned.
+
+Totals follow ``active_stock_lots`` through its own statement trigger, so a
+stock check by active substance is a primary-key lookup.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from services.db_migrate import lock_ensure
+
+
+def ensure_active_stock(engine: Engine) -> None:
+    with engine.connect() as conn:
+        lock_ensure(conn, "active_stock")
+        # Shared with vw_active_stock so both convert quantities the same way.
+        conn.exec_driver_sql(
+            """
+            CREATE OR REPLACE FUNCTION fn_active_kg(
+                qty double precision,
+                lot_uom text,
+                concentration double precision,
+                unit text,
+                density double precision
+            ) RETURNS double precision AS $$
+              SELECT CASE
+                WHEN lower(lot_uom) = 'l' AND unit = 'g/L' THEN qty * concentration / 1000
+                WHEN lower(lot_uom) = 'l' AND unit = '%%w/v' THEN qty * concentration / 100
+                WHEN lower(lot_uom) = 'l' AND unit = 'g/kg' THEN qty * density * concentration / 1000
+                WHEN lower(lot_uom) = 'l' AND unit = '%%w/w' THEN qty * density * concentration / 100
+                WHEN lower(lot_uom) = 'kg' AND unit = 'g/kg' THEN qty * concentration / 1000
+                WHEN lower(lot_uom) = 'kg' AND unit = '%%w/w' THEN qty * concentration / 100
+                WHEN lower(lot_uom) = 'kg' AND unit = 'g/L' THEN (qty / NULLIF(density, 0)) * concentration / 1000
+                WHEN lower(lot_uom) = 'kg' AND unit = '%%w/v' THEN (qty / NULLIF(density, 0)) * concentration / 100
+                ELSE NULL
+              END
+            $$ LANGUAGE sql IMMUTABLE;
+            """
+        )
+        conn.exec_driver_sql(
+            """
+            CREATE OR REPLACE FUNCTION fn_active_stock_refresh(p_lot_ids integer[]) RETURNS void AS $$
+            BEGIN
+              DELETE FROM active_stock_lots WHERE lot_id = ANY(p_lot_ids);
+              INSERT INTO active_stock_lots (lot_id, active_id, product_id, lot_qty, active_kg, updated_at)
+              SELECT l.id, pa.active_id, l.product_id, b.qty,
+                     fn_active_kg(b.qty, l.uom, pa.concentration, pa.unit, p.density_kg_per_l),
+                     NOW()
+              FROM stock_lots l
+              JOIN lot_balances b ON b.lot_id = l.id
+              JOIN chem_products p ON p.id = l.product_id
+              JOIN product_actives pa ON pa.product_id = l.product_id
+              WHERE l.id = ANY(p_lot_ids) AND b.qty > 0
+              ORDER BY l.id, pa.active_id;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        )
+        conn.exec_driver_sql(
+            """
+            CREATE OR REPLACE FUNCTION fn_active_stock_totals_apply() RETURNS trigger AS $$
+            BEGIN
+              IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO active_stock_totals (active_id, total_kg, lot_count, updated_at)
+                SELECT active_id, -SUM(COALESCE(active_kg, 0)), -COUNT(*), NOW()
+                FROM old_rows
+                GROUP BY active_id
+                ORDER BY active_id
+                ON CONFLICT (active_id) DO UPDATE
+                SET total_kg = CASE WHEN active_stock_totals.lot_count + EXCLUDED.lot_count = 0 THEN 0
+                                    ELSE active_stock_totals.total_kg + EXCLUDED.total_kg END,
+                    lot_count = active_stock_totals.lot_count + EXCLUDED.lot_count,
+                    updated_at = EXCLUDED.updated_at;
+              END IF;
+              IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO active_stock_totals (active_id, total_kg, lot_count, updated_at)
+                SELECT active_id, SUM(COALESCE(active_kg, 0)), COUNT(*), NOW()
+                FROM new_rows
+                GROUP BY active_id
+                ORDER BY active_id
+                ON CONFLICT (active_id) DO UPDATE
+                SET total_kg = active_stock_totals.total_kg + EXCLUDED.total_kg,
+                    lot_count = active_stock_totals.lot_count + EXCLUDED.lot_count,
+                    updated_at = EXCLUDED.updated_at;
+              END IF;
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        )
+        conn.exec_driver_sql(
+            """
+            CREATE OR REPLACE FUNCTION fn_active_stock_on_balance() RETURNS trigger AS $$
+            BEGIN
+              IF TG_OP = 'DELETE' THEN
+                PERFORM fn_active_stock_refresh(ARRAY(SELECT DISTINCT lot_id FROM old_rows));
+              ELSE
+                PERFORM fn_active_stock_refresh(ARRAY(SELECT DISTINCT lot_id FROM new_rows));
+              END IF;
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        )
+        conn.exec_driver_sql(
+            """
+            CREATE OR REPLACE FUNCTION fn_active_stock_on_product_actives() RETURNS trigger AS $$
+            BEGIN
+              IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM fn_active_stock_refresh(ARRAY(
+                  SELECT l.id FROM stock_lots l WHERE l.product_id IN (SELECT product_id FROM old_rows)
+                ));
+              END IF;
+              IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM fn_active_stock_refresh(ARRAY(
+                  SELECT l.id FROM stock_lots l WHERE l.product_id IN (SELECT product_id FROM new_rows)
+                ));
+              END IF;
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        )
+        conn.exec_driver_sql(
+            """
+            CREATE OR REPLACE FUNCTION fn_active_stock_on_product() RETURNS trigger AS $$
+            BEGIN
+              PERFORM fn_active_stock_refresh(ARRAY(SELECT id FROM stock_lots WHERE product_id = NEW.id));
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        )
+        conn.exec_driver_sql(
+            """
+            CREATE OR REPLACE FUNCTION fn_active_stock_on_lot() RETURNS trigger AS $$
+            BEGIN
+              PERFORM fn_active_stock_refresh(ARRAY[NEW.id]);
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        )
+
+        for table, name in (
+            ("active_stock_lots", "trg_active_stock_totals"),
+            ("lot_balances", "trg_active_stock_balance"),
+            ("product_actives", "trg_active_stock_product_actives"),
+        ):
+            for suffix in ("ins", "upd", "del"):
+                conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}_{suffix} ON {table}")
+        conn.exec_driver_sql("DROP TRIGGER IF EXISTS trg_active_stock_product ON chem_products")
+        conn.exec_driver_sql("DROP TRIGGER IF EXISTS trg_active_stock_lot ON stock_lots")
+
+        for table, name, func in (
+            ("active_stock_lots", "trg_active_stock_totals", "fn_active_stock_totals_apply"),
+            ("lot_balances", "trg_active_stock_balance", "fn_active_stock_on_balance"),
+            ("product_actives", "trg_active_stock_product_actives", "fn_active_stock_on_product_actives"),
+        ):
+            conn.exec_driver_sql(
+                f"""
+                CREATE TRIGGER {name}_ins AFTER INSERT ON {table}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION {func}()
+                """
+            )
+            conn.exec_driver_sql(
+                f"""
+                CREATE TRIGGER {name}_upd AFTER UPDATE ON {table}
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION {func}()
+                """
+            )
+            conn.exec_driver_sql(
+                f"""
+                CREATE TRIGGER {name}_del AFTER DELETE ON {table}
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION {func}()
+                """
+            )
+        # Column triggers cannot use transition tables; these changes are rare and row-sized anyway.
+        conn.exec_driver_sql(
+            """
+            CREATE TRIGGER trg_active_stock_product AFTER UPDATE OF density_kg_per_l ON chem_products
+            FOR EACH ROW WHEN (OLD.density_kg_per_l IS DISTINCT FROM NEW.density_kg_per_l)
+            EXECUTE FUNCTION fn_active_stock_on_product()
+            """
+        )
+        conn.exec_driver_sql(
+            """
+            CREATE TRIGGER trg_active_stock_lot AFTER UPDATE OF uom, product_id ON stock_lots
+            FOR EACH ROW WHEN (OLD.uom IS DISTINCT FROM NEW.uom OR OLD.product_id IS DISTINCT FROM NEW.product_id)
+            EXECUTE FUNCTION fn_active_stock_on_lot()
+            """
+        )
+        conn.commit()
+
+    # First start with existing stock: fill the tables once (checked under the lock).
+    with Session(bind=engine) as db:
+        lock_ensure(db, "active_stock")
+        needs_seed = db.execute(
+            text(
+                "SELECT NOT EXISTS (SELECT 1 FROM active_stock_totals) "
+                "AND EXISTS (SELECT 1 FROM lot_balances WHERE qty > 0)"
+            )
+        ).scalar()
+        if needs_seed:
+            rebuild_active_stock(db)
+            db.commit()
+
+
+def rebuild_active_stock(db: Session) -> int:
+    """Recompute both tables from lot_balances. The caller commits."""
+    # Balance writers wait; the refresh below reads a stable lot_balances.
+    db.execute(text("LOCK TABLE lot_balances IN SHARE MODE"))
+    db.execute(text("DELETE FROM active_stock_lots"))
+    db.execute(text("DELETE FROM active_stock_totals"))
+    db.execute(text("SELECT fn_active_stock_refresh(ARRAY(SELECT lot_id FROM lot_balances WHERE qty > 0))"))
+    return db.execute(text("SELECT COUNT(*) FROM active_stock_lots")).scalar() or 0
+
+
+def verify_active_stock(db: Session, tolerance: float = 1e-6) -> list[dict]:
+    """Compare the stored totals with a fresh aggregation over active_stock_lots."""
+    rows = db.execute(
+        text(
+            """
+            SELECT COALESCE(t.active_id, s.active_id) AS active_id,
+                   COALESCE(t.total_kg, 0) AS stored_kg,
+                   COALESCE(s.total_kg, 0) AS expected_kg
+            FROM active_stock_totals t
+            FULL JOIN (
+                SELECT active_id, SUM(COALESCE(active_kg, 0)) AS total_kg
+                FROM active_stock_lots
+                GROUP BY active_id
+            ) s ON s.active_id = t.active_id
+            WHERE ABS(COALESCE(t.total_kg, 0) - COALESCE(s.total_kg, 0)) > :tolerance
+            ORDER BY 1
+            """
+        ),
+        {"tolerance": tolerance},
+    ).mappings().all()
+    return [dict(r) for r in rows]
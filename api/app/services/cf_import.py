@@ -0,0 +1,175 @@
+"""Bulk import of CF_Points sheets (cf_number, x_stereo70, y_stereo70, order).
+
+The whole sheet is projected, turned into polygons and measured column-wise
+(``geo`` batch functions) before the database is touched. The cadastre numbers
+are then upserted with one INSERT ... ON CONFLICT and the parcels loaded with
+COPY in chunks, so the write transaction lasts as long as a few statements.
+A CF whose points do not make a polygon is reported and skipped; the rest of
+the file is imported.
+"""
+import csv
+import io
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+import shapely
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from services import geo, parcel_overlap
+
+REQUIRED_COLUMNS = ("cf_number", "x_stereo70", "y_stereo70", "order")
+CHUNK = 2000
+
+COPY_SQL = "COPY parcels (cf_id, name, area_m2, geom, status) FROM STDIN WITH (FORMAT csv)"
+
+# progress(phase, done, total)
+ProgressFn = Callable[[str, int, int], None]
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def read_points(content: bytes, filename: str) -> pd.DataFrame:
+    if (filename or "").lower().endswith(".csv"):
+        return pd.read_csv(io.BytesIO(content))
+    return pd.read_excel(io.BytesIO(content), sheet_name="CF_Points")
+
+
+def import_cf_points(
+    db: Session, df: pd.DataFrame, progress: Optional[ProgressFn] = None, allow_overlap: bool = False
+) -> dict:
+    """Create the CFs and one parcel per CF. The caller commits.
+
+    CFs whose polygon overlaps a stored parcel or an earlier imported CF of the
+    file are rejected unless ``allow_overlap``; slivers are only listed on the item.
+    """
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing:
+        raise ImportFormatError(
+            "Sheet-ul CF_Points trebuie să aibă coloanele: " + ", ".join(REQUIRED_COLUMNS)
+        )
+    report = progress or (lambda phase, done, total: None)
+    rows = len(df)
+
+    points = pd.DataFrame(
+        {
+            "cf_number": _cf_numbers(df["cf_number"]),
+            "x": pd.to_numeric(df["x_stereo70"], errors="coerce"),
+            "y": pd.to_numeric(df["y_stereo70"], errors="coerce"),
+            "order": df["order"],
+        }
+    )
+    errors: List[dict] = []
+    unnamed = points["cf_number"].isna()
+    if unnamed.any():
+        errors.append({"cf_number": None, "error": f"{int(unnamed.sum())} puncte fara cf_number"})
+        points = points[~unnamed]
+    points = points.sort_values(["cf_number", "order"], kind="stable")
+
+    rejected = _check_groups(points, errors)
+    points = points[~points["cf_number"].isin(rejected)]
+    report("validate", rows, rows)
+
+    lon, lat = geo.stereo70_to_wgs84_arrays(points["x"].to_numpy(), points["y"].to_numpy())
+    codes, numbers = pd.factorize(points["cf_number"], sort=False)
+    numbers = np.asarray(numbers, dtype=object)
+    polygons = geo.points_to_polygons(lon, lat, codes)
+    degenerate = shapely.is_missing(polygons)
+    for cf_number in numbers[degenerate]:
+        errors.append({"cf_number": cf_number, "error": "Punctele nu formeaza un poligon"})
+    numbers, polygons = numbers[~degenerate], polygons[~degenerate]
+    report("geometry", len(numbers), len(numbers))
+
+    conflicts = parcel_overlap.check_batch(db, polygons)
+    blocked = parcel_overlap.resolve_batch(conflicts, allow_overlap=allow_overlap)
+    for found in conflicts:
+        for c in found:
+            if "batch_index" in c:
+                c["cf_number"] = numbers[c.pop("batch_index")]
+    if blocked.any():
+        for cf_number, found, is_blocked in zip(numbers, conflicts, blocked):
+            if is_blocked:
+                errors.append({"cf_number": cf_number, "error": "Se suprapune cu alte parcele", "conflicts": found})
+        keep = ~blocked
+        numbers, polygons = numbers[keep], polygons[keep]
+        conflicts = [c for c, k in zip(conflicts, keep) if k]
+    report("overlaps", len(numbers), len(numbers))
+    areas = geo.areas_m2(polygons)
+
+    cf_ids = _upsert_cfs(db, numbers.tolist())
+    report("cadastre", len(cf_ids), len(numbers))
+
+    wkb = shapely.to_wkb(shapely.set_srid(polygons, 4326), hex=True, include_srid=True)
+    items = []
+    for start in range(0, len(numbers), CHUNK):
+        chunk = slice(start, start + CHUNK)
+        batch = list(zip(numbers[chunk].tolist(), areas[chunk].tolist(), wkb[chunk].tolist()))
+        _copy_parcels(db, cf_ids, batch)
+        items.extend(
+            {"cf_number": n, "cf_id": cf_ids[n], "area_m2": area, "overlaps": found}
+            for (n, area, _), found in zip(batch, conflicts[chunk])
+        )
+        report("parcels", min(start + CHUNK, len(numbers)), len(numbers))
+
+    errors.sort(key=lambda e: (e["cf_number"] is not None, e["cf_number"] or ""))
+    return {"rows": rows, "imported": len(items), "items": items, "errors": errors}
+
+
+def _cf_numbers(column: pd.Series) -> pd.Series:
+    """CF numbers as trimmed strings; 12345.0 read by pandas from a column with gaps becomes "12345"."""
+    if pd.api.types.is_float_dtype(column) and (column.dropna() % 1 == 0).all():
+        column = column.astype("Int64")
+    numbers = column.astype("string").str.strip()
+    return numbers.mask(numbers == "")
+
+
+def _check_groups(points: pd.DataFrame, errors: List[dict]) -> set:
+    """CFs that cannot become a ring: non-numeric coordinates or fewer than 3 distinct points."""
+    bad_coords = set(points.loc[~(np.isfinite(points["x"]) & np.isfinite(points["y"])), "cf_number"])
+    grouped = points.groupby("cf_number", sort=False)[["x", "y"]]
+    # A ring that repeats its first point at the end has one point less.
+    closed = (grouped.first() == grouped.last()).all(axis=1)
+    distinct = grouped.size() - closed.astype(int)
+    too_few = set(distinct.index[distinct < 3]) - bad_coords
+    for cf_number in sorted(bad_coords):
+        errors.append({"cf_number": cf_number, "error": "Coordonate lipsa sau nenumerice"})
+    for cf_number in sorted(too_few):
+        errors.append({"cf_number": cf_number, "error": "Mai putin de 3 puncte"})
+    return bad_coords | too_few
+
+
+def _upsert_cfs(db: Session, numbers: List[str]) -> Dict[str, int]:
+    if not numbers:
+        return {}
+    db.execute(
+        text(
+            """
+            INSERT INTO cadastre_cf (cf_number)
+            SELECT n FROM unnest(CAST(:numbers AS text[])) AS n
+            ORDER BY n
+            ON CONFLICT (cf_number) DO NOTHING
+            """
+        ),
+        {"numbers": numbers},
+    )
+    return dict(
+        db.execute(
+            text("SELECT cf_number, id FROM cadastre_cf WHERE cf_number = ANY(:numbers)"), {"numbers": numbers}
+        ).all()
+    )
+
+
+def _copy_parcels(db: Session, cf_ids: Dict[str, int], batch: list) -> None:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for cf_number, area, geom in batch:
+        writer.writerow([cf_ids[cf_number], f"CF {cf_number}", area, geom, "active"])
+    buf.seek(0)
+    # Same connection and transaction as the session; the row trigger derives the
+    # map geometries and the statement triggers see one insert per chunk.
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(COPY_SQL, buf)
+    finally:
+        cursor.close()
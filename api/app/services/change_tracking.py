@@ -0,0 +1,158 @@
+"""Per-table change counters for in-process caches.
+
+Every tracked table bumps its row in ``table_versions`` once per write statement
+(trigger, same transaction). A cache remembers the versions it was built from and
+reloads when they move, so it is invalidated by writes from any worker process,
+the maintenance CLI or plain SQL, at the cost of one primary-key read per use.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Generic, Hashable, Optional, Sequence, Tuple, TypeVar
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+TRACKED_TABLES = ("chem_mix_rules", "tank_mixes", "tank_mix_items", "parcels", "cadastre_cf")
+
+T = TypeVar("T")
+
+
+def ensure_change_tracking(engine: Engine, tables: Sequence[str] = TRACKED_TABLES) -> None:
+    with engine.connect() as conn:
+        # changed_at is timestamp without time zone; it holds UTC like the models' utcnow defaults.
+        conn.exec_driver_sql(
+            """
+            CREATE OR REPLACE FUNCTION fn_bump_table_version() RETURNS trigger AS $$
+            BEGIN
+              INSERT INTO table_versions (table_name, version, changed_at)
+              VALUES (TG_TABLE_NAME, 1, NOW() AT TIME ZONE 'UTC')
+              ON CONFLICT (table_name) DO UPDATE
+              SET version = table_versions.version + 1, changed_at = EXCLUDED.changed_at;
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        )
+        for table in tables:
+            conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS trg_{table}_version ON {table}")
+            conn.exec_driver_sql(
+                f"""
+                CREATE TRIGGER trg_{table}_version
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION fn_bump_table_version()
+                """
+            )
+            conn.exec_driver_sql(
+                "INSERT INTO table_versions (table_name, version, changed_at) "
+                "VALUES (%(t)s, 0, NOW() AT TIME ZONE 'UTC') "
+                "ON CONFLICT (table_name) DO NOTHING",
+                {"t": table},
+            )
+        conn.commit()
+
+
+def table_state(db: Session, tables: Sequence[str]) -> Tuple[Tuple[int, ...], Optional[datetime]]:
+    """Versions of ``tables`` (in order) and the latest time one of them changed."""
+    rows = {
+        name: (version, changed_at)
+        for name, version, changed_at in db.execute(
+            text("SELECT table_name, version, changed_at FROM table_versions WHERE table_name = ANY(:tables)"),
+            {"tables": list(tables)},
+        )
+    }
+    versions = tuple(int(rows[t][0]) if t in rows else 0 for t in tables)
+    changed = [changed_at for _, changed_at in rows.values() if changed_at is not None]
+    return versions, max(changed) if changed else None
+
+
+def table_versions(db: Session, tables: Sequence[str]) -> Tuple[int, ...]:
+    return table_state(db, tables)[0]
+
+
+class VersionedCache(Generic[T]):
+    """A value built by ``loader(db)`` and kept until one of ``tables`` changes."""
+
+    def __init__(self, tables: Sequence[str], loader: Callable[[Session], T]):
+        self.tables = tuple(tables)
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._version: Optional[Tuple[int, ...]] = None
+        self._value: Optional[T] = None
+
+    def get(self, db: Session) -> T:
+        version = table_versions(db, self.tables)
+        if version == self._version:
+            return self._value
+        with self._lock:
+            if version != self._version:
+                # The version is read before the data, so a concurrent write can
+                # only cost an extra reload later, never a stale value.
+                self._value = self.loader(db)
+                self._version = version
+            return self._value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._version = None
+            self._value = None
+
+
+class VersionedLRU(Generic[T]):
+    """Keyed values (tiles, rendered responses) dropped together when one of ``tables`` changes.
+
+    ``max_bytes`` also bounds the total ``len()`` of the values (for bytes bodies);
+    a value larger than that on its own is returned but not kept.
+    """
+
+    def __init__(self, tables: Sequence[str], maxsize: int = 1024, max_bytes: Optional[int] = None):
+        self.tables = tuple(tables)
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._version: Optional[Tuple[int, ...]] = None
+        self._entries: "OrderedDict[Hashable, T]" = OrderedDict()
+        self._bytes = 0
+
+    def get(
+        self,
+        db: Session,
+        key: Hashable,
+        loader: Callable[[Session], T],
+        version: Optional[Tuple[int, ...]] = None,
+    ) -> T:
+        """``version`` may be passed when the caller already read ``table_versions(db, self.tables)``."""
+        if version is None:
+            version = table_versions(db, self.tables)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._bytes = 0
+                self._version = version
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = loader(db)
+        with self._lock:
+            # Another request may have seen a newer version meanwhile; keep only current values.
+            if version == self._version and key not in self._entries and self._fits(value):
+                self._entries[key] = value
+                self._bytes += self._size(value)
+                while len(self._entries) > self.maxsize or (
+                    self.max_bytes is not None and self._bytes > self.max_bytes
+                ):
+                    _, dropped = self._entries.popitem(last=False)
+                    self._bytes -= self._size(dropped)
+        return value
+
+    def _size(self, value) -> int:
+        return len(value) if self.max_bytes is not None else 0
+
+    def _fits(self, value) -> bool:
+        return self.max_bytes is None or len(value) <= self.max_bytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._version = None
+            self._entries.clear()
+            self._bytes = 0
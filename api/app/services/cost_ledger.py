@@ -0,0 +1,170 @@
+"""Per-parcel, per-season cost ledger.
+
+``cost_ledger`` holds one row per (parcel, season, category) with the summed
+amount and the number of source rows. Statement triggers on the source tables
+apply the deltas in the same transaction as the write, so reports read the
+ledger instead of scanning works and applications.
+
+The season is the calendar year of the entry's date, like ``parcel_crops.season_year``;
+``fn_cost_season`` is the one place to change that.
+"""
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from services.db_migrate import lock_ensure
+
+# category -> (source table, amount column)
+COST_SOURCES = {
+    "works": ("works", "cost_total"),
+    "applications": ("applications", "total_cost"),
+}
+
+
+def ensure_cost_ledger(engine: Engine) -> None:
+    with engine.connect() as conn:
+        lock_ensure(conn, "cost_ledger")
+        conn.exec_driver_sql(
+            """
+            CREATE OR REPLACE FUNCTION fn_cost_season(d date) RETURNS integer AS $$
+              SELECT EXTRACT(YEAR FROM d)::integer
+            $$ LANGUAGE sql IMMUTABLE;
+            """
+        )
+        for category, (table, column) in COST_SOURCES.items():
+            conn.exec_driver_sql(
+                f"""
+                CREATE OR REPLACE FUNCTION fn_cost_ledger_{table}() RETURNS trigger AS $$
+                BEGIN
+                  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    INSERT INTO cost_ledger (parcel_id, season, category, amount, entries, updated_at)
+                    SELECT parcel_id, fn_cost_season(date), '{category}', -SUM(COALESCE({column}, 0)), -COUNT(*), NOW()
+                    FROM old_rows
+                    GROUP BY 1, 2
+                    ORDER BY 1, 2
+                    ON CONFLICT (parcel_id, season, category) DO UPDATE
+                    SET amount = CASE WHEN cost_ledger.entries + EXCLUDED.entries = 0 THEN 0
+                                      ELSE cost_ledger.amount + EXCLUDED.amount END,
+                        entries = cost_ledger.entries + EXCLUDED.entries,
+                        updated_at = EXCLUDED.updated_at;
+                  END IF;
+                  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO cost_ledger (parcel_id, season, category, amount, entries, updated_at)
+                    SELECT parcel_id, fn_cost_season(date), '{category}', SUM(COALESCE({column}, 0)), COUNT(*), NOW()
+                    FROM new_rows
+                    GROUP BY 1, 2
+                    ORDER BY 1, 2
+                    ON CONFLICT (parcel_id, season, category) DO UPDATE
+                    SET amount = cost_ledger.amount + EXCLUDED.amount,
+                        entries = cost_ledger.entries + EXCLUDED.entries,
+                        updated_at = EXCLUDED.updated_at;
+                  END IF;
+                  RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+                """
+            )
+            conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS trg_cost_ledger_{table}_ins ON {table}")
+            conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS trg_cost_ledger_{table}_upd ON {table}")
+            conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS trg_cost_ledger_{table}_del ON {table}")
+            conn.exec_driver_sql(
+                f"""
+                CREATE TRIGGER trg_cost_ledger_{table}_ins AFTER INSERT ON {table}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION fn_cost_ledger_{table}()
+                """
+            )
+            conn.exec_driver_sql(
+                f"""
+                CREATE TRIGGER trg_cost_ledger_{table}_upd AFTER UPDATE ON {table}
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION fn_cost_ledger_{table}()
+                """
+            )
+            conn.exec_driver_sql(
+                f"""
+                CREATE TRIGGER trg_cost_ledger_{table}_del AFTER DELETE ON {table}
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION fn_cost_ledger_{table}()
+                """
+            )
+        conn.commit()
+
+    # First start with existing works/applications: fill the ledger once (checked under the lock).
+    with Session(bind=engine) as db:
+        lock_ensure(db, "cost_ledger")
+        needs_seed = db.execute(
+            text(
+                "SELECT NOT EXISTS (SELECT 1 FROM cost_ledger) "
+                "AND (EXISTS (SELECT 1 FROM works) OR EXISTS (SELECT 1 FROM applications))"
+            )
+        ).scalar()
+        if needs_seed:
+            rebuild_cost_ledger(db)
+            db.commit()
+
+
+def rebuild_cost_ledger(db: Session) -> int:
+    """Recompute the ledger from the source tables. The caller commits."""
+    tables = ", ".join(table for table, _ in COST_SOURCES.values())
+    db.execute(text(f"LOCK TABLE {tables} IN SHARE MODE"))
+    db.execute(text("DELETE FROM cost_ledger"))
+    sources = " UNION ALL ".join(
+        f"SELECT parcel_id, date, '{category}' AS category, COALESCE({column}, 0) AS amount FROM {table}"
+        for category, (table, column) in COST_SOURCES.items()
+    )
+    result = db.execute(
+        text(
+            f"""
+            INSERT INTO cost_ledger (parcel_id, season, category, amount, entries, updated_at)
+            SELECT parcel_id, fn_cost_season(date), category, SUM(amount), COUNT(*), NOW()
+            FROM ({sources}) s
+            GROUP BY 1, 2, 3
+            """
+        )
+    )
+    return result.rowcount
+
+
+def rollup(db: Session, season: Optional[int] = None, parcel_id: Optional[int] = None) -> dict:
+    """Costs per parcel and season, split by category, plus farm-wide totals per season."""
+    rows = db.execute(
+        text(
+            """
+            SELECT c.parcel_id, p.name AS parcel_name, p.area_m2, c.season, c.category, c.amount
+            FROM cost_ledger c
+            JOIN parcels p ON p.id = c.parcel_id
+            WHERE c.entries > 0
+              AND (CAST(:season AS integer) IS NULL OR c.season = :season)
+              AND (CAST(:parcel_id AS integer) IS NULL OR c.parcel_id = :parcel_id)
+            ORDER BY c.season DESC, c.parcel_id, c.category
+            """
+        ),
+        {"season": season, "parcel_id": parcel_id},
+    ).mappings().all()
+
+    parcels = {}
+    seasons = {}
+    for r in rows:
+        amount = float(r["amount"] or 0)
+        key = (r["parcel_id"], r["season"])
+        entry = parcels.get(key)
+        if entry is None:
+            area_ha = (r["area_m2"] or 0) / 10000
+            entry = parcels[key] = {
+                "parcel_id": r["parcel_id"],
+                "parcel_name": r["parcel_name"],
+                "season": r["season"],
+                "area_ha": area_ha,
+                "categories": {},
+                "total": 0.0,
+            }
+        entry["categories"][r["category"]] = amount
+        entry["total"] += amount
+        farm = seasons.setdefault(r["season"], {"season": r["season"], "categories": {}, "total": 0.0})
+        farm["categories"][r["category"]] = farm["categories"].get(r["category"], 0.0) + amount
+        farm["total"] += amount
+
+    for entry in parcels.values():
+        entry["cost_per_ha"] = entry["total"] / entry["area_ha"] if entry["area_ha"] else None
+    return {"parcels": list(parcels.values()), "seasons": list(seasons.values())}
@@ -1,5 +1,19 @@
+from sqlalchemy import text
 from sqlalchemy.engine import Engine
 
+# pg_advisory_xact_lock(ns, hashtext(name)) around ensure_* installs and first-start seeds.
+ENSURE_LOCK_NAMESPACE = 7303
+
+
+def lock_ensure(conn, name: str) -> None:
+    """Serialize the ``name`` install/seed across workers starting together, until the transaction ends.
+
+    ``conn`` is a Connection or a Session; whoever waits re-checks after getting the lock.
+    """
+    conn.execute(
+        text("SELECT pg_advisory_xact_lock(:ns, hashtext(:name))"), {"ns": ENSURE_LOCK_NAMESPACE, "name": name}
+    )
+
 
 def ensure_schema_extensions(engine: Engine) -> None:
     with engine.connect() as conn:
@@ -39,3 +53,31 @@ def ensure_schema_extensions(engine: Engine) -> None:
             """
         )
         conn.commit()
+
+
+def ensure_indexes(engine: Engine) -> None:
+    # create_all only creates indexes together with new tables; existing ones get them here.
+    with engine.connect() as conn:
+        # Viewport queries compare parcels.geom::geometry with planar envelopes.
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_parcels_geom_geometry ON parcels USING GIST ((geom::geometry))"
+        )
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_works_parcel_date ON works (parcel_id, date, id)")
+        # ix_stock_lots_product_expires already leads with product_id.
+        conn.exec_driver_sql("DROP INDEX IF EXISTS ix_stock_lots_product_id")
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_inventory_txns_lot ON inventory_txns (lot_id, id)")
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_inventory_txns_date ON inventory_txns (date, id)")
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_applications_date ON applications (date, id)")
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_applications_parcel_date ON applications (parcel_id, date, id)"
+        )
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_application_items_application_id ON application_items (application_id)"
+        )
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_harvests_date ON harvests (date, id)")
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_harvests_parcel_date ON harvests (parcel_id, date, id)")
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_soil_analyses_date ON soil_analyses (date, id)")
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_soil_analyses_parcel_date ON soil_analyses (parcel_id, date, id)"
+        )
+        conn.commit()
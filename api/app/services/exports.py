@@ -0,0 +1,396 @@
+"""Streaming inventory exports (XLSX, CSV, Parquet).
+
+Rows come from server-side cursors in batches and every batch is encoded and handed
+to the client before the next one is fetched, so memory stays bounded by the batch
+size whatever the table size. XLSX is written as a raw SpreadsheetML zip stream
+instead of through openpyxl, which needs the whole workbook before it can save.
+"""
+import csv
+import io
+import math
+import zipfile
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable, Iterator, List, Tuple
+from xml.sax.saxutils import escape
+from sqlalchemy import text
+from db import engine
+
+BATCH_SIZE = 2000
+
+FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+@dataclass(frozen=True)
+class ExportScope:
+    sheet: str
+    columns: Tuple[Tuple[str, str], ...]  # (header, type) with type in int/float/str/date/datetime
+    sql: str
+
+    @property
+    def headers(self) -> List[str]:
+        return [name for name, _ in self.columns]
+
+
+EXPORT_SCOPES = {
+    "products": ExportScope(
+        "Products",
+        (("id", "int"), ("trade_name", "str"), ("formulation", "str"), ("supplier", "str"),
+         ("ean13", "str"), ("registration_no", "str"), ("density", "float")),
+        """
+        SELECT id, trade_name, formulation, supplier, ean13, registration_no, density_kg_per_l
+        FROM chem_products
+        ORDER BY trade_name ASC
+        """,
+    ),
+    "actives": ExportScope(
+        "ActiveSubstances",
+        (("id", "int"), ("name", "str"), ("cas_no", "str"), ("synonyms", "str"), ("notes", "str")),
+        """
+        SELECT id, name, cas_no, array_to_string(synonyms, ','), notes
+        FROM active_substances
+        ORDER BY name ASC
+        """,
+    ),
+    "product_actives": ExportScope(
+        "ProductActives",
+        (("id", "int"), ("product_id", "int"), ("product", "str"), ("active_id", "int"),
+         ("active", "str"), ("concentration", "float"), ("unit", "str")),
+        """
+        SELECT pa.id, pa.product_id, p.trade_name, pa.active_id, a.name, pa.concentration, pa.unit
+        FROM product_actives pa
+        JOIN chem_products p ON p.id = pa.product_id
+        JOIN active_substances a ON a.id = pa.active_id
+        """,
+    ),
+    "lots": ExportScope(
+        "Lots",
+        (("id", "int"), ("product_id", "int"), ("product", "str"), ("lot_code", "str"),
+         ("received_date", "date"), ("expires_at", "date"), ("uom", "str"), ("unit_price", "float")),
+        """
+        SELECT l.id, l.product_id, p.trade_name, l.lot_code, l.received_date, l.expires_at, l.uom, l.unit_price
+        FROM stock_lots l
+        JOIN chem_products p ON p.id = l.product_id
+        ORDER BY (l.expires_at IS NULL) ASC, l.expires_at ASC
+        """,
+    ),
+    "txns": ExportScope(
+        "Transactions",
+        (("id", "int"), ("lot_id", "int"), ("movement", "str"), ("qty", "float"), ("uom", "str"),
+         ("date", "date"), ("reason", "str"), ("ref_type", "str"), ("ref_id", "int"), ("created_at", "datetime")),
+        """
+        SELECT id, lot_id, movement::text, qty, uom, date, reason, ref_type, ref_id, created_at
+        FROM inventory_txns
+        ORDER BY created_at DESC
+        """,
+    ),
+    "applications": ExportScope(
+        "Applications",
+        (("id", "int"), ("parcel_id", "int"), ("date", "date"), ("area_ha", "float"), ("total_cost", "float")),
+        """
+        SELECT a.id, a.parcel_id, a.date, a.area_ha, a.total_cost
+        FROM applications a
+        ORDER BY a.date DESC
+        """,
+    ),
+    "active_summary": ExportScope(
+        "ActiveStockSummary",
+        (("active_name", "str"), ("total_kg", "float")),
+        """
+        SELECT a.name AS active_name, t.total_kg
+        FROM active_stock_totals t
+        JOIN active_substances a ON a.id = t.active_id
+        WHERE t.lot_count > 0
+        ORDER BY a.name ASC
+        """,
+    ),
+}
+
+
+def resolve_scopes(scope: str) -> List[str]:
+    if scope == "all":
+        return list(EXPORT_SCOPES)
+    if scope not in EXPORT_SCOPES:
+        raise ValueError(scope)
+    return [scope]
+
+
+def stream_export(fmt: str, scope: str) -> Tuple[Iterator[bytes], str]:
+    """Return (byte iterator, filename) for the export; raises ValueError on bad scope/format."""
+    if fmt not in FORMATS:
+        raise ValueError(fmt)
+    scopes = resolve_scopes(scope)
+    if fmt == "xlsx":
+        return _xlsx_stream(scopes), "inventory_export.xlsx"
+    chunks = _csv_chunks if fmt == "csv" else _parquet_chunks
+    if len(scopes) == 1:
+        return chunks(EXPORT_SCOPES[scopes[0]]), f"inventory_{scopes[0]}.{fmt}"
+    entries = [(f"{name}.{fmt}", chunks(EXPORT_SCOPES[name])) for name in scopes]
+    return _zip_stream(entries), f"inventory_export_{fmt}.zip"
+
+
+def _iter_batches(sql: str, batch_size: int = BATCH_SIZE) -> Iterator[list]:
+    # stream_results makes psycopg2 use a named (server-side) cursor.
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(text(sql))
+        for batch in result.partitions(batch_size):
+            yield batch
+
+
+class _ChunkSink:
+    """Write-only file object that buffers bytes until the generator drains them."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _zip_stream(entries: Iterable[Tuple[str, Iterable[bytes]]]) -> Iterator[bytes]:
+    sink = _ChunkSink()
+    # An unseekable sink makes zipfile write data descriptors after each entry.
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, chunks in entries:
+            # Entry sizes are unknown up front; without ZIP64 headers one past 2 GiB would fail.
+            with zf.open(name, "w", force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _csv_chunks(spec: ExportScope) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(spec.headers)
+    # BOM so Excel opens the UTF-8 file with diacritics intact.
+    yield b"\xef\xbb\xbf" + buf.getvalue().encode("utf-8")
+    for batch in _iter_batches(spec.sql):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(batch)
+        yield buf.getvalue().encode("utf-8")
+
+
+def _parquet_chunks(spec: ExportScope) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "str": pa.string(),
+        "date": pa.date32(),
+        "datetime": pa.timestamp("us"),
+    }
+    schema = pa.schema([(name, arrow_types[kind]) for name, kind in spec.columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for batch in _iter_batches(spec.sql):
+            columns = list(zip(*batch))
+            arrays = [
+                pa.array([_plain(v) for v in col], type=field.type)
+                for col, field in zip(columns, schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+# --- XLSX ------------------------------------------------------------------
+
+_XLSX_STYLE_DATE = 1
+_XLSX_STYLE_DATETIME = 2
+_XLSX_STYLE_BOLD = 3
+_EXCEL_EPOCH = date(1899, 12, 30)
+
+
+def _xlsx_stream(scopes: List[str]) -> Iterator[bytes]:
+    specs = [EXPORT_SCOPES[s] for s in scopes]
+    entries = [
+        ("[Content_Types].xml", [_xlsx_content_types(len(specs))]),
+        ("_rels/.rels", [_XLSX_ROOT_RELS]),
+        ("xl/workbook.xml", [_xlsx_workbook(specs)]),
+        ("xl/_rels/workbook.xml.rels", [_xlsx_workbook_rels(len(specs))]),
+        ("xl/styles.xml", [_XLSX_STYLES]),
+    ]
+    entries += [(f"xl/worksheets/sheet{i}.xml", _xlsx_sheet_chunks(spec)) for i, spec in enumerate(specs, 1)]
+    return _zip_stream(entries)
+
+
+def _xlsx_sheet_chunks(spec: ExportScope) -> Iterator[bytes]:
+    header = "".join(_xlsx_cell(h, _XLSX_STYLE_BOLD) for h in spec.headers)
+    yield (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<sheetViews><sheetView workbookViewId="0">'
+        '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+        "</sheetView></sheetViews>"
+        f'<sheetData><row r="1">{header}</row>'
+    ).encode("utf-8")
+    row_num = 1
+    for batch in _iter_batches(spec.sql):
+        parts = []
+        for row in batch:
+            row_num += 1
+            parts.append(f'<row r="{row_num}">{"".join(_xlsx_cell(v) for v in row)}</row>')
+        yield "".join(parts).encode("utf-8")
+    last_col = _xlsx_column(len(spec.columns))
+    yield f'</sheetData><autoFilter ref="A1:{last_col}{row_num}"/></worksheet>'.encode("utf-8")
+
+
+def _xlsx_cell(value, style: int = 0) -> str:
+    s = f' s="{style}"' if style else ""
+    if value is None:
+        return "<c/>"
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (float, Decimal)) and not math.isfinite(value):
+        # NaN/inf are not valid cell values; Excel would refuse to open the sheet.
+        return "<c/>"
+    if isinstance(value, (int, float, Decimal)):
+        return f"<c{s}><v>{value}</v></c>"
+    if isinstance(value, datetime):
+        delta = value - datetime(1899, 12, 30)
+        serial = delta.days + delta.seconds / 86400 + delta.microseconds / 86400e6
+        return f'<c s="{_XLSX_STYLE_DATETIME}"><v>{serial}</v></c>'
+    if isinstance(value, date):
+        return f'<c s="{_XLSX_STYLE_DATE}"><v>{(value - _EXCEL_EPOCH).days}</v></c>'
+    return f'<c t="inlineStr"{s}><is><t xml:space="preserve">{_xml_text(str(value))}</t></is></c>'
+
+
+def _xml_text(value: str) -> str:
+    # XML 1.0 forbids most control characters even when escaped.
+    cleaned = "".join(ch for ch in value if ch in "\t\n\r" or ord(ch) >= 32)
+    return escape(cleaned)
+
+
+def _xlsx_column(n: int) -> str:
+    name = ""
+    while n:
+        n, rem = divmod(n - 1, 26)
+        name = chr(65 + rem) + name
+    return name
+
+
+def _xlsx_content_types(sheet_count: int) -> bytes:
+    sheets = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, sheet_count + 1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        f"{sheets}</Types>"
+    ).encode("utf-8")
+
+
+def _xlsx_workbook(specs: List[ExportScope]) -> bytes:
+    sheets = "".join(
+        f'<sheet name="{escape(spec.sheet)}" sheetId="{i}" r:id="rId{i}"/>' for i, spec in enumerate(specs, 1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f"<sheets>{sheets}</sheets></workbook>"
+    ).encode("utf-8")
+
+
+def _xlsx_workbook_rels(sheet_count: int) -> bytes:
+    rels = "".join(
+        f'<Relationship Id="rId{i}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, sheet_count + 1)
+    )
+    styles_id = sheet_count + 1
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f"{rels}"
+        f'<Relationship Id="rId{styles_id}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        "</Relationships>"
+    ).encode("utf-8")
+
+
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    "</Relationships>"
+).encode("utf-8")
+
+# cellXfs: 0 default, 1 date, 2 date-time, 3 bold header.
+_XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    "</cellXfs>"
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    "</styleSheet>"
+).encode("utf-8")
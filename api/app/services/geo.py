@@ -1,19 +1,43 @@
-from typing import List, Tuple
+import json
+import threading
+from typing import List, Sequence, Tuple
+import numpy as np
+import shapely
 from shapely.geometry import Polygon, shape, mapping
 from shapely.ops import transform
 from shapely.validation import make_valid
 from pyproj import Transformer
 
-TRANSFORM_31700_TO_4326 = Transformer.from_crs("EPSG:31700", "EPSG:4326", always_xy=True)
-TRANSFORM_4326_TO_32634 = Transformer.from_crs("EPSG:4326", "EPSG:32634", always_xy=True)
+STEREO70 = "EPSG:31700"
+WGS84 = "EPSG:4326"
+UTM34N = "EPSG:32634"
+POLYGON_TYPE_ID = 3
+
+# pyproj transformers must not be shared between threads; each worker thread builds its own.
+_local = threading.local()
+
+
+def transformer(src: str, dst: str) -> Transformer:
+    cache = getattr(_local, "transformers", None)
+    if cache is None:
+        cache = _local.transformers = {}
+    key = (src, dst)
+    if key not in cache:
+        cache[key] = Transformer.from_crs(src, dst, always_xy=True)
+    return cache[key]
+
+
+def stereo70_to_wgs84_arrays(x: Sequence[float], y: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """Whole coordinate columns (e.g. a CF_Points sheet) in one call; returns (lon, lat)."""
+    return transformer(STEREO70, WGS84).transform(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
 
 
 def stereo70_to_wgs84(points: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
-    out = []
-    for x, y in points:
-        lon, lat = TRANSFORM_31700_TO_4326.transform(x, y)
-        out.append((lon, lat))
-    return out
+    if not points:
+        return []
+    xy = np.asarray(points, dtype=float)
+    lon, lat = stereo70_to_wgs84_arrays(xy[:, 0], xy[:, 1])
+    return list(zip(lon.tolist(), lat.tolist()))
 
 
 def points_to_polygon(points_wgs84: List[Tuple[float, float]]) -> Polygon:
@@ -29,6 +53,68 @@ def points_to_polygon(points_wgs84: List[Tuple[float, float]]) -> Polygon:
     return poly
 
 
+def points_to_polygons(lon: np.ndarray, lat: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """Batch ``points_to_polygon``: point i belongs to ring ``indices[i]`` (0..n-1, non-decreasing).
+
+    Every ring needs at least 3 distinct points; rings are closed, invalid
+    polygons repaired and reduced to their largest part. None where nothing
+    polygonal is left.
+    """
+    if not len(indices):
+        return np.empty(0, dtype=object)
+    rings = shapely.linearrings(np.column_stack([lon, lat]), indices=indices)
+    return repair_polygons(shapely.polygons(rings))
+
+
+def validate_polygons(geoms) -> Tuple[np.ndarray, np.ndarray]:
+    """(repaired polygons, reason each input was invalid or None) for N geometries at once.
+
+    Invalid geometries go through make_valid and every result is reduced to its
+    largest polygon, as ``geojson_to_shape`` does for one geometry. None where
+    nothing polygonal is left.
+    """
+    geoms = np.array(geoms, dtype=object)
+    invalid = ~shapely.is_valid(geoms) & ~shapely.is_missing(geoms)
+    reasons = np.full(len(geoms), None, dtype=object)
+    if invalid.any():
+        reasons[invalid] = shapely.is_valid_reason(geoms[invalid])
+        geoms[invalid] = shapely.make_valid(geoms[invalid])
+    return largest_polygons(geoms), reasons
+
+
+def repair_polygons(geoms) -> np.ndarray:
+    return validate_polygons(geoms)[0]
+
+
+def largest_polygons(geoms) -> np.ndarray:
+    """Each geometry reduced to its largest polygon (the polygon itself when it is one)."""
+    out = np.array(geoms, dtype=object)
+    multi = np.flatnonzero(shapely.get_type_id(out) != POLYGON_TYPE_ID)
+    if not len(multi):
+        return out
+    parts, owner = shapely.get_parts(out[multi], return_index=True)
+    # make_valid can nest a MultiPolygon inside a GeometryCollection.
+    while len(parts) and (shapely.get_type_id(parts) > POLYGON_TYPE_ID).any():
+        nested = shapely.get_type_id(parts) > POLYGON_TYPE_ID
+        sub_parts, sub_owner = shapely.get_parts(parts[nested], return_index=True)
+        parts = np.concatenate([parts[~nested], sub_parts])
+        owner = np.concatenate([owner[~nested], owner[nested][sub_owner]])
+    areas = np.where(shapely.get_type_id(parts) == POLYGON_TYPE_ID, shapely.area(parts), 0.0)
+    best = np.full(len(multi), None, dtype=object)
+    # Largest part first within each owner, then keep the first row of every owner.
+    order = np.lexsort((-areas, owner))
+    first = order[np.r_[True, owner[order][1:] != owner[order][:-1]]] if len(order) else order
+    first = first[areas[first] > 0]
+    best[owner[first]] = parts[first]
+    out[multi] = best
+    return out
+
+
+def shapes_from_geojson(geojsons: Sequence[dict]) -> np.ndarray:
+    """Batch ``shape``: GeoJSON geometry dicts parsed by GEOS in one call."""
+    return shapely.from_geojson([json.dumps(g) for g in geojsons])
+
+
 def geojson_to_shape(geojson: dict):
     geom = shape(geojson)
     if not geom.is_valid:
@@ -43,5 +129,15 @@ def shape_to_geojson(geom) -> dict:
 
 
 def area_m2(geom) -> float:
-    projected = transform(TRANSFORM_4326_TO_32634.transform, geom)
+    projected = transform(transformer(WGS84, UTM34N).transform, geom)
     return projected.area
+
+
+def areas_m2(geoms) -> np.ndarray:
+    """Batch ``area_m2``: all vertices are reprojected in one call. NaN for missing geometries."""
+    to_utm = transformer(WGS84, UTM34N)
+
+    def project(xy: np.ndarray) -> np.ndarray:
+        return np.column_stack(to_utm.transform(xy[:, 0], xy[:, 1]))
+
+    return shapely.area(shapely.transform(np.asarray(geoms, dtype=object), project))
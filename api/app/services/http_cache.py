@@ -0,0 +1,68 @@
+"""Conditional GET for payloads derived from tracked tables.
+
+Validators come from ``table_versions``: the ETag hashes the table versions with
+the request key (path id, bbox, zoom, ...), Last-Modified is the latest
+``changed_at``. Checking them costs one primary-key read, so an unchanged map
+request is answered with 304 before any geometry is loaded.
+"""
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Hashable, Optional, Sequence, Tuple
+from fastapi import Request, Response
+from sqlalchemy.orm import Session
+from services.change_tracking import table_state
+
+
+@dataclass(frozen=True)
+class Validators:
+    versions: Tuple[int, ...]
+    etag: str
+    last_modified: Optional[datetime]
+
+    def headers(self) -> Dict[str, str]:
+        headers = {"ETag": self.etag, "Cache-Control": "private, no-cache"}
+        if self.last_modified is not None:
+            headers["Last-Modified"] = format_datetime(self.last_modified, usegmt=True)
+        return headers
+
+
+def validators(db: Session, tables: Sequence[str], key: Hashable) -> Validators:
+    versions, changed_at = table_state(db, tables)
+    digest = hashlib.sha1(repr((tuple(tables), versions, key)).encode()).hexdigest()[:24]
+    if changed_at is not None:
+        # fn_bump_table_version stores NOW() AT TIME ZONE 'UTC'; HTTP dates have second resolution.
+        changed_at = changed_at.replace(tzinfo=timezone.utc, microsecond=0)
+    return Validators(versions=versions, etag=f'W/"{digest}"', last_modified=changed_at)
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request: Request, v: Validators) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison; If-Modified-Since is ignored when If-None-Match is present.
+        tags = {_opaque(t) for t in if_none_match.split(",")}
+        return "*" in tags or _opaque(v.etag) in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and v.last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return v.last_modified <= since
+    return False
+
+
+def not_modified(v: Validators) -> Response:
+    return Response(status_code=304, headers=v.headers())
+
+
+def apply(response: Response, v: Validators) -> None:
+    response.headers.update(v.headers())
@@ -12,19 +12,9 @@ def ensure_inventory_views(engine: Engine) -> None:
                 l.uom,
                 l.expires_at,
                 l.received_date,
-                COALESCE(
-                    SUM(
-                        CASE
-                            WHEN t.movement = 'in' THEN t.qty
-                            WHEN t.movement = 'out' THEN -t.qty
-                            ELSE t.qty
-                        END
-                    ),
-                    0
-                ) AS qty
+                COALESCE(b.qty, 0) AS qty
             FROM stock_lots l
-            LEFT JOIN inventory_txns t ON t.lot_id = l.id
-            GROUP BY l.id;
+            LEFT JOIN lot_balances b ON b.lot_id = l.id;
             """
         )
         conn.exec_driver_sql(
@@ -43,17 +33,7 @@ def ensure_inventory_views(engine: Engine) -> None:
                 pa.concentration,
                 pa.unit,
                 p.density_kg_per_l,
-                CASE
-                    WHEN lower(l.uom) = 'l' AND pa.unit = 'g/L' THEN lb.qty * pa.concentration / 1000
-                    WHEN lower(l.uom) = 'l' AND pa.unit = '%%w/v' THEN lb.qty * pa.concentration / 100
-                    WHEN lower(l.uom) = 'l' AND pa.unit = 'g/kg' THEN lb.qty * p.density_kg_per_l * pa.concentration / 1000
-                    WHEN lower(l.uom) = 'l' AND pa.unit = '%%w/w' THEN lb.qty * p.density_kg_per_l * pa.concentration / 100
-                    WHEN lower(l.uom) = 'kg' AND pa.unit = 'g/kg' THEN lb.qty * pa.concentration / 1000
-                    WHEN lower(l.uom) = 'kg' AND pa.unit = '%%w/w' THEN lb.qty * pa.concentration / 100
-                    WHEN lower(l.uom) = 'kg' AND pa.unit = 'g/L' THEN (lb.qty / NULLIF(p.density_kg_per_l, 0)) * pa.concentration / 1000
-                    WHEN lower(l.uom) = 'kg' AND pa.unit = '%%w/v' THEN (lb.qty / NULLIF(p.density_kg_per_l, 0)) * pa.concentration / 100
-                    ELSE NULL
-                END AS active_kg
+                fn_active_kg(lb.qty, l.uom, pa.concentration, pa.unit, p.density_kg_per_l) AS active_kg
             FROM vw_lot_balance lb
             JOIN stock_lots l ON l.id = lb.lot_id
             JOIN chem_products p ON p.id = l.product_id
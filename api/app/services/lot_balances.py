@@ -0,0 +1,143 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from services.db_migrate import lock_ensure
+
+# Signed quantity of a transaction: 'in' adds, 'out' subtracts, 'adjust' carries its own sign.
+SIGNED_QTY_SQL = "CASE WHEN movement = 'out' THEN -qty ELSE qty END"
+
+
+def ensure_lot_balances(engine: Engine) -> None:
+    """Install the triggers that keep lot_balances in step with inventory_txns.
+
+    The triggers are statement-level so bulk inserts update each lot once, and they run
+    inside the writing transaction, so a balance is never visible without its txns.
+    """
+    with engine.connect() as conn:
+        lock_ensure(conn, "lot_balances")
+        conn.exec_driver_sql(
+            f"""
+            CREATE OR REPLACE FUNCTION fn_lot_balances_apply() RETURNS trigger AS $$
+            BEGIN
+              IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO lot_balances (lot_id, qty, updated_at)
+                SELECT lot_id, -SUM({SIGNED_QTY_SQL}), NOW()
+                FROM old_rows
+                GROUP BY lot_id
+                ORDER BY lot_id
+                ON CONFLICT (lot_id) DO UPDATE
+                SET qty = lot_balances.qty + EXCLUDED.qty, updated_at = EXCLUDED.updated_at;
+              END IF;
+              IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO lot_balances (lot_id, qty, updated_at)
+                SELECT lot_id, SUM({SIGNED_QTY_SQL}), NOW()
+                FROM new_rows
+                GROUP BY lot_id
+                ORDER BY lot_id
+                ON CONFLICT (lot_id) DO UPDATE
+                SET qty = lot_balances.qty + EXCLUDED.qty, updated_at = EXCLUDED.updated_at;
+              END IF;
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        )
+        conn.exec_driver_sql("DROP TRIGGER IF EXISTS trg_lot_balances_ins ON inventory_txns")
+        conn.exec_driver_sql("DROP TRIGGER IF EXISTS trg_lot_balances_upd ON inventory_txns")
+        conn.exec_driver_sql("DROP TRIGGER IF EXISTS trg_lot_balances_del ON inventory_txns")
+        conn.exec_driver_sql(
+            """
+            CREATE TRIGGER trg_lot_balances_ins AFTER INSERT ON inventory_txns
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION fn_lot_balances_apply()
+            """
+        )
+        conn.exec_driver_sql(
+            """
+            CREATE TRIGGER trg_lot_balances_upd AFTER UPDATE ON inventory_txns
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION fn_lot_balances_apply()
+            """
+        )
+        conn.exec_driver_sql(
+            """
+            CREATE TRIGGER trg_lot_balances_del AFTER DELETE ON inventory_txns
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION fn_lot_balances_apply()
+            """
+        )
+        conn.commit()
+
+    # First start after the table was introduced: seed it from the existing history.
+    # Checked under the lock, so a worker that waited sees the seed already done.
+    with Session(bind=engine) as db:
+        lock_ensure(db, "lot_balances")
+        needs_seed = db.execute(
+            text(
+                "SELECT NOT EXISTS (SELECT 1 FROM lot_balances) AND EXISTS (SELECT 1 FROM inventory_txns)"
+            )
+        ).scalar()
+        if needs_seed:
+            rebuild_lot_balances(db)
+            db.commit()
+
+
+def rebuild_lot_balances(db: Session) -> int:
+    """Recompute every lot balance from inventory_txns. The caller commits."""
+    # SHARE mode blocks concurrent txn writers for the duration, but not readers.
+    db.execute(text("LOCK TABLE inventory_txns IN SHARE MODE"))
+    db.execute(text("DELETE FROM lot_balances"))
+    result = db.execute(
+        text(
+            f"""
+            INSERT INTO lot_balances (lot_id, qty, updated_at)
+            SELECT l.id, COALESCE(t.qty, 0), NOW()
+            FROM stock_lots l
+            LEFT JOIN (
+                SELECT lot_id, SUM({SIGNED_QTY_SQL}) AS qty
+                FROM inventory_txns
+                GROUP BY lot_id
+            ) t ON t.lot_id = l.id
+            """
+        )
+    )
+    return result.rowcount
+
+
+def verify_lot_balances(db: Session, tolerance: float = 1e-6) -> list[dict]:
+    """Return the lots whose stored balance differs from the sum of their txns."""
+    rows = db.execute(
+        text(
+            f"""
+            SELECT l.id AS lot_id,
+                   COALESCE(b.qty, 0) AS stored_qty,
+                   COALESCE(t.qty, 0) AS expected_qty
+            FROM stock_lots l
+            LEFT JOIN lot_balances b ON b.lot_id = l.id
+            LEFT JOIN (
+                SELECT lot_id, SUM({SIGNED_QTY_SQL}) AS qty
+                FROM inventory_txns
+                GROUP BY lot_id
+            ) t ON t.lot_id = l.id
+            WHERE ABS(COALESCE(b.qty, 0) - COALESCE(t.qty, 0)) > :tolerance
+            ORDER BY l.id
+            """
+        ),
+        {"tolerance": tolerance},
+    ).mappings().all()
+    return [
+        {
+            "lot_id": r["lot_id"],
+            "stored_qty": float(r["stored_qty"]),
+            "expected_qty": float(r["expected_qty"]),
+        }
+        for r in rows
+    ]
+
+
+def get_lot_balance(db: Session, lot_id: int) -> float:
+    row = db.execute(
+        text("SELECT qty FROM lot_balances WHERE lot_id = :lot_id"),
+        {"lot_id": lot_id},
+    ).first()
+    return float(row[0]) if row else 0.0
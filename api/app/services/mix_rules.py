@@ -0,0 +1,89 @@
+"""Tank-mix compatibility checks against an in-process index of ``chem_mix_rules``.
+
+Rules are keyed by the unordered pair of active names, so a mix of n actives is
+evaluated with dictionary lookups only. The index is rebuilt when the rules
+table changes (see ``change_tracking``).
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from services.change_tracking import VersionedCache
+
+Pair = Tuple[str, str]
+
+SEVERITY = {"forbidden": 3, "caution": 2, "unknown": 1, "allowed": 0}
+
+
+def pair_key(a: str, b: str) -> Pair:
+    return (a, b) if a <= b else (b, a)
+
+
+def severity(relation: str) -> int:
+    return SEVERITY.get(relation, 1)
+
+
+def _load_index(db: Session) -> Dict[Pair, dict]:
+    index: Dict[Pair, dict] = {}
+    for a, b, allowed, notes in db.execute(
+        text("SELECT a_subst, b_subst, allowed, notes FROM chem_mix_rules ORDER BY id")
+    ):
+        relation = "allowed" if allowed else "forbidden"
+        key = pair_key(a, b)
+        current = index.get(key)
+        # A pair stored in both directions with different verdicts: the stricter one wins.
+        if current is None or severity(relation) > severity(current["relation"]):
+            index[key] = {"relation": relation, "note": notes}
+    return index
+
+
+_rules = VersionedCache(("chem_mix_rules",), _load_index)
+
+
+def get_index(db: Session) -> Dict[Pair, dict]:
+    return _rules.get(db)
+
+
+def check_pair(index: Dict[Pair, dict], a: str, b: str) -> dict:
+    return index.get(pair_key(a, b)) or {"relation": "unknown", "note": None}
+
+
+def evaluate_mix(index: Dict[Pair, dict], active_names: Iterable[str]) -> dict:
+    names = sorted(set(active_names))
+    pairs = []
+    worst = "allowed"
+    for i in range(len(names)):
+        for j in range(i + 1, len(names)):
+            rule = check_pair(index, names[i], names[j])
+            pairs.append({"a": names[i], "b": names[j], "relation": rule["relation"], "note": rule["note"]})
+            if severity(rule["relation"]) > severity(worst):
+                worst = rule["relation"]
+    return {"summary": worst, "pairs": pairs}
+
+
+def active_names_by_product(db: Session, product_ids: Sequence[int]) -> Dict[int, List[str]]:
+    names: Dict[int, List[str]] = {}
+    for product_id, name in db.execute(
+        text(
+            """
+            SELECT pa.product_id, a.name
+            FROM product_actives pa
+            JOIN active_substances a ON a.id = pa.active_id
+            WHERE pa.product_id = ANY(:product_ids)
+            """
+        ),
+        {"product_ids": list(product_ids)},
+    ):
+        names.setdefault(product_id, []).append(name)
+    return names
+
+
+def evaluate_product_mixes(db: Session, mixes: Sequence[Sequence[int]]) -> List[dict]:
+    """Check several candidate mixes (lists of product ids) with two queries in total."""
+    index = get_index(db)
+    names = active_names_by_product(db, sorted({pid for mix in mixes for pid in mix}))
+    return [evaluate_mix(index, (n for pid in mix for n in names.get(pid, []))) for mix in mixes]
+
+
+def rule_status(db: Session, a: str, b: str) -> Optional[dict]:
+    """The rule for one pair, or None when there is none."""
+    return get_index(db).get(pair_key(a, b))
@@ -0,0 +1,147 @@
+"""Keyset (cursor) pagination shared by the list endpoints.
+
+A page is fetched with ``WHERE (k1, k2) < (:v1, :v2) ORDER BY k1 DESC, k2 DESC LIMIT n+1``
+so the cost of a page does not depend on how deep it is. The cursor is the key of the
+last row, base64-encoded; clients treat it as opaque and send it back as ``cursor``.
+
+Totals are only computed on request (``with_total``): ``total_mode=exact`` counts,
+``capped`` counts up to TOTAL_CAP rows and ``estimate`` asks the planner.
+"""
+import base64
+import json
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Literal, Optional, Sequence, Tuple
+from fastapi import HTTPException, Query
+from sqlalchemy import func, select, text, tuple_
+
+TOTAL_CAP = 10000
+
+
+@dataclass
+class PageParams:
+    cursor: Optional[str]
+    limit: int
+    with_total: bool
+    total_mode: str = "exact"
+
+
+def page_params_for(default_limit: int = 100, max_limit: int = 1000):
+    """A ``page_params`` dependency with its own default and maximum page size."""
+
+    def dependency(
+        cursor: Optional[str] = Query(None),
+        limit: int = Query(default_limit, ge=1, le=max_limit),
+        with_total: bool = Query(False),
+        total_mode: Literal["exact", "capped", "estimate"] = Query("exact"),
+    ) -> PageParams:
+        return PageParams(cursor=cursor, limit=limit, with_total=with_total, total_mode=total_mode)
+
+    return dependency
+
+
+page_params = page_params_for()
+
+
+def encode_cursor(values: Sequence) -> str:
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError(cursor)
+        return [_decode_value(v) for v in values]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor invalid")
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"t": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "t" in value:
+            return datetime.fromisoformat(value["t"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+        raise ValueError(value)
+    return value
+
+
+def estimate_rows(db, statement, params: Optional[dict] = None) -> int:
+    """Planner row estimate for a Core/ORM select or an SQL string with :named params."""
+    if isinstance(statement, str):
+        plan = db.execute(text("EXPLAIN (FORMAT JSON) " + statement), params or {}).scalar()
+    else:
+        compiled = statement.compile(dialect=db.get_bind().dialect)
+        plan = db.connection().exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params).scalar()
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def query_total(query, mode: str) -> Tuple[int, bool]:
+    """(total, exact) for an ORM query according to ``mode``."""
+    query = query.order_by(None)
+    if mode == "estimate":
+        return estimate_rows(query.session, query.statement), False
+    if mode == "capped":
+        counted = query.session.execute(
+            select(func.count()).select_from(query.limit(TOTAL_CAP + 1).subquery())
+        ).scalar()
+        return min(counted, TOTAL_CAP), counted <= TOTAL_CAP
+    return query.count(), True
+
+
+def sql_total(db, sql: str, params: dict, mode: str) -> Tuple[int, bool]:
+    """Same as query_total for a raw ``SELECT`` (no ORDER BY / LIMIT)."""
+    if mode == "estimate":
+        return estimate_rows(db, sql, params), False
+    if mode == "capped":
+        counted = db.execute(text(f"SELECT COUNT(*) FROM ({sql} LIMIT {TOTAL_CAP + 1}) t"), params).scalar()
+        return min(counted, TOTAL_CAP), counted <= TOTAL_CAP
+    return db.execute(text(f"SELECT COUNT(*) FROM ({sql}) t"), params).scalar(), True
+
+
+def page_of_rows(
+    rows: list, key_names: Sequence[str], page: PageParams, total: Optional[Tuple[int, bool]] = None
+) -> dict:
+    """Trim ``rows`` (fetched with LIMIT page.limit + 1) to a page of plain dicts."""
+    next_cursor = None
+    if len(rows) > page.limit:
+        rows = rows[: page.limit]
+        next_cursor = encode_cursor([rows[-1][k] for k in key_names])
+    count, exact = total if total else (None, None)
+    return {"items": rows, "next": next_cursor, "total": count, "total_exact": exact}
+
+
+def keyset(query, keys: Sequence, page: PageParams, descending: bool = False):
+    """``query`` restricted to the rows after ``page.cursor``, ordered, with LIMIT page.limit + 1."""
+    if page.cursor:
+        values = decode_cursor(page.cursor, len(keys))
+        bound = tuple_(*keys) < tuple_(*values) if descending else tuple_(*keys) > tuple_(*values)
+        query = query.filter(bound)
+    order = [k.desc() if descending else k.asc() for k in keys]
+    return query.order_by(*order).limit(page.limit + 1)
+
+
+def paginate(query, keys: Sequence, page: PageParams, descending: bool = False) -> dict:
+    """Return one page of ``query`` ordered by ``keys`` (non-null columns, last one unique).
+
+    Rows must expose each key under the column's attribute name, which holds for ORM
+    entities and for column tuples selected without relabelling.
+    """
+    total, exact = query_total(query, page.total_mode) if page.with_total else (None, None)
+    rows = keyset(query, keys, page, descending).all()
+    next_cursor = None
+    if len(rows) > page.limit:
+        rows = rows[: page.limit]
+        next_cursor = encode_cursor([getattr(rows[-1], k.key) for k in keys])
+    return {"items": rows, "next": next_cursor, "total": total, "total_exact": exact}
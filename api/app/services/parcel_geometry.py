@@ -0,0 +1,132 @@
+"""Derived parcel geometries: simplified copies per zoom band, centroid and bbox.
+
+A BEFORE trigger fills the derived columns whenever ``parcels.geom`` is written
+with a different shape (create/update endpoints, CF imports, plain SQL), so
+viewport queries pick the stored resolution for the requested zoom instead of
+simplifying on every request.
+"""
+import json
+from typing import Optional, Tuple
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from models import Parcel
+
+# (first zoom that no longer uses the band, column, tolerance in degrees)
+GEOMETRY_BANDS = (
+    (10, "geom_z9", 0.001),
+    (13, "geom_z12", 0.0003),
+)
+BBOX_COLUMNS = ("bbox_min_lon", "bbox_min_lat", "bbox_max_lon", "bbox_max_lat")
+
+# Must stay textually equal to the ix_parcels_geom_geometry expression for the planner to match it.
+PARCEL_GEOMETRY = literal_column("parcels.geom::geometry")
+BBOX_INDEX = "ix_parcels_geom_geometry"
+
+
+def ensure_parcel_geometry(engine: Engine) -> None:
+    with engine.connect() as conn:
+        for _, column, _ in GEOMETRY_BANDS:
+            conn.exec_driver_sql(f"ALTER TABLE parcels ADD COLUMN IF NOT EXISTS {column} geometry(Geometry, 4326)")
+        conn.exec_driver_sql("ALTER TABLE parcels ADD COLUMN IF NOT EXISTS centroid geometry(Point, 4326)")
+        for column in BBOX_COLUMNS:
+            conn.exec_driver_sql(f"ALTER TABLE parcels ADD COLUMN IF NOT EXISTS {column} DOUBLE PRECISION")
+
+        derived = [column for _, column, _ in GEOMETRY_BANDS] + ["centroid", *BBOX_COLUMNS]
+        clear = "\n".join(f"                NEW.{column} := NULL;" for column in derived)
+        derive = "\n".join(
+            f"              NEW.{column} := ST_SimplifyPreserveTopology(g, {tolerance});"
+            for _, column, tolerance in GEOMETRY_BANDS
+        )
+        conn.exec_driver_sql(
+            f"""
+            CREATE OR REPLACE FUNCTION fn_parcel_geometry_derive() RETURNS trigger AS $$
+            DECLARE
+              g geometry;
+            BEGIN
+              IF TG_OP = 'UPDATE' AND NEW.centroid IS NOT NULL
+                 AND ST_AsEWKB(OLD.geom) IS NOT DISTINCT FROM ST_AsEWKB(NEW.geom) THEN
+                RETURN NEW;
+              END IF;
+              IF NEW.geom IS NULL THEN
+{clear}
+                RETURN NEW;
+              END IF;
+              g := NEW.geom::geometry;
+{derive}
+              NEW.centroid := ST_Centroid(g);
+              NEW.bbox_min_lon := ST_XMin(g);
+              NEW.bbox_min_lat := ST_YMin(g);
+              NEW.bbox_max_lon := ST_XMax(g);
+              NEW.bbox_max_lat := ST_YMax(g);
+              RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        )
+        conn.exec_driver_sql("DROP TRIGGER IF EXISTS trg_parcel_geometry_derive ON parcels")
+        conn.exec_driver_sql(
+            """
+            CREATE TRIGGER trg_parcel_geometry_derive BEFORE INSERT OR UPDATE OF geom ON parcels
+            FOR EACH ROW EXECUTE FUNCTION fn_parcel_geometry_derive()
+            """
+        )
+        # Existing rows (and rows written before the trigger existed) get their copies once.
+        # Checked first: the UPDATE bumps the parcels version (and drops every ETag and
+        # cached page) even when it matches nothing.
+        if conn.exec_driver_sql(
+            "SELECT EXISTS (SELECT 1 FROM parcels WHERE geom IS NOT NULL AND centroid IS NULL)"
+        ).scalar():
+            conn.exec_driver_sql("UPDATE parcels SET geom = geom WHERE geom IS NOT NULL AND centroid IS NULL")
+        conn.commit()
+
+
+def geometry_for_zoom(zoom: Optional[int]):
+    """The parcel geometry column to draw at ``zoom`` (full resolution when unknown)."""
+    if zoom is not None:
+        for max_zoom, column, _ in GEOMETRY_BANDS:
+            if zoom < max_zoom:
+                return getattr(Parcel, column)
+    return Parcel.geom
+
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    minx, miny, maxx, maxy = [float(x) for x in bbox.split(",")]
+    if minx > maxx or miny > maxy:
+        raise ValueError(bbox)
+    return minx, miny, maxx, maxy
+
+
+def bbox_hits(minx: float, miny: float, maxx: float, maxy: float):
+    """Ids of parcels intersecting the envelope, as a MATERIALIZED CTE.
+
+    Materializing keeps the planner from trading the GiST lookup for an id-ordered
+    scan with a filter (tempting because of the LIMIT): the CTE can only be
+    answered from the spatial index, and the page is sorted afterwards.
+    """
+    envelope = func.ST_MakeEnvelope(minx, miny, maxx, maxy, 4326)
+    return (
+        select(Parcel.id)
+        .where(func.ST_Intersects(PARCEL_GEOMETRY, envelope))
+        .cte("bbox_hits")
+        .prefix_with("MATERIALIZED")
+    )
+
+
+def explain_statement(db: Session, statement, analyze: bool = False) -> dict:
+    """Plan of ``statement`` under the session's planner settings; ``uses_index`` says whether
+    ix_parcels_geom_geometry is in it.
+
+    Run it on a table of production size: on a small one a sequential scan is
+    legitimately cheaper and the index will not show up.
+    """
+    compiled = statement.compile(dialect=db.get_bind().dialect)
+    options = "ANALYZE, FORMAT JSON" if analyze else "FORMAT JSON"
+    plan = db.connection().exec_driver_sql(f"EXPLAIN ({options}) {compiled}", compiled.params).scalar()
+    plan_json = json.dumps(plan)
+    return {"uses_index": BBOX_INDEX in plan_json, "plan": plan}
+
+
+def feature_bbox(row) -> Optional[list]:
+    values = [getattr(row, c) for c in BBOX_COLUMNS]
+    return values if None not in values else None
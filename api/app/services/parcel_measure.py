@@ -0,0 +1,102 @@
+"""Re-validation and re-measurement of stored parcels, one chunk at a time.
+
+Each chunk is read with one keyset query, repaired and measured with the ``geo``
+batch functions and written back with a single UPDATE ... FROM unnest(...) for
+the rows that actually changed. Chunks commit separately, so the job holds no
+long locks and can be interrupted and rerun.
+"""
+from typing import Callable, Optional
+import numpy as np
+import shapely
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from services import geo
+
+CHUNK = 1000
+# Stored areas closer than this to the recomputed one are left alone.
+AREA_TOLERANCE_M2 = 0.01
+
+
+def remeasure_parcels(
+    db: Session,
+    chunk: int = CHUNK,
+    dry_run: bool = False,
+    progress: Optional[Callable[[int, int], None]] = None,
+    after_id: int = 0,
+    max_chunks: Optional[int] = None,
+) -> dict:
+    """Repair invalid parcel geometries and recompute ``area_m2`` for parcels with id > ``after_id``.
+
+    With ``max_chunks`` the run stops early; ``last_id`` is where to resume and
+    ``done`` says whether the end of the table was reached.
+    """
+    total = db.execute(text("SELECT COUNT(*) FROM parcels WHERE geom IS NOT NULL")).scalar() if progress else None
+    summary = {"parcels": 0, "repaired": 0, "remeasured": 0, "failed": [], "last_id": after_id, "done": False}
+    after = after_id
+    chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        rows = db.execute(
+            text(
+                """
+                SELECT id, ST_AsBinary(geom), area_m2
+                FROM parcels
+                WHERE geom IS NOT NULL AND id > :after
+                ORDER BY id
+                LIMIT :chunk
+                """
+            ),
+            {"after": after, "chunk": chunk},
+        ).all()
+        if not rows:
+            summary["done"] = True
+            break
+        chunks += 1
+        after = summary["last_id"] = rows[-1][0]
+        summary["done"] = len(rows) < chunk
+        ids = np.array([r[0] for r in rows])
+        stored = np.array([r[2] if r[2] is not None else np.nan for r in rows], dtype=float)
+        polygons, reasons = geo.validate_polygons(shapely.from_wkb([bytes(r[1]) for r in rows]))
+
+        failed = shapely.is_missing(polygons)
+        repaired = np.array([r is not None for r in reasons]) & ~failed
+        areas = geo.areas_m2(polygons)
+        remeasured = ~failed & ~(np.abs(areas - stored) <= AREA_TOLERANCE_M2)
+        changed = repaired | remeasured
+
+        summary["parcels"] += len(rows)
+        summary["repaired"] += int(repaired.sum())
+        summary["remeasured"] += int(remeasured.sum())
+        summary["failed"].extend(
+            {"id": int(i), "reason": reason} for i, reason in zip(ids[failed].tolist(), reasons[failed].tolist())
+        )
+        if changed.any() and not dry_run:
+            ewkb = shapely.to_wkb(shapely.set_srid(polygons[changed], 4326), hex=True, include_srid=True)
+            db.execute(
+                text(
+                    """
+                    UPDATE parcels p
+                    SET area_m2 = v.area_m2,
+                        geom = CASE WHEN v.repaired THEN CAST(v.geom AS geography) ELSE p.geom END
+                    FROM unnest(
+                        CAST(:ids AS integer[]),
+                        CAST(:areas AS double precision[]),
+                        CAST(:geoms AS text[]),
+                        CAST(:repaired AS boolean[])
+                    ) AS v(id, area_m2, geom, repaired)
+                    WHERE p.id = v.id
+                    """
+                ),
+                {
+                    "ids": ids[changed].tolist(),
+                    "areas": areas[changed].tolist(),
+                    "geoms": ewkb.tolist(),
+                    "repaired": repaired[changed].tolist(),
+                },
+            )
+            db.commit()
+        if progress:
+            progress(summary["parcels"], total)
+        if summary["done"]:
+            break
+    db.rollback()
+    return summary
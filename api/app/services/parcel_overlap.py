@@ -0,0 +1,131 @@
+"""Overlap and sliver checks for parcel geometries before they are written.
+
+Candidates come from ix_parcels_geom_geometry (``&&`` on ``geom::geometry``), so
+only parcels whose bounding boxes touch the new shape are intersected. An
+intersection of at least OVERLAP_MIN_M2 is an overlap and blocks the write (it
+would double-count area in reports); anything smaller but non-zero is a sliver,
+usually digitizing noise along a shared border, and is only reported.
+
+Bulk mode checks a whole import batch against the table with one query and
+against itself with an STRtree, both near-linear in the batch size.
+
+Checks for a write take a transaction-level advisory lock first, so two
+transactions cannot both pass the check with overlapping shapes; it is held
+until the caller commits or rolls back.
+"""
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+import shapely
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from services import geo
+
+OVERLAP_MIN_M2 = 10.0
+# pg_advisory_xact_lock(ns, 0) serializes checked parcel writes; same scheme as STOCK_LOCK_NAMESPACE.
+PARCEL_LOCK_NAMESPACE = 7302
+
+CHECK_SQL = """
+    WITH v AS (
+        SELECT u.idx - 1 AS idx, CAST(u.ewkb AS geometry) AS g
+        FROM unnest(CAST(:geoms AS text[])) WITH ORDINALITY AS u(ewkb, idx)
+    )
+    SELECT v.idx, p.id, p.name, ST_Area(ST_Intersection(p.geom::geometry, v.g)::geography) AS overlap_m2
+    FROM v
+    -- Same expression as ix_parcels_geom_geometry.
+    JOIN parcels p ON p.geom::geometry && v.g AND ST_Intersects(p.geom::geometry, v.g)
+    WHERE CAST(:exclude_id AS integer) IS NULL OR p.id <> :exclude_id
+    ORDER BY v.idx, overlap_m2 DESC
+"""
+
+
+def kind(overlap_m2: float) -> str:
+    return "overlap" if overlap_m2 >= OVERLAP_MIN_M2 else "sliver"
+
+
+def blocking(conflicts: List[dict]) -> List[dict]:
+    return [c for c in conflicts if c["kind"] == "overlap"]
+
+
+def check_parcel(db: Session, geom, exclude_id: Optional[int] = None) -> List[dict]:
+    """Existing parcels intersecting ``geom`` (a shapely polygon in WGS84) with a non-zero area."""
+    return check_against_table(db, [geom], exclude_id=exclude_id)[0]
+
+
+def lock_parcel_writes(db: Session) -> None:
+    """Serialize overlap-checked parcel writes until the end of the current transaction."""
+    db.execute(text("SELECT pg_advisory_xact_lock(:ns, 0)"), {"ns": PARCEL_LOCK_NAMESPACE})
+
+
+def check_write(db: Session, geom, allow_overlap: bool = False, exclude_id: Optional[int] = None) -> List[dict]:
+    """``check_parcel`` for a create/update: 409 on a real overlap unless ``allow_overlap``.
+
+    Takes the parcel write lock, so the caller's insert/update is checked against
+    every parcel committed before it.
+    """
+    lock_parcel_writes(db)
+    conflicts = check_parcel(db, geom, exclude_id=exclude_id)
+    if blocking(conflicts) and not allow_overlap:
+        raise HTTPException(status_code=409, detail=conflict_detail(conflicts))
+    return conflicts
+
+
+def check_against_table(db: Session, geoms: Sequence, exclude_id: Optional[int] = None) -> List[List[dict]]:
+    """Conflicts with stored parcels for each geometry of a batch, in one query."""
+    geoms = np.asarray(geoms, dtype=object)
+    found: List[List[dict]] = [[] for _ in range(len(geoms))]
+    if not len(geoms):
+        return found
+    ewkb = shapely.to_wkb(shapely.set_srid(geoms, 4326), hex=True, include_srid=True)
+    for idx, parcel_id, name, overlap_m2 in db.execute(
+        text(CHECK_SQL), {"geoms": ewkb.tolist(), "exclude_id": exclude_id}
+    ):
+        if overlap_m2 and overlap_m2 > 0:
+            found[idx].append(
+                {"parcel_id": parcel_id, "name": name, "overlap_m2": float(overlap_m2), "kind": kind(overlap_m2)}
+            )
+    return found
+
+
+def check_within_batch(geoms: Sequence) -> List[List[dict]]:
+    """Conflicts between geometries of the same batch; each pair is reported on the later one."""
+    geoms = np.asarray(geoms, dtype=object)
+    found: List[List[dict]] = [[] for _ in range(len(geoms))]
+    if len(geoms) < 2:
+        return found
+    left, right = shapely.STRtree(geoms).query(geoms, predicate="intersects")
+    pairs = left < right
+    left, right = left[pairs], right[pairs]
+    if not len(left):
+        return found
+    areas = geo.areas_m2(shapely.intersection(geoms[left], geoms[right]))
+    for i, j, overlap_m2 in zip(left.tolist(), right.tolist(), areas.tolist()):
+        if overlap_m2 > 0:
+            found[j].append({"batch_index": i, "overlap_m2": overlap_m2, "kind": kind(overlap_m2)})
+    return found
+
+
+def check_batch(db: Session, geoms: Sequence) -> List[List[dict]]:
+    """Table and in-batch conflicts for every geometry of an import batch (takes the parcel write lock)."""
+    lock_parcel_writes(db)
+    table = check_against_table(db, geoms)
+    batch = check_within_batch(geoms)
+    return [t + b for t, b in zip(table, batch)]
+
+
+def resolve_batch(conflicts: List[List[dict]], allow_overlap: bool = False) -> np.ndarray:
+    """Entries of a checked batch to reject, decided in batch order.
+
+    A conflict with an earlier entry only counts if that entry is kept: in a chain
+    A∩B, B∩C with B rejected, C is imported. Conflicts with rejected entries are
+    removed from ``conflicts`` in place.
+    """
+    rejected = np.zeros(len(conflicts), dtype=bool)
+    for j, found in enumerate(conflicts):
+        found[:] = [c for c in found if "batch_index" not in c or not rejected[c["batch_index"]]]
+        rejected[j] = not allow_overlap and bool(blocking(found))
+    return rejected
+
+
+def conflict_detail(conflicts: List[dict]) -> Dict[str, object]:
+    return {"message": "Parcela se suprapune cu parcele existente", "conflicts": conflicts}
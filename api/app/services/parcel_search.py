@@ -0,0 +1,88 @@
+"""Fuzzy parcel search (names and CF numbers) on pg_trgm GIN indexes.
+
+Names are compared through ``f_unaccent`` so "campul de sus" finds "Câmpul de sus";
+pg_trgm itself ignores case. ``unaccent()`` is only STABLE, so an IMMUTABLE
+wrapper pinned to the default dictionary is what the expression index is built on.
+"""
+from typing import List
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+SEARCH_SQL = """
+    WITH candidates AS (
+        SELECT p.id
+        FROM parcels p
+        WHERE f_unaccent(p.name) % f_unaccent(:q)
+           OR f_unaccent(:q) <% f_unaccent(p.name)
+           OR f_unaccent(p.name) ILIKE f_unaccent(:like)
+        UNION
+        SELECT p.id
+        FROM cadastre_cf c
+        JOIN parcels p ON p.cf_id = c.id
+        WHERE c.cf_number % :q
+           OR c.cf_number ILIKE :like
+    )
+    SELECT p.id, p.name, p.cf_id, c.cf_number, p.area_m2, p.culture, p.status,
+           p.bbox_min_lon, p.bbox_min_lat, p.bbox_max_lon, p.bbox_max_lat,
+           ST_X(p.centroid) AS centroid_lon, ST_Y(p.centroid) AS centroid_lat,
+           GREATEST(
+               similarity(f_unaccent(p.name), f_unaccent(:q)),
+               word_similarity(f_unaccent(:q), f_unaccent(p.name)),
+               similarity(c.cf_number, :q)
+           ) AS score
+    FROM candidates x
+    JOIN parcels p ON p.id = x.id
+    JOIN cadastre_cf c ON c.id = p.cf_id
+    ORDER BY score DESC, p.id
+    LIMIT :limit
+"""
+
+
+def ensure_parcel_search(engine: Engine) -> None:
+    with engine.connect() as conn:
+        conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS unaccent")
+        conn.exec_driver_sql(
+            """
+            CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS $$
+              SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+            $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+            """
+        )
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_parcels_name_trgm ON parcels USING GIN (f_unaccent(name) gin_trgm_ops)"
+        )
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_cadastre_cf_number_trgm ON cadastre_cf USING GIN (cf_number gin_trgm_ops)"
+        )
+        conn.commit()
+
+
+def like_pattern(term: str) -> str:
+    """``%term%`` with LIKE wildcards in the user's text escaped."""
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def search_parcels(db: Session, q: str, limit: int = 10) -> List[dict]:
+    term = q.strip()
+    rows = db.execute(text(SEARCH_SQL), {"q": term, "like": like_pattern(term), "limit": limit}).mappings().all()
+    results = []
+    for r in rows:
+        bbox = [r["bbox_min_lon"], r["bbox_min_lat"], r["bbox_max_lon"], r["bbox_max_lat"]]
+        results.append(
+            {
+                "id": r["id"],
+                "name": r["name"],
+                "cf_id": r["cf_id"],
+                "cf_number": r["cf_number"],
+                "area_m2": r["area_m2"],
+                "culture": r["culture"],
+                "status": r["status"],
+                "score": round(float(r["score"]), 4),
+                "bbox": bbox if None not in bbox else None,
+                "centroid": [r["centroid_lon"], r["centroid_lat"]] if r["centroid_lon"] is not None else None,
+            }
+        )
+    return results
@@ -0,0 +1,68 @@
+"""Mapbox Vector Tiles for the parcel layer, rendered by PostGIS.
+
+Geometries are simplified in the database to about one screen pixel at the tile's
+zoom and clipped/quantized by ``ST_AsMVTGeom``, so a tile costs the same however
+many parcels the farm has. Rendered tiles are kept in an in-process LRU that is
+emptied whenever parcels or CFs change.
+"""
+import os
+from typing import Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from services.change_tracking import VersionedLRU
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+MAX_ZOOM = 22
+# Above this zoom parcels are drawn at full resolution.
+SIMPLIFY_MAX_ZOOM = 16
+WEB_MERCATOR_WORLD_M = 40075016.68557849
+
+_tiles = VersionedLRU(("parcels", "cadastre_cf"), maxsize=int(os.getenv("TILE_CACHE_SIZE", "2048")))
+
+TILE_SQL = """
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(:z, :x, :y) AS env_3857,
+               ST_Transform(ST_TileEnvelope(:z, :x, :y), 4326) AS env_4326
+    ),
+    features AS (
+        SELECT ST_AsMVTGeom(
+                   ST_SimplifyPreserveTopology(ST_Transform(p.geom::geometry, 3857), :tolerance),
+                   b.env_3857, :extent, :buffer, true
+               ) AS geom,
+               p.id, p.name, p.area_m2, p.culture, p.status, p.cf_id, c.cf_number
+        FROM parcels p
+        JOIN cadastre_cf c ON c.id = p.cf_id
+        CROSS JOIN bounds b
+        -- Same expression as ix_parcels_geom_geometry.
+        WHERE p.geom::geometry && b.env_4326
+    )
+    SELECT ST_AsMVT(features.*, 'parcels', :extent, 'geom')
+    FROM features
+    WHERE geom IS NOT NULL
+"""
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_tolerance(z: int) -> float:
+    """Simplification tolerance in metres: one 256px screen pixel at zoom ``z``."""
+    if z >= SIMPLIFY_MAX_ZOOM:
+        return 0.0
+    return WEB_MERCATOR_WORLD_M / (256 * 2 ** z)
+
+
+def render_tile(db: Session, z: int, x: int, y: int) -> bytes:
+    row = db.execute(
+        text(TILE_SQL),
+        {"z": z, "x": x, "y": y, "tolerance": tile_tolerance(z), "extent": MVT_EXTENT, "buffer": MVT_BUFFER},
+    ).scalar()
+    return bytes(row) if row is not None else b""
+
+
+def get_tile(db: Session, z: int, x: int, y: int, version: Optional[Tuple[int, ...]] = None) -> bytes:
+    """``version``: the parcels/cadastre_cf versions, when the caller already read them (ETag check)."""
+    return _tiles.get(db, (z, x, y), lambda session: render_tile(session, z, x, y), version=version)
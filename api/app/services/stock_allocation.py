@@ -0,0 +1,167 @@
+from datetime import date
+from typing import Dict, List, Sequence, Tuple
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+from models import InventoryTxn
+
+# Namespace for pg_advisory_xact_lock(ns, product_id); keeps stock locks apart from other advisory users.
+STOCK_LOCK_NAMESPACE = 7301
+
+FIFO_ORDER_SQL = "(l.expires_at IS NULL) ASC, l.expires_at ASC, l.received_date ASC, l.id ASC"
+
+Demand = Tuple[int, str]
+
+
+class StockShortage(Exception):
+    def __init__(self, product_id: int, uom: str, requested: float, available: float):
+        super().__init__(f"Stoc insuficient pentru produsul {product_id}")
+        self.product_id = product_id
+        self.uom = uom
+        self.requested = requested
+        self.available = available
+
+
+def lock_products(db: Session, product_ids) -> None:
+    """Serialize stock consumption per product until the end of the current transaction.
+
+    Locks are always taken in ascending product id order so two writers touching
+    overlapping product sets cannot deadlock.
+    """
+    for product_id in sorted(set(int(p) for p in product_ids)):
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(:ns, :product_id)"),
+            {"ns": STOCK_LOCK_NAMESPACE, "product_id": product_id},
+        )
+
+
+def load_available_lots(db: Session, product_ids) -> Dict[int, List[dict]]:
+    """Lots with a positive balance for the given products, in FIFO order."""
+    ids = sorted(set(int(p) for p in product_ids))
+    if not ids:
+        return {}
+    rows = db.execute(
+        text(
+            f"""
+            SELECT l.id AS lot_id, l.product_id, l.lot_code, l.expires_at, l.uom, l.unit_price, b.qty
+            FROM stock_lots l
+            JOIN lot_balances b ON b.lot_id = l.id
+            WHERE l.product_id = ANY(:product_ids)
+              AND b.qty > 0
+            ORDER BY l.product_id, {FIFO_ORDER_SQL}
+            """
+        ),
+        {"product_ids": ids},
+    ).mappings().all()
+    lots: Dict[int, List[dict]] = {pid: [] for pid in ids}
+    for r in rows:
+        lots[r["product_id"]].append(
+            {
+                "lot_id": r["lot_id"],
+                "lot_code": r["lot_code"],
+                "expires_at": r["expires_at"],
+                "uom": r["uom"],
+                "unit_price": float(r["unit_price"]) if r["unit_price"] is not None else None,
+                "qty": float(r["qty"]),
+            }
+        )
+    return lots
+
+
+def allocate_fifo(db: Session, demands: Dict[Demand, float], lock: bool = True) -> Dict[Demand, List[dict]]:
+    """Allocate each (product_id, uom) demand across lots, oldest expiry first.
+
+    With lock=True the products are advisory-locked before balances are read, so the
+    allocation stays valid until the caller commits. Raises StockShortage if any
+    demand cannot be covered; nothing is written either way.
+    """
+    product_ids = [pid for pid, _ in demands]
+    if lock:
+        lock_products(db, product_ids)
+    allocations, shortages = plan_fifo(load_available_lots(db, product_ids), demands)
+    if shortages:
+        raise shortages[0]
+    return allocations
+
+
+def plan_fifo(lots: Dict[int, List[dict]], demands: Dict[Demand, float]) -> Tuple[Dict[Demand, List[dict]], List[StockShortage]]:
+    """Pure FIFO pass over ``lots`` (consumed in place); short demands get what is there.
+
+    Returns the allocations and one StockShortage per demand that could not be covered.
+    """
+    allocations: Dict[Demand, List[dict]] = {}
+    shortages: List[StockShortage] = []
+    for (product_id, uom), qty in demands.items():
+        remaining = qty
+        picked = []
+        for lot in lots.get(product_id, []):
+            if remaining <= 0:
+                break
+            if lot["uom"] != uom or lot["qty"] <= 0:
+                continue
+            take = lot["qty"] if lot["qty"] < remaining else remaining
+            picked.append(
+                {
+                    "lot_id": lot["lot_id"],
+                    "lot_code": lot.get("lot_code"),
+                    "expires_at": lot.get("expires_at"),
+                    "qty": take,
+                    "uom": uom,
+                    "unit_price": lot["unit_price"],
+                }
+            )
+            # Two demands for the same product must not draw the same stock twice.
+            lot["qty"] -= take
+            remaining -= take
+        if remaining > 1e-9:
+            shortages.append(StockShortage(product_id, uom, qty, qty - remaining))
+        allocations[(product_id, uom)] = picked
+    return allocations, shortages
+
+
+def split_allocation(picked: List[dict], amounts: Sequence[float]) -> List[List[dict]]:
+    """Cut one allocation into consecutive shares of ``amounts``, in order.
+
+    Each share draws from the lots exactly as separate allocations made one after
+    the other would; the last share takes whatever is left.
+    """
+    lots = [dict(a) for a in picked]
+    shares = []
+    i = 0
+    for n, amount in enumerate(amounts):
+        last = n == len(amounts) - 1
+        remaining = amount
+        share = []
+        while i < len(lots) and (last or remaining > 1e-9):
+            lot = lots[i]
+            take = lot["qty"] if last or lot["qty"] <= remaining else remaining
+            share.append({**lot, "qty": take})
+            lot["qty"] -= take
+            remaining -= take
+            if lot["qty"] <= 1e-9:
+                i += 1
+        shares.append(share)
+    return shares
+
+
+def insert_out_txns(db: Session, allocations: List[dict], txn_date: date, **fields) -> None:
+    """Write one 'out' txn per allocation with a single multi-row insert.
+
+    ``fields`` (reason, ref_id, doc_id, ...) apply to every row; an allocation that
+    carries its own ``ref_id`` overrides it.
+    """
+    if not allocations:
+        return
+    rows = []
+    for a in allocations:
+        row = {
+            **fields,
+            "lot_id": a["lot_id"],
+            "movement": "out",
+            "qty": a["qty"],
+            "uom": a["uom"],
+            "date": txn_date,
+        }
+        if "ref_id" in a:
+            row["ref_id"] = a["ref_id"]
+        rows.append(row)
+    db.execute(insert(InventoryTxn), rows)
@@ -0,0 +1,234 @@
+"""Per-lot stock snapshots at period ends ("stock as of date" without full replay).
+
+A snapshot stores the balance of every lot with non-zero stock at the end of
+``as_of``. A historical query starts from the closest snapshot on or before the
+requested date and adds only the txns dated after it. Txns back-dated into an
+already snapshotted period are folded into the affected snapshots by a trigger,
+in the same transaction as the txn itself.
+"""
+import os
+from datetime import date, timedelta
+from typing import List, Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from services.db_migrate import lock_ensure
+from services.lot_balances import SIGNED_QTY_SQL
+
+SNAPSHOT_PERIODS = {"month", "quarter", "year"}
+SNAPSHOT_PERIOD = os.getenv("STOCK_SNAPSHOT_PERIOD", "month")
+
+
+def ensure_stock_snapshots(engine: Engine) -> None:
+    with engine.connect() as conn:
+        lock_ensure(conn, "stock_snapshots")
+        conn.exec_driver_sql(
+            """
+            CREATE OR REPLACE FUNCTION fn_stock_snapshots_patch() RETURNS trigger AS $$
+            BEGIN
+              IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO stock_snapshot_lots (snapshot_id, lot_id, qty)
+                SELECT s.id, o.lot_id, -SUM(CASE WHEN o.movement = 'out' THEN -o.qty ELSE o.qty END)
+                FROM old_rows o
+                JOIN stock_snapshots s ON s.as_of >= o.date
+                GROUP BY s.id, o.lot_id
+                ORDER BY 1, 2
+                ON CONFLICT (snapshot_id, lot_id) DO UPDATE
+                SET qty = stock_snapshot_lots.qty + EXCLUDED.qty;
+              END IF;
+              IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO stock_snapshot_lots (snapshot_id, lot_id, qty)
+                SELECT s.id, n.lot_id, SUM(CASE WHEN n.movement = 'out' THEN -n.qty ELSE n.qty END)
+                FROM new_rows n
+                JOIN stock_snapshots s ON s.as_of >= n.date
+                GROUP BY s.id, n.lot_id
+                ORDER BY 1, 2
+                ON CONFLICT (snapshot_id, lot_id) DO UPDATE
+                SET qty = stock_snapshot_lots.qty + EXCLUDED.qty;
+              END IF;
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        )
+        conn.exec_driver_sql("DROP TRIGGER IF EXISTS trg_stock_snapshots_ins ON inventory_txns")
+        conn.exec_driver_sql("DROP TRIGGER IF EXISTS trg_stock_snapshots_upd ON inventory_txns")
+        conn.exec_driver_sql("DROP TRIGGER IF EXISTS trg_stock_snapshots_del ON inventory_txns")
+        conn.exec_driver_sql(
+            """
+            CREATE TRIGGER trg_stock_snapshots_ins AFTER INSERT ON inventory_txns
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION fn_stock_snapshots_patch()
+            """
+        )
+        conn.exec_driver_sql(
+            """
+            CREATE TRIGGER trg_stock_snapshots_upd AFTER UPDATE ON inventory_txns
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION fn_stock_snapshots_patch()
+            """
+        )
+        conn.exec_driver_sql(
+            """
+            CREATE TRIGGER trg_stock_snapshots_del AFTER DELETE ON inventory_txns
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION fn_stock_snapshots_patch()
+            """
+        )
+        conn.commit()
+
+
+def period_end(day: date, period: str = SNAPSHOT_PERIOD) -> date:
+    """Last day of the month/quarter/year containing ``day``."""
+    if period not in SNAPSHOT_PERIODS:
+        raise ValueError(period)
+    if period == "year":
+        return date(day.year, 12, 31)
+    month = day.month if period == "month" else ((day.month - 1) // 3 + 1) * 3
+    first_of_next = date(day.year + month // 12, month % 12 + 1, 1)
+    return first_of_next - timedelta(days=1)
+
+
+def checkpoint_dates(start: date, end: date, period: str = SNAPSHOT_PERIOD) -> List[date]:
+    """Period ends between ``start`` and ``end`` inclusive."""
+    dates = []
+    current = period_end(start, period)
+    while current <= end:
+        dates.append(current)
+        current = period_end(current + timedelta(days=1), period)
+    return dates
+
+
+def write_snapshot(db: Session, as_of: date) -> dict:
+    """(Re)write the snapshot for ``as_of``, building on the previous snapshot. The caller commits."""
+    # Keep txn writers out while the snapshot is assembled; readers are unaffected.
+    db.execute(text("LOCK TABLE inventory_txns IN SHARE MODE"))
+    # SHARE does not conflict with itself: two checkpoint runs would both insert ``as_of``.
+    lock_ensure(db, "stock_snapshots")
+    db.execute(text("DELETE FROM stock_snapshots WHERE as_of = :as_of"), {"as_of": as_of})
+    prev = _nearest_snapshot(db, as_of)
+    snapshot_id = db.execute(
+        text("INSERT INTO stock_snapshots (as_of, created_at) VALUES (:as_of, NOW()) RETURNING id"),
+        {"as_of": as_of},
+    ).scalar()
+    result = db.execute(
+        text(
+            f"""
+            INSERT INTO stock_snapshot_lots (snapshot_id, lot_id, qty)
+            SELECT :snapshot_id, lot_id, SUM(qty)
+            FROM (
+                SELECT lot_id, qty FROM stock_snapshot_lots WHERE snapshot_id = :prev_id
+                UNION ALL
+                SELECT lot_id, {SIGNED_QTY_SQL}
+                FROM inventory_txns
+                WHERE (CAST(:prev_date AS date) IS NULL OR date > :prev_date)
+                  AND date <= :as_of
+            ) x
+            GROUP BY lot_id
+            HAVING ABS(SUM(qty)) > 1e-9
+            """
+        ),
+        {
+            "snapshot_id": snapshot_id,
+            "prev_id": prev["id"] if prev else None,
+            "prev_date": prev["as_of"] if prev else None,
+            "as_of": as_of,
+        },
+    )
+    return {"id": snapshot_id, "as_of": as_of, "lots": result.rowcount}
+
+
+def ensure_checkpoints(db: Session, up_to: Optional[date] = None, period: str = SNAPSHOT_PERIOD) -> List[dict]:
+    """Write the missing snapshots for every closed period up to ``up_to`` (default: yesterday)."""
+    up_to = up_to or date.today() - timedelta(days=1)
+    first_txn = db.execute(text("SELECT MIN(date) FROM inventory_txns")).scalar()
+    if not first_txn:
+        return []
+    existing = {r[0] for r in db.execute(text("SELECT as_of FROM stock_snapshots")).all()}
+    written = []
+    for as_of in checkpoint_dates(first_txn, up_to, period):
+        if as_of in existing:
+            continue
+        # Each checkpoint builds on the previous one, so commit as we go.
+        written.append(write_snapshot(db, as_of))
+        db.commit()
+    return written
+
+
+def stock_as_of(
+    db: Session,
+    as_of: date,
+    product_id: Optional[int] = None,
+    location_id: Optional[int] = None,
+) -> dict:
+    snapshot = _nearest_snapshot(db, as_of, inclusive=True)
+    rows = db.execute(
+        text(
+            f"""
+            WITH base AS (
+                SELECT lot_id, qty FROM stock_snapshot_lots WHERE snapshot_id = :snapshot_id
+            ),
+            delta AS (
+                SELECT lot_id, SUM({SIGNED_QTY_SQL}) AS qty
+                FROM inventory_txns
+                WHERE (CAST(:snapshot_date AS date) IS NULL OR date > :snapshot_date)
+                  AND date <= :as_of
+                GROUP BY lot_id
+            )
+            SELECT l.id AS lot_id,
+                   l.product_id,
+                   l.location_id,
+                   l.lot_code,
+                   l.expires_at,
+                   l.uom,
+                   l.unit_price,
+                   COALESCE(b.qty, 0) + COALESCE(d.qty, 0) AS qty
+            FROM base b
+            FULL JOIN delta d ON d.lot_id = b.lot_id
+            JOIN stock_lots l ON l.id = COALESCE(b.lot_id, d.lot_id)
+            WHERE (:product_id IS NULL OR l.product_id = :product_id)
+              AND (:location_id IS NULL OR l.location_id = :location_id)
+              AND ABS(COALESCE(b.qty, 0) + COALESCE(d.qty, 0)) > 1e-9
+            ORDER BY l.product_id, l.id
+            """
+        ),
+        {
+            "snapshot_id": snapshot["id"] if snapshot else None,
+            "snapshot_date": snapshot["as_of"] if snapshot else None,
+            "as_of": as_of,
+            "product_id": product_id,
+            "location_id": location_id,
+        },
+    ).mappings().all()
+    lots = []
+    for r in rows:
+        qty = float(r["qty"])
+        unit_price = float(r["unit_price"]) if r["unit_price"] is not None else None
+        lots.append(
+            {
+                "lot_id": r["lot_id"],
+                "product_id": r["product_id"],
+                "location_id": r["location_id"],
+                "lot_code": r["lot_code"],
+                "expires_at": r["expires_at"],
+                "uom": r["uom"],
+                "unit_price": unit_price,
+                "qty": qty,
+                "value": qty * (unit_price or 0),
+            }
+        )
+    return {
+        "as_of": as_of,
+        "snapshot_as_of": snapshot["as_of"] if snapshot else None,
+        "lots": lots,
+        "total_value": sum(l["value"] for l in lots),
+    }
+
+
+def _nearest_snapshot(db: Session, as_of: date, inclusive: bool = False) -> Optional[dict]:
+    op = "<=" if inclusive else "<"
+    row = db.execute(
+        text(f"SELECT id, as_of FROM stock_snapshots WHERE as_of {op} :as_of ORDER BY as_of DESC LIMIT 1"),
+        {"as_of": as_of},
+    ).mappings().first()
+    return dict(row) if row else None
@@ -1,5 +1,6 @@
 import os
 import uuid
+from typing import IO
 import boto3
 from botocore.client import Config
 
@@ -31,3 +32,11 @@ def save_doc(file_bytes: bytes, filename: str, content_type: str = "application/
     client = _client()
     client.put_object(Bucket=MINIO_BUCKET_DOCS, Key=key, Body=file_bytes, ContentType=content_type)
     return key
+
+
+def save_doc_fileobj(fileobj: IO[bytes], filename: str, content_type: str = "application/octet-stream") -> str:
+    """``save_doc`` for a file object, uploaded in parts without reading it into memory."""
+    key = f"docs/{uuid.uuid4().hex}_{filename}"
+    client = _client()
+    client.upload_fileobj(fileobj, MINIO_BUCKET_DOCS, key, ExtraArgs={"ContentType": content_type})
+    return key
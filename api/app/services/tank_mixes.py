@@ -0,0 +1,54 @@
+"""Tank-mix catalog, cached in-process.
+
+Mixes are written once and then only read (mix list, every application post), so
+the whole catalog is loaded with one grouped query and kept until ``tank_mixes``
+or ``tank_mix_items`` change.
+"""
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from services.change_tracking import VersionedCache
+
+
+def _load_catalog(db: Session) -> dict:
+    rows = db.execute(
+        text(
+            """
+            SELECT m.id, m.name, m.water_ph, m.water_hardness_ppm, m.notes,
+                   COALESCE(
+                       json_agg(
+                           json_build_object('product_id', i.product_id, 'dose_per_ha', i.dose_per_ha, 'uom', i.uom)
+                           ORDER BY i.id
+                       ) FILTER (WHERE i.id IS NOT NULL),
+                       '[]'::json
+                   ) AS items
+            FROM tank_mixes m
+            LEFT JOIN tank_mix_items i ON i.mix_id = m.id
+            GROUP BY m.id
+            ORDER BY m.created_at DESC, m.id DESC
+            """
+        )
+    ).mappings().all()
+    mixes = [dict(r) for r in rows]
+    return {"list": mixes, "by_id": {m["id"]: m for m in mixes}}
+
+
+_catalog = VersionedCache(("tank_mixes", "tank_mix_items"), _load_catalog)
+
+
+def list_mixes(db: Session) -> List[dict]:
+    return _catalog.get(db)["list"]
+
+
+def get_mix(db: Session, mix_id: int) -> Optional[dict]:
+    return _catalog.get(db)["by_id"].get(mix_id)
+
+
+def mix_items(db: Session, mix_id: int) -> List[Dict]:
+    mix = get_mix(db, mix_id)
+    return [dict(i) for i in mix["items"]] if mix else []
+
+
+def invalidate() -> None:
+    """Drop this process's copy at once; other processes notice the version bump."""
+    _catalog.clear()
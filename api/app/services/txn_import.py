@@ -0,0 +1,315 @@
+"""Bulk import of inventory txns from CSV/XLSX (physical counts, ERP migrations).
+
+The file is read one row at a time and every row is checked against an in-memory
+index of the lots, so validation costs no queries. A first pass only collects the
+lots the file touches, so their products can be locked (same locks as the
+allocation code) and their balances read; the second pass replays the rows in
+file order against those balances and loads the accepted ones with COPY every
+COPY_CHUNK rows. Memory stays bounded by the lot index, not by the file: at most
+ERROR_LIMIT rejected rows are kept for the error report, the rest are counted.
+"""
+import csv
+import io
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from services import chem_parse, chem_units, stock_allocation
+
+MOVEMENTS = {"in", "out", "adjust"}
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y")
+REPORT_SAMPLE = 100
+ERROR_LIMIT = 10000
+ERROR_CELL_MAX = 200
+COPY_CHUNK = 5000
+
+COPY_SQL = (
+    "COPY inventory_txns (lot_id, movement, qty, uom, date, reason, ref_type, doc_id, created_by, notes, created_at) "
+    "FROM STDIN WITH (FORMAT csv)"
+)
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class RowError(ValueError):
+    pass
+
+
+@dataclass
+class LotIndex:
+    by_id: Dict[int, Tuple[int, str]] = field(default_factory=dict)
+    by_code: Dict[str, List[int]] = field(default_factory=dict)
+
+    def resolve(self, lot_id: Optional[int], lot_code: Optional[str], product_id: Optional[int]) -> int:
+        if lot_id is not None:
+            if lot_id not in self.by_id:
+                raise RowError("Lotul nu exista")
+            return lot_id
+        if not lot_code:
+            raise RowError("lot_id sau lot_code este obligatoriu")
+        candidates = self.by_code.get(_code_key(lot_code), [])
+        if product_id is not None:
+            candidates = [c for c in candidates if self.by_id[c][0] == product_id]
+        if not candidates:
+            raise RowError("Lotul nu exista")
+        if len(candidates) > 1:
+            raise RowError("Codul de lot este ambiguu; completati product_id sau lot_id")
+        return candidates[0]
+
+
+def build_lot_index(db: Session) -> LotIndex:
+    index = LotIndex()
+    for lot_id, lot_code, product_id, uom in db.execute(
+        text("SELECT id, lot_code, product_id, uom FROM stock_lots")
+    ):
+        index.by_id[lot_id] = (product_id, uom)
+        index.by_code.setdefault(_code_key(lot_code), []).append(lot_id)
+    return index
+
+
+def iter_rows(fileobj: IO[bytes], filename: str) -> Iterator[Tuple[int, dict]]:
+    """Yield (line number, {column: value}) without loading the whole sheet."""
+    name = (filename or "").lower()
+    if name.endswith(".xlsx"):
+        yield from _iter_xlsx(fileobj)
+    elif name.endswith(".csv"):
+        yield from _iter_csv(fileobj)
+    else:
+        raise ImportFormatError("Fisierul trebuie sa fie CSV sau XLSX")
+
+
+def parse_row(row: dict, index: LotIndex) -> tuple:
+    movement = (_str(row.get("movement")) or "").lower()
+    if movement not in MOVEMENTS:
+        raise RowError("Movement invalid")
+    qty = _float(row.get("qty"))
+    if qty is None:
+        raise RowError("Cantitatea lipseste")
+    if movement != "adjust" and qty <= 0:
+        raise RowError("Cantitatea trebuie sa fie > 0")
+    uom = chem_units.normalize_uom(_str(row.get("uom")) or "")
+    if uom not in chem_units.ALLOWED_UOM:
+        raise RowError("Unitatea trebuie sa fie l sau kg")
+    txn_date = _date(row.get("date"))
+    lot_id = index.resolve(_int(row.get("lot_id")), _str(row.get("lot_code")), _int(row.get("product_id")))
+    if index.by_id[lot_id][1] != uom:
+        raise RowError("Unitatea nu corespunde lotului")
+    return lot_id, movement, qty, uom, txn_date, _str(row.get("reason")), _str(row.get("notes"))
+
+
+def import_txns(
+    db: Session,
+    fileobj: IO[bytes],
+    filename: str,
+    doc_id: Optional[int] = None,
+    created_by: Optional[int] = None,
+    dry_run: bool = False,
+) -> dict:
+    """Validate and load the file (seekable, read twice). The caller commits (or rolls back for a dry run)."""
+    index = build_lot_index(db)
+    lot_ids = set()
+    for _, row in iter_rows(fileobj, filename):
+        try:
+            lot_ids.add(parse_row(row, index)[0])
+        except RowError:
+            pass
+    fileobj.seek(0)
+    balances = _lock_balances(db, index, sorted(lot_ids)) if lot_ids else {}
+
+    result = {"rows": 0, "imported": 0, "rejected": 0, "errors": [], "columns": []}
+    pending: List[tuple] = []
+    for line, row in iter_rows(fileobj, filename):
+        result["rows"] += 1
+        if not result["columns"]:
+            result["columns"] = list(row)
+        try:
+            parsed = parse_row(row, index)
+            _apply_balance(balances, parsed)
+        except RowError as exc:
+            _reject(result, line, str(exc), row)
+            continue
+        result["imported"] += 1
+        if not dry_run:
+            pending.append(parsed)
+            if len(pending) >= COPY_CHUNK:
+                _copy_txns(db, pending, doc_id, created_by)
+                pending.clear()
+    if pending:
+        _copy_txns(db, pending, doc_id, created_by)
+    return result
+
+
+def error_report_csv(result: dict) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["line", "error", *result["columns"]])
+    for err in result["errors"]:
+        writer.writerow([err["line"], err["error"], *(_cell(err["row"].get(c)) for c in result["columns"])])
+    unlisted = result["rejected"] - len(result["errors"])
+    if unlisted:
+        writer.writerow(["", f"Inca {unlisted} randuri respinse nelistate"])
+    # BOM so Excel opens the UTF-8 file with diacritics intact.
+    return b"\xef\xbb\xbf" + out.getvalue().encode("utf-8")
+
+
+def _reject(result: dict, line: int, error: str, row: dict) -> None:
+    result["rejected"] += 1
+    if len(result["errors"]) < ERROR_LIMIT:
+        row = {k: _truncate(v) for k, v in row.items()}
+        result["errors"].append({"line": line, "error": error, "row": row})
+
+
+def _lock_balances(db: Session, index: LotIndex, lot_ids: List[int]) -> Dict[int, float]:
+    """Current balances of ``lot_ids``, read after locking their products."""
+    stock_allocation.lock_products(db, sorted({index.by_id[lot_id][0] for lot_id in lot_ids}))
+    return dict(
+        db.execute(
+            text("SELECT lot_id, qty FROM lot_balances WHERE lot_id = ANY(:lot_ids)"), {"lot_ids": lot_ids}
+        ).all()
+    )
+
+
+def _apply_balance(balances: Dict[int, float], parsed: tuple) -> None:
+    """Move the running balance of the row's lot; an 'out' that overdraws it is rejected."""
+    lot_id, movement, qty = parsed[0], parsed[1], parsed[2]
+    current = balances.get(lot_id, 0.0)
+    if movement == "out":
+        if current < qty - 1e-9:
+            raise RowError("Stoc insuficient in lot")
+        current -= qty
+    else:
+        current += qty
+    balances[lot_id] = current
+
+
+def _copy_txns(db: Session, rows: List[tuple], doc_id: Optional[int], created_by: Optional[int]) -> None:
+    created_at = datetime.utcnow().isoformat()
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for lot_id, movement, qty, uom, txn_date, reason, notes in rows:
+        writer.writerow(
+            [lot_id, movement, qty, uom, txn_date.isoformat(), reason or "import", "import", doc_id, created_by, notes, created_at]
+        )
+    buf.seek(0)
+    # COPY runs on the session's own connection, inside its transaction; the
+    # statement-level triggers on inventory_txns see one insert per chunk.
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(COPY_SQL, buf)
+    finally:
+        cursor.close()
+
+
+def _iter_csv(fileobj: IO[bytes]) -> Iterator[Tuple[int, dict]]:
+    stream = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    try:
+        sample = stream.read(4096)
+        stream.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(stream, dialect)
+        header = _header(next(reader, None))
+        for values in reader:
+            if any(v.strip() for v in values):
+                yield reader.line_num, dict(zip(header, values))
+    except UnicodeDecodeError:
+        raise ImportFormatError("Fisierul CSV trebuie sa fie UTF-8")
+    finally:
+        stream.detach()
+
+
+def _iter_xlsx(fileobj: IO[bytes]) -> Iterator[Tuple[int, dict]]:
+    from openpyxl import load_workbook
+
+    try:
+        wb = load_workbook(fileobj, read_only=True, data_only=True)
+    except Exception:
+        raise ImportFormatError("Fisier XLSX invalid")
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = _header(next(rows, None))
+        for line, values in enumerate(rows, start=2):
+            if any(v not in (None, "") for v in values):
+                yield line, dict(zip(header, values))
+    finally:
+        wb.close()
+
+
+def _header(values) -> List[str]:
+    if not values:
+        raise ImportFormatError("Fisierul nu are antet")
+    header = [chem_parse.normalize_text(str(v or "")).replace(" ", "_") for v in values]
+    if "movement" not in header or "qty" not in header:
+        raise ImportFormatError("Antetul trebuie sa contina cel putin movement si qty")
+    return header
+
+
+def _code_key(code: str) -> str:
+    return str(code).strip().upper()
+
+
+def _str(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _float(value) -> Optional[float]:
+    if value is None or isinstance(value, float):
+        return value
+    if isinstance(value, int):
+        return float(value)
+    raw = str(value).strip().replace(" ", "").replace(",", ".")
+    if not raw:
+        return None
+    try:
+        return float(raw)
+    except ValueError:
+        raise RowError("Cantitate invalida")
+
+
+def _int(value) -> Optional[int]:
+    raw = _str(value)
+    if raw is None:
+        return None
+    try:
+        number = float(raw)
+    except ValueError:
+        raise RowError("Identificator invalid")
+    if not number.is_integer():
+        raise RowError("Identificator invalid")
+    return int(number)
+
+
+def _date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    raw = _str(value)
+    if not raw:
+        raise RowError("Data lipseste")
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(raw[:10], fmt).date()
+        except ValueError:
+            continue
+    raise RowError("Data invalida")
+
+
+def _truncate(value):
+    if isinstance(value, str) and len(value) > ERROR_CELL_MAX:
+        return value[:ERROR_CELL_MAX] + "…"
+    return value
+
+
+def _cell(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return "" if value is None else value
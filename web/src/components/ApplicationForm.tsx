@@ -64,7 +64,7 @@ export default function ApplicationForm({ parcelId }: ApplicationFormProps) {
     ]);
     setMixes(mixRes.data || []);
     setProducts((prodRes.data || []).filter((p: Product) => p.product_type === "herbicide"));
-    setApps(appRes.data || []);
+    setApps(appRes.data.items || []);
   };
 
   useEffect(() => {
@@ -38,10 +38,10 @@ export default function CropHistory({ parcelId }: CropHistoryProps) {
   };
 
   const loadCatalog = async () => {
-    const cropsRes = await api.get("/catalog/crops");
-    const varRes = await api.get("/catalog/varieties");
-    setCrops(cropsRes.data || []);
-    setVarieties(varRes.data || []);
+    const cropsRes = await api.get("/catalog/crops", { params: { limit: 1000 } });
+    const varRes = await api.get("/catalog/varieties", { params: { limit: 1000 } });
+    setCrops(cropsRes.data.items || []);
+    setVarieties(varRes.data.items || []);
   };
 
   useEffect(() => {
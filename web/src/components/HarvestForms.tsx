@@ -23,9 +23,8 @@ export default function HarvestForms({ parcelId }: HarvestFormsProps) {
   const [ticketResult, setTicketResult] = useState<any>(null);
 
   const load = async () => {
-    const res = await api.get("/harvests");
-    const all = res.data || [];
-    setItems(all.filter((h: Harvest) => h.parcel_id === parcelId));
+    const res = await api.get("/harvests", { params: { parcel_id: parcelId } });
+    setItems(res.data.items || []);
   };
 
   useEffect(() => {
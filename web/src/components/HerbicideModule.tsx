@@ -109,8 +109,8 @@ export default function HerbicideModule() {
     setProducts(pRes.data || []);
     setActives(aRes.data || []);
     setLots(lRes.data || []);
-    setTxns(tRes.data || []);
-    setApplications(appRes.data || []);
+    setTxns(tRes.data.items || []);
+    setApplications(appRes.data.items || []);
     try {
       const parcelRes = await api.get("/parcels");
       const items = parcelRes.data.items || parcelRes.data || [];
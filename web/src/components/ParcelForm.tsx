@@ -24,11 +24,11 @@ export default function ParcelForm({ parcel, onParcelUpdated }: ParcelFormProps)
   useEffect(() => {
     const loadReport = async () => {
       const [worksRes, harvestRes] = await Promise.all([
-        api.get(`/parcels/${parcel.id}/works`),
-        api.get("/harvests")
+        api.get(`/parcels/${parcel.id}/works`, { params: { limit: 1000 } }),
+        api.get("/harvests", { params: { parcel_id: parcel.id, limit: 1000 } })
       ]);
       const works = worksRes.data.items || [];
-      const harvests = (harvestRes.data || []).filter((h: any) => h.parcel_id === parcel.id);
+      const harvests = harvestRes.data.items || [];
       const totalCost = works.reduce((sum: number, w: any) => sum + (w.cost_total || 0), 0);
       const areaHa = (parcel.area_m2 || 0) / 10000;
       setCostPerHa(areaHa > 0 ? totalCost / areaHa : null);
@@ -28,9 +28,8 @@ export default function SoilForm({ parcelId }: SoilFormProps) {
   });
 
   const load = async () => {
-    const res = await api.get("/soil-analyses");
-    const all = res.data || [];
-    setItems(all.filter((s: Soil) => s.parcel_id === parcelId));
+    const res = await api.get("/soil-analyses", { params: { parcel_id: parcelId } });
+    setItems(res.data.items || []);
   };
 
   useEffect(() => {